@@ -0,0 +1,167 @@
+"""
+Inbound admission: per-user rate limits, request dedup, supersession and load shedding
+"""
+import asyncio
+import functools
+import time
+from typing import Any, Awaitable, Callable, Dict, Set, Tuple
+from metrics import metrics
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Refills continuously at rate tokens per second up to capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "warned")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Whether the user has been told they are throttled since the last admit
+        self.warned = False
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class AdmissionController:
+    """
+    Guards handlers with a token bucket per user and runs crew work so that
+    identical in-flight requests are not repeated, a user's newer request
+    of the same kind cancels the older one, and new work is shed once too
+    much is pending. Blocking work started through offload keeps its slot
+    after its request is superseded, until the worker thread returns.
+    """
+
+    def __init__(self, rate_per_minute: float = None, burst: int = None,
+                 max_pending: int = None):
+        self.rate = (rate_per_minute or config.USER_RATE_PER_MINUTE) / 60.0
+        self.burst = burst or config.USER_BURST
+        self.max_pending = max_pending or config.MAX_PENDING_CREWS
+        self.pending = 0
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._running: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._keys: Set[Tuple[str, str]] = set()
+        self._superseded: Set[asyncio.Task] = set()
+        self._threads: Dict[asyncio.Task, Set[asyncio.Future]] = {}
+
+    def allow(self, user_id: str) -> bool:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._prune()
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        if bucket.take():
+            bucket.warned = False
+            return True
+        return False
+
+    def _prune(self):
+        now = time.monotonic()
+        for user_id in [u for u, b in self._buckets.items() if b.idle(now)]:
+            del self._buckets[user_id]
+
+    def guard(self, handler: Callable[..., Awaitable[Any]]):
+        """Wrap a telegram handler so throttled updates never reach it"""
+        @functools.wraps(handler)
+        async def guarded(update, context):
+            user = update.effective_user
+            if user is None or self.allow(str(user.id)):
+                return await handler(update, context)
+
+            metrics.increment("admission.throttled")
+            bucket = self._buckets[str(user.id)]
+            if update.callback_query:
+                await update.callback_query.answer("Too many requests, please slow down.")
+            elif not bucket.warned and update.effective_message:
+                # One notice per burst, so the replies can't become a flood themselves
+                bucket.warned = True
+                await update.effective_message.reply_text(
+                    "⏳ You're sending requests faster than I can handle. "
+                    "Please wait a few seconds."
+                )
+        return guarded
+
+    async def offload(self, func: Callable[..., Any], *args) -> Any:
+        """
+        asyncio.to_thread for work started under run. Cancelling the request
+        can't stop the thread, so the thread is tracked against the request
+        and its pending slot is held until it finishes.
+        """
+        future = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        owner = asyncio.current_task()
+        if owner in self._threads:
+            threads = self._threads[owner]
+            threads.add(future)
+            future.add_done_callback(threads.discard)
+        return await asyncio.shield(future)
+
+    def _release_after(self, threads: Set[asyncio.Future]):
+        """Free a superseded request's slot once its last thread returns"""
+        remaining = {f for f in threads if not f.done()}
+        if not remaining:
+            self.pending -= 1
+            return
+        metrics.increment("admission.orphaned_threads", len(remaining))
+
+        def done(future: asyncio.Future):
+            remaining.discard(future)
+            if not remaining:
+                self.pending -= 1
+        for future in remaining:
+            future.add_done_callback(done)
+
+    async def run(self, user_id: str, kind: str, key: str,
+                  work: Callable[[], Awaitable[Any]]) -> Tuple[str, Any]:
+        """
+        Run work and return (status, result). status is "ok", "duplicate"
+        when the same request is already in flight, "shed" under overload,
+        or "superseded" when a newer request of the same kind replaced it.
+        """
+        if (user_id, key) in self._keys:
+            metrics.increment("admission.duplicates")
+            return "duplicate", None
+        if self.pending >= self.max_pending:
+            metrics.increment("admission.shed")
+            logger.warning(f"Shedding {kind} for {user_id}: {self.pending} pending")
+            return "shed", None
+
+        previous = self._running.get((user_id, kind))
+        if previous and not previous.done():
+            self._superseded.add(previous)
+            previous.cancel()
+            metrics.increment("admission.superseded")
+
+        task = asyncio.ensure_future(work())
+        self._threads[task] = set()
+        self._running[(user_id, kind)] = task
+        self._keys.add((user_id, key))
+        self.pending += 1
+        metrics.observe("admission.pending", self.pending)
+        try:
+            return "ok", await task
+        except asyncio.CancelledError:
+            if task in self._superseded:
+                return "superseded", None
+            task.cancel()
+            raise
+        finally:
+            self._release_after(self._threads.pop(task))
+            self._keys.discard((user_id, key))
+            self._superseded.discard(task)
+            if self._running.get((user_id, kind)) is task:
+                del self._running[(user_id, kind)]
\ No newline at end of file
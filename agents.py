@@ -1,25 +1,34 @@
 from crewai import Agent, Task, Crew, Process
 from langchain.llms import OpenAI
 from tools import FlightTools
+from analytics import RouteAnalytics
+from price_calendar import PriceCalendar
 from typing import List, Dict, Any
 from config import config
 
 class FlightAgents:
     """Collection of specialized agents"""
     
-    def __init__(self):
+    def __init__(self, analytics: RouteAnalytics = None,
+                 calendar: PriceCalendar = None):
         self.llm = OpenAI(api_key=config.OPENAI_API_KEY, model=config.MODEL_NAME)
         self.tools = FlightTools()
+        self.analytics = analytics
+        self.calendar = calendar
     
     def search_specialist(self) -> Agent:
         """Agent specialized in flight searches"""
+        tools = [self.tools.search_flights_tool()]
+        if self.calendar:
+            tools.append(self.tools.compare_dates_tool(self.calendar))
+        
         return Agent(
             role="Flight Search Specialist",
             goal="Find the best flight options based on user requirements",
             backstory="""You are an expert at searching for flights. You know all 
             the tricks to find the best deals, hidden city ticketing, optimal 
             connection times, and which airlines offer the best service.""",
-            tools=[self.tools.search_flights_tool()],
+            tools=tools,
             llm=self.llm,
             verbose=True
         )
@@ -33,7 +42,8 @@ class FlightAgents:
             You understand seasonal patterns, demand curves, and can predict when 
             prices will drop or rise. You use advanced analytics to help users 
             save money.""",
-            tools=[self.tools.predict_prices_tool(), self.tools.analyze_route_tool()],
+            tools=[self.tools.predict_prices_tool(self.analytics.history if self.analytics else None),
+                   self.tools.analyze_route_tool(self.analytics)],
             llm=self.llm,
             verbose=True
         )
@@ -83,6 +93,22 @@ class FlightTasks:
             expected_output="List of flights with rankings"
         )
     
+    @staticmethod
+    def rank_flights_task(agent: Agent, origin: str, destination: str,
+                          date: str, table: str) -> Task:
+        return Task(
+            description=f"""Here are the flights found from {origin} to {destination} 
+            on {date}, one row per flight, prices in {config.BASE_CURRENCY}:
+            
+            {table}
+            
+            The table is all you need, do not search again. Rank the best 
+            options by price, duration, departure time convenience and airline 
+            quality, and recommend one in a few sentences.""",
+            agent=agent,
+            expected_output="Short recommendation of the best flights"
+        )
+    
     @staticmethod
     def predict_prices_task(agent: Agent, route: str) -> Task:
         return Task(
@@ -97,6 +123,23 @@ class FlightTasks:
             expected_output="Price predictions with recommendations"
         )
     
+    @staticmethod
+    def assess_routes_task(agent: Agent, table: str) -> Task:
+        return Task(
+            description=f"""Review the latest search results for several tracked 
+            routes, one row per route. Prices are in {config.BASE_CURRENCY}; "last" is 
+            the previous best price and "target" the traveler's maximum, if set.
+            
+            {table}
+            
+            The table is all you need, do not search again. For every row give 
+            one short sentence for the traveler: book now, wait or keep watching, 
+            and why. Reply with only a JSON object mapping each row number to 
+            its sentence, e.g. {{"1": "...", "2": "..."}}.""",
+            agent=agent,
+            expected_output="JSON object of row number to assessment"
+        )
+    
     @staticmethod
     def create_alert_task(agent: Agent, flights: List[Dict], 
                          user_preferences: Dict) -> Task:
@@ -112,4 +155,4 @@ class FlightTasks:
             Format for Telegram with proper markdown.""",
             agent=agent,
             expected_output="Formatted Telegram message"
-        )
+        )
\ No newline at end of file
@@ -0,0 +1,279 @@
+"""
+Airport and city lookup over the bundled IATA dataset
+"""
+import bisect
+import csv
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DATASET = os.path.join(DATA_DIR, "airports.csv")
+# Prebuilt index arrays (numpy .npz, no pickled objects), rebuilt whenever
+# the dataset changes or the file can't be read back
+INDEX_CACHE = os.path.join(DATA_DIR, "airports.idx")
+INDEX_VERSION = 2
+# Weaker fuzzy matches are more often a different place than a typo
+FUZZY_THRESHOLD = 0.5
+
+
+class Place(NamedTuple):
+    code: str
+    kind: str  # airport | metro
+    name: str
+    city: str
+    country: str
+    metro: str = ""
+
+    @property
+    def label(self) -> str:
+        if self.kind == "metro":
+            return f"{self.name} ({self.code})"
+        return f"{self.name} ({self.code}) · {self.city}, {self.country}"
+
+
+class Resolution(NamedTuple):
+    """A confident match, or the candidates to offer when input is ambiguous"""
+    place: Optional[Place]
+    candidates: List[Place]
+
+
+def normalize(text: str) -> str:
+    """Lowercase ASCII words separated by single spaces"""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+def _trigrams(key: str) -> List[str]:
+    padded = f"  {key} "
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+class AirportIndex:
+    """
+    Exact code lookup, word-prefix search over a sorted key list, and
+    fuzzy matching by trigram overlap. Keys are codes, cities, airport
+    names and aliases, all pointing back at places.
+    """
+
+    def __init__(self, places: List[Place], aliases: Dict[int, List[str]] = None):
+        keys: List[Tuple[str, int]] = []
+        for i, place in enumerate(places):
+            names = {place.city, place.name, f"{place.city} {place.name}"}
+            names.update((aliases or {}).get(i, []))
+            for name in names:
+                key = normalize(name)
+                if key:
+                    keys.append((key, i))
+        keys = sorted(set(keys))
+
+        # Every word start of every key, so "kennedy" finds JFK
+        starts = set()
+        for key, i in keys:
+            for m in re.finditer(r"(?:^| )(\S)", key):
+                starts.add((key[m.start(1):], i))
+
+        postings: Dict[str, List[int]] = {}
+        grams = []
+        for k, (key, _) in enumerate(keys):
+            key_grams = _trigrams(key)
+            grams.append(len(key_grams))
+            for gram in key_grams:
+                postings.setdefault(gram, []).append(k)
+        self._set(places, keys, sorted(starts),
+                  {g: np.asarray(ids, dtype=np.int32) for g, ids in postings.items()},
+                  np.asarray(grams, dtype=np.int32))
+
+    def _set(self, places: List[Place], keys: List[Tuple[str, int]],
+             prefixes: List[Tuple[str, int]], postings: Dict[str, np.ndarray],
+             key_grams: np.ndarray):
+        self.places = places
+        self.codes = {p.code: i for i, p in enumerate(places)}
+        self.keys = keys
+        self.exact: Dict[str, List[int]] = {}
+        for key, i in self.keys:
+            self.exact.setdefault(key, []).append(i)
+        self.prefixes = prefixes
+        self._prefix_keys = [key for key, _ in self.prefixes]
+        self.postings = postings
+        self.key_grams = key_grams
+        self.key_places = np.asarray([i for _, i in self.keys], dtype=np.int32)
+
+    @classmethod
+    def from_csv(cls, path: str = DATASET) -> "AirportIndex":
+        places, aliases = [], {}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                aliases[len(places)] = [a for a in row["aliases"].split("|") if a]
+                places.append(Place(
+                    row["code"], row["kind"], row["name"], row["city"],
+                    row["country"], row["metro"]
+                ))
+        return cls(places, aliases)
+
+    def save(self, f, stamp: Tuple[int, float]):
+        """Write the index as plain numpy arrays"""
+        grams = sorted(self.postings)
+        lengths = [len(self.postings[g]) for g in grams]
+        np.savez(
+            f,
+            stamp=np.asarray(stamp, dtype=np.float64),
+            places=np.asarray([list(p) for p in self.places], dtype=str).reshape(-1, len(Place._fields)),
+            keys=np.asarray([key for key, _ in self.keys], dtype=str),
+            key_places=self.key_places,
+            prefixes=np.asarray([key for key, _ in self.prefixes], dtype=str),
+            prefix_places=np.asarray([i for _, i in self.prefixes], dtype=np.int32),
+            grams=np.asarray(grams, dtype=str),
+            offsets=np.cumsum([0] + lengths).astype(np.int64),
+            postings=np.concatenate([self.postings[g] for g in grams]).astype(np.int32)
+            if grams else np.zeros(0, dtype=np.int32),
+            key_grams=self.key_grams,
+        )
+
+    @classmethod
+    def read(cls, f, stamp: Tuple[int, float]) -> Optional["AirportIndex"]:
+        """The index saved in f, or None when it was built from another dataset or version"""
+        with np.load(f, allow_pickle=False) as data:
+            if tuple(data["stamp"]) != tuple(np.asarray(stamp, dtype=np.float64)):
+                return None
+            index = cls.__new__(cls)
+            offsets, postings = data["offsets"], data["postings"]
+            index._set(
+                [Place(*row) for row in data["places"].tolist()],
+                list(zip(data["keys"].tolist(), data["key_places"].tolist())),
+                list(zip(data["prefixes"].tolist(), data["prefix_places"].tolist())),
+                {g: postings[offsets[j]:offsets[j + 1]] for j, g in enumerate(data["grams"].tolist())},
+                data["key_grams"],
+            )
+            return index
+
+    @classmethod
+    def load(cls, path: str = DATASET, cache: str = INDEX_CACHE) -> "AirportIndex":
+        """Load the prebuilt index, building and caching it if it is stale or unreadable"""
+        stamp = (INDEX_VERSION, os.path.getmtime(path))
+        try:
+            with open(cache, "rb") as f:
+                index = cls.read(f, stamp)
+            if index is not None:
+                return index
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # Anything unreadable, whatever the reason, is rebuilt from the dataset
+            logger.info(f"Rebuilding airport index, cache unreadable: {e}")
+
+        index = cls.from_csv(path)
+        try:
+            with open(cache, "wb") as f:
+                index.save(f, stamp)
+        except OSError as e:
+            logger.warning(f"Could not write airport index cache: {e}")
+        return index
+
+    def get(self, code: str) -> Optional[Place]:
+        i = self.codes.get(code.strip().upper())
+        return self.places[i] if i is not None else None
+
+    def prefix(self, text: str, limit: int = 20) -> List[Place]:
+        query = normalize(text)
+        if not query:
+            return []
+        found = []
+        start = bisect.bisect_left(self._prefix_keys, query)
+        for key, i in self.prefixes[start:]:
+            if not key.startswith(query):
+                break
+            if i not in found:
+                found.append(i)
+                if len(found) >= limit:
+                    break
+        return [self.places[i] for i in found]
+
+    def fuzzy(self, text: str, limit: int = 5, threshold: float = 0.35) -> List[Tuple[Place, float]]:
+        """Places ranked by Dice similarity of trigram sets"""
+        query = normalize(text)
+        grams = [self.postings[g] for g in _trigrams(query) if g in self.postings]
+        if not grams:
+            return []
+        shared = np.bincount(np.concatenate(grams), minlength=len(self.keys))
+        scores = 2 * shared / (len(_trigrams(query)) + self.key_grams)
+
+        best: Dict[int, float] = {}
+        for k in np.argsort(-scores)[:limit * 4]:
+            if scores[k] < threshold:
+                break
+            i = int(self.key_places[k])
+            best.setdefault(i, float(scores[k]))
+        # Ties go to the metro, so equally good airports fold into it
+        ranked = sorted(
+            best.items(), key=lambda item: (-item[1], self.places[item[0]].kind != "metro")
+        )[:limit]
+        return [(self.places[i], score) for i, score in ranked]
+
+    def _collapse(self, places: List[Place]) -> List[Place]:
+        """Drop airports whose metro is already a better-ranked candidate"""
+        collapsed = []
+        for place in places:
+            if not any(p.code == place.metro for p in collapsed) and place not in collapsed:
+                collapsed.append(place)
+        return collapsed
+
+    def resolve(self, text: str, limit: int = 5) -> Resolution:
+        """Best interpretation of free text as a place"""
+        query = normalize(text)
+        if not query:
+            return Resolution(None, [])
+
+        code = self.get(text) if len(query) == 3 and query.isalpha() else None
+        # An uppercase code is taken at face value; "los" could be Lagos or Los Angeles
+        if code and (text.strip().isupper() or not self.prefix(query)):
+            return Resolution(code, [code])
+
+        exact = self._collapse([self.places[i] for i in self.exact.get(query, [])])
+        if (not code and not exact and len(query) == 3 and query.isalpha()
+                and text.strip().isupper()):
+            # The bundled list covers major airports only; a well-formed
+            # code outside it is passed through rather than fuzzily guessed
+            unknown = Place(query.upper(), "airport", query.upper(), "", "")
+            return Resolution(unknown, [unknown])
+        if code:
+            # A lowercase code that also starts a name is offered next to it
+            matches = exact or self._collapse(self.prefix(query))
+            candidates = self._collapse([code] + matches)[:limit]
+            return Resolution(code if len(candidates) == 1 else None, candidates)
+        if exact:
+            return Resolution(exact[0] if len(exact) == 1 else None, exact[:limit])
+
+        prefixed = self._collapse(self.prefix(query))
+        if prefixed:
+            confident = len(prefixed) == 1 and len(query) >= 3
+            return Resolution(prefixed[0] if confident else None, prefixed[:limit])
+
+        fuzzy = self.fuzzy(query, limit * 4, FUZZY_THRESHOLD)
+        if not fuzzy:
+            return Resolution(None, [])
+        scores = {place: score for place, score in fuzzy}
+        places = self._collapse([place for place, _ in fuzzy])[:limit]
+        top = scores[places[0]]
+        runner_up = scores[places[1]] if len(places) > 1 else 0.0
+        confident = top >= 0.6 and top - runner_up >= 0.15
+        return Resolution(places[0] if confident else None, places)
+
+_index: Optional[AirportIndex] = None
+_lock = threading.Lock()
+
+
+def get_index() -> AirportIndex:
+    """Shared index, loaded on first lookup rather than at startup"""
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = AirportIndex.load()
+    return _index
\ No newline at end of file
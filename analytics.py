@@ -0,0 +1,341 @@
+"""
+Materialized route statistics built from real price observations
+"""
+import calendar
+import time
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Tuple
+from database import Database
+from retention import PriceHistory
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Width of the price histogram buckets used for percentile estimation
+PRICE_BUCKET = 5.0
+
+# Booking lead time windows in days before departure
+LEAD_WINDOWS = [(0, 6), (7, 13), (14, 29), (30, 59), (60, 89), (90, 365)]
+
+
+def route_key(origin: str, destination: str) -> str:
+    """Canonical key for a route, e.g. 'LAX-JFK'"""
+    return f"{origin.strip().upper()}-{destination.strip().upper()}"
+
+
+def _lead_window(days: int) -> str:
+    for low, high in LEAD_WINDOWS:
+        if low <= days <= high:
+            return f"{low}-{high}"
+    return f"{LEAD_WINDOWS[-1][0]}-{LEAD_WINDOWS[-1][1]}"
+
+
+def _empty_accumulators() -> Dict[str, Any]:
+    return {
+        "count": 0,
+        "sum": 0.0,
+        "min": None,
+        "max": None,
+        "histogram": {},
+        "booking_weekday": {},
+        "travel_weekday": {},
+        "month": {},
+        "lead_time": {},
+        "airlines": {},
+    }
+
+
+def _add(bucket: Dict[str, List[float]], key: str, price: float):
+    """Accumulate [sum, count, min] for a grouping key"""
+    entry = bucket.setdefault(key, [0.0, 0, price])
+    entry[0] += price
+    entry[1] += 1
+    entry[2] = min(entry[2], price)
+
+
+def _cheapest(bucket: Dict[str, List[float]]) -> Optional[str]:
+    if not bucket:
+        return None
+    return min(bucket, key=lambda k: bucket[k][0] / bucket[k][1])
+
+
+def _percentile(histogram: Dict[str, int], count: int, q: float) -> Optional[float]:
+    """Estimate a percentile from the bucketed price histogram"""
+    if not count:
+        return None
+    target = q * count
+    seen = 0
+    for bucket in sorted(histogram, key=int):
+        seen += histogram[bucket]
+        if seen >= target:
+            return round((int(bucket) + 0.5) * PRICE_BUCKET, 2)
+    return None
+
+
+def summarize(acc: Dict[str, Any]) -> Dict[str, Any]:
+    """Derive the user-facing statistics from raw accumulators"""
+    count = acc["count"]
+    travel_day = _cheapest(acc["travel_weekday"])
+    booking_day = _cheapest(acc["booking_weekday"])
+    month = _cheapest(acc["month"])
+    airlines = sorted(
+        acc["airlines"].items(),
+        key=lambda item: item[1][0] / item[1][1]
+    )
+
+    return {
+        "observations": count,
+        "average_price": round(acc["sum"] / count, 2) if count else None,
+        "price_range": {"min": acc["min"], "max": acc["max"]},
+        "percentiles": {
+            f"p{int(q * 100)}": _percentile(acc["histogram"], count, q)
+            for q in (0.1, 0.25, 0.5, 0.75, 0.9)
+        },
+        "best_booking_day": calendar.day_name[int(booking_day)] if booking_day else None,
+        "best_travel_day": calendar.day_name[int(travel_day)] if travel_day else None,
+        "cheapest_month": calendar.month_name[int(month)] if month else None,
+        "best_lead_time_days": _cheapest(acc["lead_time"]),
+        "best_airlines": [
+            {"airline": name, "average_price": round(s / c, 2), "min_price": m}
+            for name, (s, c, m) in airlines[:3]
+        ],
+    }
+
+
+class RouteAnalytics:
+    """Per-route statistics store, updated incrementally on every observation"""
+
+    def __init__(self, db: Database = None, cache_seconds: int = None):
+        self.db = db or Database()
+        # Read cache only; other processes write the same rows, so entries expire
+        self.cache_seconds = config.STATS_CACHE_SECONDS if cache_seconds is None else cache_seconds
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._cached_at: Dict[str, float] = {}
+        self.history = PriceHistory(self.db)
+
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(key)
+        if entry is not None and time.monotonic() - self._cached_at[key] < self.cache_seconds:
+            return entry
+        return None
+
+    def _remember(self, key: str, entry: Dict[str, Any]):
+        self._cache[key] = entry
+        self._cached_at[key] = time.monotonic()
+
+    def _load(self, key: str) -> Dict[str, Any]:
+        entry = self._cached(key)
+        if entry is None:
+            entry = self.db.get_route_stats(key) or {
+                "accumulators": _empty_accumulators(),
+                "summary": summarize(_empty_accumulators()),
+            }
+            self._remember(key, entry)
+        return entry
+
+    def record_observation(self, origin: str, destination: str, price: float,
+                           observed_at: datetime = None,
+                           departure_date: datetime = None,
+                           airline: str = None) -> Dict[str, Any]:
+        """Fold a single price observation into the route's statistics"""
+        key = route_key(origin, destination)
+        observed_at = observed_at or datetime.utcnow()
+        entry = self.db.update_route_stats(key, lambda stats: self._fold(
+            stats, price, observed_at, departure_date, airline
+        ))
+        self._remember(key, entry)
+        return entry["summary"]
+
+    @staticmethod
+    def _fold(stats: Optional[Dict[str, Any]], price: float, observed_at: datetime,
+              departure_date: datetime = None, airline: str = None) -> Dict[str, Any]:
+        acc = stats["accumulators"] if stats else _empty_accumulators()
+
+        acc["count"] += 1
+        acc["sum"] += price
+        acc["min"] = price if acc["min"] is None else min(acc["min"], price)
+        acc["max"] = price if acc["max"] is None else max(acc["max"], price)
+
+        bucket = str(int(price // PRICE_BUCKET))
+        acc["histogram"][bucket] = acc["histogram"].get(bucket, 0) + 1
+
+        _add(acc["booking_weekday"], str(observed_at.weekday()), price)
+        if departure_date:
+            _add(acc["travel_weekday"], str(departure_date.weekday()), price)
+            _add(acc["month"], str(departure_date.month), price)
+            lead_days = max((departure_date - observed_at).days, 0)
+            _add(acc["lead_time"], _lead_window(lead_days), price)
+        if airline:
+            _add(acc["airlines"], airline, price)
+
+        return {"accumulators": acc, "summary": summarize(acc)}
+
+    def get(self, origin: str, destination: str = None) -> Optional[Dict[str, Any]]:
+        """Look up materialized statistics by route or 'ORIGIN-DEST' key"""
+        key = route_key(*origin.split("-", 1)) if destination is None else route_key(origin, destination)
+        entry = self._cached(key) or self.db.get_route_stats(key)
+        if not entry or not entry["accumulators"]["count"]:
+            return None
+        self._remember(key, entry)
+        return dict(entry["summary"], route=key)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Statistics held in memory, for a warm restart"""
+        return dict(self._cache)
+
+    def restore(self, entries: Dict[str, Dict[str, Any]], saved_at: datetime) -> int:
+        """
+        Reload statistics from a snapshot taken at saved_at. Routes whose
+        stored row was written after that are left to load from the
+        database, so no observation folded since the snapshot is lost.
+        """
+        written = self.db.get_route_stats_times()
+        fresh = {
+            key: entry for key, entry in entries.items()
+            if key in written and written[key] <= saved_at
+        }
+        for key, entry in fresh.items():
+            self._remember(key, entry)
+        return len(fresh)
+
+    def trend(self, route: str, days: int = 365) -> Optional[Dict[str, Any]]:
+        """Long-horizon view of a route from the daily rollups"""
+        key = route_key(*route.split("-", 1))
+        series = self.history.series(
+            key, datetime.utcnow() - timedelta(days=days), resolution="day"
+        ).dropna(subset=["avg"])
+        if series.empty:
+            return None
+        first, last = series["avg"].iloc[0], series["avg"].iloc[-1]
+        return {
+            "days": len(series),
+            "since": series["time"].iloc[0].date().isoformat(),
+            "low": round(float(series["min"].min()), 2),
+            "high": round(float(series["max"].max()), 2),
+            "average": round(float((series["avg"] * series["count"]).sum() / series["count"].sum()), 2),
+            "change_pct": round(float((last - first) / first * 100), 1) if first else None,
+        }
+
+    def history_frames(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Every observation still held raw, and the daily rollups of days
+        whose raw rows have partly expired. A day comes from its raw rows
+        while all of its rolled-up rows are still there, otherwise from its
+        daily bucket; rows not rolled up yet are always taken raw.
+        """
+        raw = pd.DataFrame(self.db.get_observations_for_stats(), columns=[
+            "route", "price", "observed_at", "departure_date", "airline", "rolled_up"
+        ])
+        raw["observed_at"] = pd.to_datetime(raw["observed_at"])
+        raw["departure_date"] = pd.to_datetime(raw["departure_date"])
+        raw = raw.dropna(subset=["price", "observed_at"])
+        raw["day"] = raw["observed_at"].dt.floor("D")
+        rolled = raw["rolled_up"].fillna(False).astype(bool)
+
+        daily = pd.DataFrame(self.db.get_rollups("day"), columns=[
+            "route", "day", "min", "max", "sum", "count"
+        ])
+        daily["day"] = pd.to_datetime(daily["day"])
+        held = raw[rolled].groupby(["route", "day"]).size().rename("held")
+        daily = daily.join(held, on=["route", "day"])
+        partial = daily[daily["held"].fillna(0) < daily["count"]]
+
+        from_rollups = set(zip(partial["route"], partial["day"]))
+        in_partial = np.array(
+            [(r, d) in from_rollups for r, d in zip(raw["route"], raw["day"])], dtype=bool
+        )
+        keep = ~rolled.to_numpy(dtype=bool) | ~in_partial
+        return (
+            raw.loc[keep, ["route", "price", "observed_at", "departure_date", "airline"]],
+            partial[["route", "day", "min", "max", "sum", "count"]],
+        )
+
+    def rebuild(self, history: pd.DataFrame = None, daily: pd.DataFrame = None) -> int:
+        """
+        Recompute every route's statistics with vectorized group-bys, from
+        every stored observation including those of routes no longer
+        tracked. Days only held as daily rollups add to the totals and
+        booking weekdays; their prices count at the day's average in the
+        percentile histogram.
+        """
+        if history is None:
+            history, daily = self.history_frames()
+        accumulators: Dict[str, Dict[str, Any]] = {}
+        if not history.empty:
+            self._fold_frame(accumulators, history.copy())
+        if daily is not None and not daily.empty:
+            self._fold_daily(accumulators, daily)
+        if not accumulators:
+            return 0
+
+        for key, acc in accumulators.items():
+            entry = {"accumulators": acc, "summary": summarize(acc)}
+            self._remember(key, entry)
+            self.db.save_route_stats(key, entry)
+
+        logger.info(f"Rebuilt statistics for {len(accumulators)} routes")
+        return len(accumulators)
+
+    @staticmethod
+    def _fold_frame(accumulators: Dict[str, Dict[str, Any]], df: pd.DataFrame):
+        """Raw observations into accumulators"""
+        df["price"] = df["price"].astype(float)
+        df["bucket"] = (df["price"] // PRICE_BUCKET).astype(int).astype(str)
+        df["booking_weekday"] = df["observed_at"].dt.weekday.astype(str)
+        has_departure = df["departure_date"].notna()
+        df["travel_weekday"] = np.where(
+            has_departure, df["departure_date"].dt.weekday.fillna(0).astype(int).astype(str), None
+        )
+        df["month"] = np.where(
+            has_departure, df["departure_date"].dt.month.fillna(0).astype(int).astype(str), None
+        )
+        lead_days = (df["departure_date"] - df["observed_at"]).dt.days.clip(lower=0)
+        df["lead_time"] = [
+            _lead_window(int(d)) if pd.notna(d) else None for d in lead_days
+        ]
+
+        for key in df["route"].unique():
+            accumulators.setdefault(key, _empty_accumulators())
+
+        totals = df.groupby("route")["price"].agg(["count", "sum", "min", "max"])
+        for key, row in totals.iterrows():
+            acc = accumulators[key]
+            acc["count"] = int(row["count"])
+            acc["sum"] = float(row["sum"])
+            acc["min"] = float(row["min"])
+            acc["max"] = float(row["max"])
+
+        for (key, bucket), size in df.groupby(["route", "bucket"]).size().items():
+            accumulators[key]["histogram"][bucket] = int(size)
+
+        for column in ("booking_weekday", "travel_weekday", "month", "lead_time", "airline"):
+            target = "airlines" if column == "airline" else column
+            grouped = df.dropna(subset=[column]).groupby(["route", column])["price"]
+            for (key, group), row in grouped.agg(["sum", "count", "min"]).iterrows():
+                accumulators[key][target][group] = [
+                    float(row["sum"]), int(row["count"]), float(row["min"])
+                ]
+
+    @staticmethod
+    def _fold_daily(accumulators: Dict[str, Dict[str, Any]], daily: pd.DataFrame):
+        """Daily rollup buckets (route, day, min, max, sum, count) into accumulators"""
+        for key, day, low, high, total, count in zip(
+            daily["route"], daily["day"], daily["min"], daily["max"], daily["sum"], daily["count"]
+        ):
+            count = int(count)
+            if not count:
+                continue
+            acc = accumulators.setdefault(key, _empty_accumulators())
+            acc["count"] += count
+            acc["sum"] += float(total)
+            acc["min"] = float(low) if acc["min"] is None else min(acc["min"], float(low))
+            acc["max"] = float(high) if acc["max"] is None else max(acc["max"], float(high))
+            bucket = str(int(total / count // PRICE_BUCKET))
+            acc["histogram"][bucket] = acc["histogram"].get(bucket, 0) + count
+            entry = acc["booking_weekday"].setdefault(str(day.weekday()), [0.0, 0, float(low)])
+            entry[0] += float(total)
+            entry[1] += count
+            entry[2] = min(entry[2], float(low))
\ No newline at end of file
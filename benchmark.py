@@ -0,0 +1,487 @@
+"""
+Offline benchmarks for monitoring and delivery paths
+
+Usage:
+    python benchmark.py polling [--routes 200] [--days 14]
+    python benchmark.py booking [--users 50] [--duplicates 3]
+    python benchmark.py retention [--routes 20] [--days 365]
+    python benchmark.py fx [--flights 200] [--sets 500]
+    python benchmark.py restart [--routes 5000] [--downtime 30]
+    python benchmark.py crew [--routes 12] [--batch 6]   (runs real crews, needs OPENAI_API_KEY)
+"""
+import argparse
+import asyncio
+import heapq
+import os
+import tempfile
+import time
+import numpy as np
+from datetime import datetime, timedelta
+
+
+def _simulate_prices(rng: np.random.Generator, routes: int, minutes: int):
+    """Synthetic per-minute prices with short-lived drops"""
+    base = rng.uniform(250, 800, routes)
+    # A third of routes are volatile, the rest drift slowly
+    volatile = rng.random(routes) < 0.33
+    sigma = np.where(volatile, 0.0012, 0.0002)
+    departure_days = rng.uniform(3, 120, routes)
+
+    walk = rng.normal(0, 1, (routes, minutes)).astype(np.float32) * sigma[:, None]
+    prices = base[:, None] * np.exp(np.cumsum(walk, axis=1))
+
+    drops = []
+    t = np.arange(minutes) / 1440.0
+    for i in range(routes):
+        days_out = departure_days[i] - t
+        # Drops get more frequent as departure approaches and on volatile routes
+        rate = (3.0 if volatile[i] else 0.3) / 1440 * np.clip(30 / np.maximum(days_out, 1), 0.5, 6)
+        starts = np.flatnonzero(rng.random(minutes) < rate)
+        route_drops = []
+        for start in starts:
+            length = int(rng.uniform(10, 45) if volatile[i] else rng.uniform(60, 240))
+            end = min(start + length, minutes)
+            prices[i, start:end] *= 1 - rng.uniform(0.08, 0.2)
+            route_drops.append((start, end))
+        drops.append(route_drops)
+    return prices, drops, departure_days
+
+
+def _count_caught(polls, drops) -> int:
+    caught = 0
+    for route_polls, route_drops in zip(polls, drops):
+        times = np.asarray(route_polls)
+        for start, end in route_drops:
+            i = np.searchsorted(times, start)
+            if i < len(times) and times[i] < end:
+                caught += 1
+    return caught
+
+
+def bench_polling(args):
+    from scheduling import AdaptivePolicy
+
+    rng = np.random.default_rng(args.seed)
+    minutes = args.days * 1440
+    prices, drops, departure_days = _simulate_prices(rng, args.routes, minutes)
+    start = datetime(2026, 1, 1)
+    departures = [start + timedelta(days=float(d)) for d in departure_days]
+    horizon = np.minimum(departure_days * 1440, minutes).astype(int)
+
+    # Fixed cadence
+    fixed_polls = [list(range(0, h, args.interval)) for h in horizon]
+    fixed_calls = sum(len(p) for p in fixed_polls)
+
+    # Adaptive cadence under the same call budget
+    budget = args.routes * 60.0 / args.interval
+    policy = AdaptivePolicy(min_interval=5, max_interval=720, budget_per_hour=budget)
+    adaptive_polls = [[] for _ in range(args.routes)]
+    history = [[] for _ in range(args.routes)]
+    active = set(range(args.routes))
+    queue = [(0, i) for i in range(args.routes)]
+    heapq.heapify(queue)
+
+    began = time.perf_counter()
+    while queue:
+        minute, i = heapq.heappop(queue)
+        if minute >= horizon[i]:
+            active.discard(i)
+            policy.retain(active)
+            continue
+        adaptive_polls[i].append(minute)
+        history[i].append(float(prices[i, minute]))
+        planned = policy.plan([{
+            "id": i,
+            "prices": history[i],
+            "base": args.interval,
+            "departure_date": departures[i],
+        }], now=start + timedelta(minutes=minute))
+        heapq.heappush(queue, (minute + max(planned[i], 1), i))
+    planning_ms = (time.perf_counter() - began) * 1000
+    adaptive_calls = sum(len(p) for p in adaptive_polls)
+
+    total_drops = sum(len(d) for d in drops)
+    fixed_caught = _count_caught(fixed_polls, drops)
+    adaptive_caught = _count_caught(adaptive_polls, drops)
+
+    print(f"routes={args.routes} days={args.days} drops={total_drops}")
+    print(f"{'policy':<10}{'calls':>10}{'caught':>10}{'caught/1k calls':>18}")
+    for name, calls, caught in [("fixed", fixed_calls, fixed_caught),
+                                ("adaptive", adaptive_calls, adaptive_caught)]:
+        print(f"{name:<10}{calls:>10}{caught:>10}{caught / calls * 1000:>18.2f}")
+    print(f"adaptive planning overhead: {planning_ms / adaptive_calls * 1000:.1f} us/check")
+
+
+def bench_booking(args):
+    from config import config
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    config.DATABASE_URL = f"sqlite:///{path}"
+    config.ENABLE_AUTO_BOOKING = True
+    config.BOOKING_MONTHLY_CAP = args.cap
+
+    from database import Database, BookingRecord
+    from booking import AutoBooker, StubBookingProvider
+    from flight_results import FlightResults
+    from metrics import metrics
+
+    db = Database()
+    for u in range(args.users):
+        user_id = f"user{u}"
+        db.save_traveler_profile(user_id, {
+            "full_name": f"Traveler {u}", "email": f"t{u}@example.com",
+            "phone": "+15550000000", "date_of_birth": datetime(1990, 1, 1).date(),
+        })
+        for destination in ("LAX", "SFO"):
+            db.add_tracked_route(user_id, "JFK", destination, max_price=args.fare + 50, auto_book=True)
+    routes = db.get_active_routes()
+
+    booker = AutoBooker(db, StubBookingProvider(latency=args.provider_ms / 1000))
+
+    async def observe(route):
+        flights = FlightResults.from_records([{
+            "flight_number": f"XX{route.destination}", "airline": "Stub Air",
+            "departure_time": "08:00", "arrival_time": "11:30", "price": args.fare,
+        }])
+        observed_at = datetime.utcnow()
+        # Several monitors seeing the same drop at once
+        await asyncio.gather(*(
+            booker.consider(route, flights, observed_at) for _ in range(args.duplicates)
+        ))
+
+    async def run():
+        for i in range(0, len(routes), args.concurrency):
+            await asyncio.gather(*(observe(r) for r in routes[i:i + args.concurrency]))
+
+    began = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - began
+
+    session = db.Session()
+    try:
+        confirmed = session.query(BookingRecord.route_id).filter_by(status="confirmed").all()
+        declined = session.query(BookingRecord).filter_by(status="declined").count()
+    finally:
+        session.close()
+    booked_routes = [r.route_id for r in confirmed]
+    double_booked = len(booked_routes) - len(set(booked_routes))
+    timing = metrics.snapshot()["timings"].get("booking.observation_to_confirmation_seconds", {})
+    os.remove(path)
+
+    print(f"users={args.users} routes={len(routes)} duplicates={args.duplicates} "
+          f"fare=${args.fare:.0f} cap=${args.cap:.0f} provider={args.provider_ms}ms")
+    print(f"confirmed={len(confirmed)} declined_over_cap={declined} "
+          f"duplicates_suppressed={metrics.counter('booking.duplicates'):.0f} "
+          f"double_booked={double_booked}")
+    if timing:
+        overhead = timing['p50'] * 1000 - args.provider_ms
+        print(f"observation->confirmation p50={timing['p50'] * 1000:.1f}ms "
+              f"p95={timing['p95'] * 1000:.1f}ms (engine overhead p50 {overhead:.1f}ms)")
+    print(f"wall clock {elapsed:.2f}s")
+
+
+def bench_retention(args):
+    from config import config
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    config.DATABASE_URL = f"sqlite:///{path}"
+
+    from database import Database, PriceObservation, PriceRollup
+    from retention import PriceHistory
+
+    db = Database()
+    history = PriceHistory(db)
+    rng = np.random.default_rng(args.seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    steps = args.days * 24 * 60 // args.interval
+    times = [now - timedelta(minutes=args.interval * i) for i in range(steps, 0, -1)]
+
+    session = db.Session()
+    try:
+        for r in range(args.routes):
+            prices = 300 + np.cumsum(rng.normal(0, 3, steps))
+            session.bulk_insert_mappings(PriceObservation, [
+                {"route_key": f"R{r:03d}-XXX", "price": float(p), "observed_at": t}
+                for p, t in zip(prices, times)
+            ])
+        session.commit()
+    finally:
+        session.close()
+    raw_before = args.routes * steps
+
+    began = time.perf_counter()
+    folded = 0
+    while True:
+        batch = history.roll_up()
+        folded += batch
+        if not batch:
+            break
+    rollup_time = time.perf_counter() - began
+    began = time.perf_counter()
+    expired = history.expire(now)
+    expire_time = time.perf_counter() - began
+
+    session = db.Session()
+    try:
+        raw_after = session.query(PriceObservation).count()
+        hourly = session.query(PriceRollup).filter_by(resolution="hour").count()
+        daily = session.query(PriceRollup).filter_by(resolution="day").count()
+    finally:
+        session.close()
+
+    print(f"routes={args.routes} days={args.days} interval={args.interval}min "
+          f"raw_window={history.raw_days}d hourly_window={history.hourly_days}d")
+    print(f"rolled up {folded} rows in {rollup_time:.2f}s "
+          f"({folded / max(rollup_time, 1e-9):.0f} rows/s), expired {expired} in {expire_time:.2f}s")
+    print(f"rows: raw {raw_before} -> {raw_after}, hourly {hourly}, daily {daily} "
+          f"({(raw_after + hourly + daily) / raw_before:.1%} of untiered)")
+
+    for days in (1, 7, 30, 90, 365):
+        if days > args.days:
+            continue
+        began = time.perf_counter()
+        series = history.series("R000-XXX", now - timedelta(days=days), now)
+        elapsed = (time.perf_counter() - began) * 1000
+        print(f"{days:>4}d query: {series.attrs['resolution']:>4} "
+              f"{len(series):>5} points {elapsed:7.1f}ms")
+    os.remove(path)
+
+
+def bench_fx(args):
+    from flight_results import FlightResults
+    from fx import RateSnapshot, FileRateSource
+
+    data = FileRateSource().load()
+    snapshot = RateSnapshot(data["base"], data["rates"], data["as_of"])
+    rng = np.random.default_rng(args.seed)
+    codes = snapshot.codes
+    result_sets = [
+        FlightResults.from_records([
+            {"flight_number": f"XX{i}", "price": float(p), "currency": codes[c]}
+            for i, (p, c) in enumerate(zip(
+                rng.uniform(50, 2000, args.flights), rng.integers(0, len(codes), args.flights)
+            ))
+        ])
+        for _ in range(args.sets)
+    ]
+
+    began = time.perf_counter()
+    for results in result_sets:
+        rates = {code: snapshot.rate(code) for code in codes}
+        per_row = [r["price"] / rates[r["currency"]] for r in results.records()]
+        min(per_row)
+    row_time = time.perf_counter() - began
+
+    began = time.perf_counter()
+    for results in result_sets:
+        results = snapshot.normalize(results)
+        results.min_price()
+    vector_time = time.perf_counter() - began
+
+    total = args.flights * args.sets
+    print(f"{args.sets} result sets x {args.flights} flights in {len(codes)} currencies")
+    print(f"per-row   {row_time * 1000:8.1f}ms  ({row_time / total * 1e6:.2f}µs/flight)")
+    print(f"vectorized{vector_time * 1000:8.1f}ms  ({vector_time / total * 1e6:.2f}µs/flight), "
+          f"{row_time / vector_time:.1f}x faster")
+
+
+def bench_restart(args):
+    from config import config
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    config.DATABASE_URL = f"sqlite:///{path}"
+    snapshot_path = f"{path}.snapshot"
+
+    import pandas as pd
+    from database import Database, RouteStatistics, TrackedRoute
+    from analytics import RouteAnalytics
+    from scheduling import AdaptivePolicy
+    from snapshot import SnapshotStore
+
+    db = Database()
+    rng = np.random.default_rng(args.seed)
+    now = datetime.utcnow()
+    # Due times as the previous process left them, then args.downtime minutes offline
+    offsets = rng.uniform(-args.downtime, config.CHECK_INTERVAL * 2, args.routes)
+    session = db.Session()
+    try:
+        session.bulk_insert_mappings(TrackedRoute, [
+            {"id": f"route{i}", "user_id": f"user{i % 500}", "origin": "JFK",
+             "destination": f"D{i:05d}", "active": True, "check_frequency": config.CHECK_INTERVAL,
+             "next_check": now + timedelta(minutes=float(offset))}
+            for i, offset in enumerate(offsets)
+        ])
+        session.commit()
+    finally:
+        session.close()
+
+    observations = 20
+    history = pd.DataFrame({
+        "route": np.repeat([f"JFK-D{i:05d}" for i in range(args.routes)], observations),
+        "price": rng.uniform(150, 900, args.routes * observations),
+        "observed_at": pd.Timestamp(now) - pd.to_timedelta(
+            rng.uniform(0, 60, args.routes * observations), unit="D"),
+        "departure_date": pd.Timestamp(now) + pd.to_timedelta(
+            rng.uniform(1, 120, args.routes * observations), unit="D"),
+        "airline": rng.choice(["AA", "DL", "UA", "B6"], args.routes * observations),
+    })
+    # Statistics are built in memory and written in one batch to keep setup short
+    previous = RouteAnalytics(db)
+    previous.db = Database()
+    previous.db.save_route_stats = lambda key, entry: None
+    previous.rebuild(history)
+    session = db.Session()
+    try:
+        session.bulk_insert_mappings(RouteStatistics, [
+            {"route_key": key, "stats": entry, "updated_at": now}
+            for key, entry in previous.snapshot().items()
+        ])
+        session.commit()
+    finally:
+        session.close()
+    budget = args.routes * 60.0 / config.CHECK_INTERVAL
+    policy = AdaptivePolicy(budget_per_hour=budget)
+    policy.restore({"raw_rates": {f"route{i}": 60.0 / config.CHECK_INTERVAL for i in range(args.routes)}})
+    in_flight = [f"route{i}" for i in range(0, args.routes, 50)]
+
+    store = SnapshotStore(snapshot_path)
+    began = time.perf_counter()
+    size = store.save({
+        "node_id": None, "in_flight": in_flight,
+        "policy": policy.snapshot(), "route_stats": previous.snapshot(),
+    }, now)
+    save_time = time.perf_counter() - began
+
+    # Cold: every overdue route fires on the first tick and stats load one route at a time
+    restarted = now + timedelta(minutes=args.downtime)
+    routes = db.get_active_routes()
+    tick = timedelta(minutes=config.MONITOR_TICK)
+    cold_first_tick = sum(r.next_check <= restarted + tick for r in routes)
+    cold = RouteAnalytics(db)
+    began = time.perf_counter()
+    for i in range(args.routes):
+        cold._load(f"JFK-D{i:05d}")
+    cold_load_time = time.perf_counter() - began
+
+    # Warm: the same steps FlightMonitor.resume() takes
+    began = time.perf_counter()
+    state = store.load(restarted)
+    load_time = time.perf_counter() - began
+    warm = RouteAnalytics(db)
+    policy = AdaptivePolicy(budget_per_hour=budget)
+    policy.restore(state["sections"]["policy"])
+    restored = warm.restore(state["sections"]["route_stats"], state["saved_at"])
+    due = policy.stagger(db.get_active_routes(), restarted, state["sections"]["in_flight"])
+    db.set_next_checks(due)
+    restore_time = time.perf_counter() - began
+    warm_first_tick = sum(r.next_check <= restarted + tick for r in db.get_active_routes())
+
+    os.remove(path)
+    os.remove(snapshot_path)
+    print(f"routes={args.routes} downtime={args.downtime}min tick={config.MONITOR_TICK}min "
+          f"budget={policy.budget_per_hour:.0f}/h")
+    print(f"snapshot {size / 1024:.0f}KB ({size / args.routes:.0f}B/route) saved in {save_time * 1000:.0f}ms")
+    print(f"cold: {cold_first_tick} checks in the first tick, "
+          f"stats loaded per route in {cold_load_time:.2f}s")
+    print(f"warm: {warm_first_tick} checks in the first tick, {len(due)} overdue spread over "
+          f"{(max(due.values()) - restarted).total_seconds() / 60 if due else 0:.0f}min, "
+          f"restored {restored} route stats in {restore_time:.2f}s (read {load_time * 1000:.0f}ms)")
+
+
+def bench_crew(args):
+    from config import config
+    handle, path = tempfile.mkstemp(suffix=".db")
+    os.close(handle)
+    config.DATABASE_URL = f"sqlite:///{path}"
+    config.SNAPSHOT_PATH = f"{path}.snapshot"
+    config.ENABLE_SHARDING = False
+    config.ENABLE_AUTO_BOOKING = False
+    # Checks never send alerts here, but the monitor builds its bot client up front
+    config.TELEGRAM_BOT_TOKEN = config.TELEGRAM_BOT_TOKEN or "0:benchmark"
+
+    from monitoring import FlightMonitor
+    from metrics import metrics
+
+    monitor = FlightMonitor()
+    airports = ["JFK", "LAX", "ORD", "SFO", "BOS", "SEA", "MIA", "DEN"]
+    departure = datetime.utcnow() + timedelta(days=30)
+    for i in range(args.routes):
+        origin = airports[i % len(airports)]
+        destination = airports[(i + 1 + i // len(airports)) % len(airports)]
+        monitor.db.add_tracked_route("bench", origin, destination, max_price=400,
+                                     departure_date=departure)
+    routes = monitor.db.get_active_routes()
+
+    async def run():
+        began = time.perf_counter()
+        for route in routes:
+            await monitor._check_route(route)
+        per_route = time.perf_counter() - began
+        began = time.perf_counter()
+        for i in range(0, len(routes), args.batch):
+            await monitor._check_batch(routes[i:i + args.batch])
+        return per_route, time.perf_counter() - began
+
+    per_route, batched = asyncio.run(run())
+    timings = metrics.snapshot()["timings"]
+    os.remove(path)
+
+    print(f"routes={len(routes)} batch={args.batch} "
+          f"search_concurrency={config.MONITOR_SEARCH_CONCURRENCY} model={config.MODEL_NAME}")
+    print(f"{'path':<10}{'tokens/route':>14}{'s/route':>10}{'wall clock':>12}")
+    for name, mode, wall in [("per-route", "route", per_route), ("batched", "batch", batched)]:
+        tokens = timings.get(f"monitor.{mode}.tokens_per_route", {}).get("p50")
+        print(f"{name:<10}{f'{tokens:.0f}' if tokens else 'n/a':>14}"
+              f"{wall / len(routes):>10.2f}{wall:>11.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    polling = commands.add_parser("polling", help="Fixed vs adaptive route polling")
+    polling.add_argument("--routes", type=int, default=200)
+    polling.add_argument("--days", type=int, default=14)
+    polling.add_argument("--interval", type=int, default=30)
+    polling.add_argument("--seed", type=int, default=7)
+    polling.set_defaults(func=bench_polling)
+
+    booking = commands.add_parser("booking", help="Auto-booking latency against a stub provider")
+    booking.add_argument("--users", type=int, default=50)
+    booking.add_argument("--duplicates", type=int, default=3)
+    booking.add_argument("--concurrency", type=int, default=10)
+    booking.add_argument("--fare", type=float, default=400)
+    booking.add_argument("--cap", type=float, default=600)
+    booking.add_argument("--provider-ms", type=float, default=150)
+    booking.set_defaults(func=bench_booking)
+
+    retention = commands.add_parser("retention", help="Tiered price history storage and queries")
+    retention.add_argument("--routes", type=int, default=20)
+    retention.add_argument("--days", type=int, default=365)
+    retention.add_argument("--interval", type=int, default=60)
+    retention.add_argument("--seed", type=int, default=7)
+    retention.set_defaults(func=bench_retention)
+
+    fx = commands.add_parser("fx", help="Per-row vs vectorized currency normalization")
+    fx.add_argument("--flights", type=int, default=200)
+    fx.add_argument("--sets", type=int, default=500)
+    fx.add_argument("--seed", type=int, default=7)
+    fx.set_defaults(func=bench_fx)
+
+    restart = commands.add_parser("restart", help="Cold vs warm monitor restart")
+    restart.add_argument("--routes", type=int, default=5000)
+    restart.add_argument("--downtime", type=int, default=30)
+    restart.add_argument("--seed", type=int, default=7)
+    restart.set_defaults(func=bench_restart)
+
+    crew = commands.add_parser("crew", help="Per-route vs batched monitoring crews (calls the LLM)")
+    crew.add_argument("--routes", type=int, default=12)
+    crew.add_argument("--batch", type=int, default=6)
+    crew.set_defaults(func=bench_crew)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+Automatic booking on price drops, decided in code without an LLM round-trip
+"""
+import asyncio
+import hashlib
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+from database import Database
+from flight_results import FlightResults, RouteRecord
+from messages import render
+from metrics import metrics
+from models import BookingConfirmation
+from fx import symbol
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def idempotency_key(user_id: str, route_id: str, travel_date: date, flight: Dict) -> str:
+    """Same user, route, travel date and flight always map to the same key"""
+    raw = (f"{user_id}|{route_id}|{travel_date:%Y-%m-%d}|"
+           f"{flight['flight_number']}|{flight['departure_time']}")
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+class StubBookingProvider:
+    """Local stand-in for a booking API, honouring idempotency keys like a real one"""
+
+    def __init__(self, latency: float = 0.15):
+        self.latency = latency
+        self._confirmed: Dict[str, BookingConfirmation] = {}
+
+    async def book(self, key: str, profile: Dict, flight: Dict) -> BookingConfirmation:
+        await asyncio.sleep(self.latency)
+        if key not in self._confirmed:
+            self._confirmed[key] = BookingConfirmation(
+                reference=f"STUB-{uuid.uuid4().hex[:8].upper()}",
+                idempotency_key=key,
+                flight_number=flight['flight_number'],
+                amount=flight['price'],
+                currency=flight.get('currency', config.BASE_CURRENCY)
+            )
+        return self._confirmed[key]
+
+
+PROVIDERS = {"stub": StubBookingProvider}
+
+
+def auto_booking_available() -> bool:
+    """Auto-booking is on and a booking provider is configured"""
+    return config.ENABLE_AUTO_BOOKING and config.BOOKING_PROVIDER in PROVIDERS
+
+
+def create_booking_provider():
+    """The configured booking provider, or None when there is none to book with"""
+    provider = PROVIDERS.get(config.BOOKING_PROVIDER)
+    if provider is None:
+        logger.warning(
+            f"Auto-booking disabled: unknown BOOKING_PROVIDER {config.BOOKING_PROVIDER!r}"
+            if config.BOOKING_PROVIDER else "Auto-booking disabled: no BOOKING_PROVIDER configured"
+        )
+        return None
+    if provider is StubBookingProvider:
+        logger.warning("Auto-booking uses the stub provider; nothing is actually booked")
+    return provider()
+
+
+class AutoBooker:
+    """Books the cheapest flight when it falls under a route's auto-book limit"""
+
+    def __init__(self, db: Database, provider,
+                 notify: Callable[[str, str], Awaitable[None]] = None, reports=None):
+        self.db = db
+        self.provider = provider
+        self.notify = notify
+        self.reports = reports
+
+    def limit_for(self, route: RouteRecord) -> Optional[float]:
+        if not (config.ENABLE_AUTO_BOOKING and route.auto_book and route.max_price):
+            return None
+        return min(route.max_price, config.MAX_BOOKING)
+
+    def recover(self) -> int:
+        """
+        Fail pending bookings left by a crash and give back their spend, so
+        the next check retries them under the same idempotency key.
+        """
+        cutoff = datetime.utcnow() - timedelta(minutes=config.BOOKING_PENDING_TIMEOUT)
+        expired = self.db.expire_pending_bookings(cutoff)
+        if expired:
+            metrics.increment("booking.expired", expired)
+            logger.warning(f"Expired {expired} bookings pending since before {cutoff:%H:%M}")
+        return expired
+
+    async def consider(self, route: RouteRecord, flights: FlightResults,
+                       observed_at: datetime) -> Optional[BookingConfirmation]:
+        """Book if eligible; every check is a cheap in-process test until the provider call"""
+        limit = self.limit_for(route)
+        if limit is None or not len(flights):
+            return None
+        flight = flights.cheapest().row(0)
+        if flight['price'] > limit:
+            return None
+
+        profile = self.db.get_traveler_profile(route.user_id)
+        if not profile:
+            logger.info(f"Auto-book skipped for {route.id}: no validated traveler profile")
+            return None
+
+        travel_date = (route.departure_date or observed_at).date()
+        key = idempotency_key(route.user_id, route.id, travel_date, flight)
+        if not self.db.claim_booking(key, route.user_id, route.id,
+                                     flight['flight_number'], flight['price']):
+            # Another check already booked or is booking this flight
+            metrics.increment("booking.duplicates")
+            return None
+
+        if not self.db.reserve_spend(route.user_id, flight['price'],
+                                     config.BOOKING_MONTHLY_CAP, key):
+            self.db.finish_booking(key, "declined")
+            metrics.increment("booking.over_cap")
+            logger.info(f"Auto-book declined for {route.user_id}: monthly cap reached")
+            return None
+
+        try:
+            confirmation = await self.provider.book(key, profile, flight)
+        except Exception as e:
+            self.db.release_spend(route.user_id, flight['price'], key)
+            self.db.finish_booking(key, "failed")
+            metrics.increment("booking.failed")
+            logger.error(f"Auto-book failed for {route.id}: {e}")
+            return None
+
+        self.db.finish_booking(key, "confirmed", confirmation.reference)
+        self.db.deactivate_route(route.id)
+        latency = (datetime.utcnow() - observed_at).total_seconds()
+        metrics.increment("booking.confirmed")
+        metrics.observe("booking.observation_to_confirmation_seconds", latency)
+        self.db.log_action(route.user_id, "book_flight", {
+            "route_id": route.id, "flight_number": flight['flight_number'], "limit": limit
+        }, confirmation.model_dump(mode="json"))
+        if self.reports:
+            self.reports.record_booking(route.user_id, confirmation.amount)
+
+        if self.notify:
+            await self.notify(route.user_id, render(
+                "booking_confirmed",
+                origin=route.origin,
+                destination=route.destination,
+                flight_number=flight['flight_number'],
+                airline=flight['airline'],
+                departure=flight['departure_time'],
+                price=flight['price'],
+                reference=confirmation.reference,
+                limit=limit,
+                symbol=symbol(config.BASE_CURRENCY)
+            ))
+        return confirmation
\ No newline at end of file
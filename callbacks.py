@@ -0,0 +1,114 @@
+"""
+Compact callback_data encoding and a single dispatch table for inline buttons
+"""
+import base64
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Telegram limits callback_data to 64 bytes
+MAX_CALLBACK_BYTES = 64
+
+# Payload format version, bumped whenever field layouts change
+VERSION = "1"
+SEPARATOR = "|"
+# Marks a payload whose state lives in the short-ID cache
+REF_MARKER = "~"
+
+
+class StateCache:
+    """Short-ID lookup for callback state that doesn't fit in 64 bytes"""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: int = 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[str, ...]]]" = OrderedDict()
+
+    def put(self, values: Tuple[str, ...]) -> str:
+        # Same state always maps to the same ID, so repeated buttons share an entry
+        digest = hashlib.blake2b(SEPARATOR.join(values).encode(), digest_size=6).digest()
+        short_id = base64.urlsafe_b64encode(digest).decode().rstrip("=")
+        self._entries[short_id] = (time.time(), values)
+        self._entries.move_to_end(short_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return short_id
+
+    def get(self, short_id: str) -> Optional[Tuple[str, ...]]:
+        entry = self._entries.get(short_id)
+        if not entry:
+            return None
+        created, values = entry
+        if time.time() - created > self.ttl:
+            del self._entries[short_id]
+            return None
+        return values
+
+
+Handler = Callable[..., Awaitable[Any]]
+
+
+class CallbackRouter:
+    """Routing table from callback actions to handlers with typed positional state"""
+
+    def __init__(self, cache: StateCache = None):
+        self.cache = cache or StateCache()
+        self._routes: Dict[str, Tuple[Handler, Sequence[str]]] = {}
+
+    def route(self, action: str, handler: Handler, fields: Sequence[str] = ()):
+        if SEPARATOR in action:
+            raise ValueError(f"Action name may not contain '{SEPARATOR}': {action}")
+        self._routes[action] = (handler, tuple(fields))
+
+    def pack(self, action: str, **state) -> str:
+        """Encode an action and its state into callback_data"""
+        _, fields = self._routes[action]
+        if not fields:
+            return action
+
+        values = tuple("" if state.get(f) is None else str(state[f]) for f in fields)
+        data = SEPARATOR.join((VERSION, action) + values)
+        if len(data.encode()) <= MAX_CALLBACK_BYTES:
+            return data
+        return SEPARATOR.join((VERSION, action, REF_MARKER + self.cache.put(values)))
+
+    def unpack(self, data: str) -> Tuple[str, Dict[str, str]]:
+        """Decode callback_data into (action, state)"""
+        parts = data.split(SEPARATOR)
+        if len(parts) == 1:
+            # Bare action names carry no state
+            return parts[0], {}
+
+        version, action, values = parts[0], parts[1], parts[2:]
+        if version != VERSION:
+            raise KeyError(f"Unsupported callback version {version}")
+        if len(values) == 1 and values[0].startswith(REF_MARKER):
+            cached = self.cache.get(values[0][len(REF_MARKER):])
+            if cached is None:
+                raise KeyError("Callback state expired")
+            values = list(cached)
+
+        _, fields = self._routes[action]
+        return action, {f: v or None for f, v in zip(fields, values)}
+
+    async def dispatch(self, update, context):
+        """Single entry point for every callback query"""
+        query = update.callback_query
+        action = query.data.split(SEPARATOR)[1 if SEPARATOR in query.data else 0]
+        if action not in self._routes:
+            await query.answer("This feature isn't available yet.")
+            return
+
+        try:
+            action, state = self.unpack(query.data)
+        except KeyError as e:
+            logger.info(f"Unroutable callback {query.data!r}: {e}")
+            await query.answer("This button has expired. Please start again with /start.")
+            return
+
+        handler, _ = self._routes[action]
+        await handler(update, context, **state)
\ No newline at end of file
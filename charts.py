@@ -0,0 +1,198 @@
+"""
+Price history charts, rendered off the event loop and cached as PNGs
+"""
+import asyncio
+import io
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+from analytics import route_key
+from metrics import metrics
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Range keys as they appear in callback data, in days
+RANGES = {"7d": 7, "30d": 30, "90d": 90, "1y": 365}
+DEFAULT_RANGE = "30d"
+# Enough points for an 8-inch wide chart; more only costs render time
+MAX_POINTS = 200
+
+
+def _warm_worker():
+    """Pay the matplotlib import once per worker rather than on its first chart"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # noqa: F401
+    from matplotlib.figure import Figure  # noqa: F401
+
+
+def render_price_chart(title: str, times, lows, averages, highs) -> bytes:
+    """
+    PNG of the average price with its min-max band. Runs in a worker
+    process and draws on a bare Agg canvas, so no GUI backend or pyplot
+    state is involved.
+    """
+    import matplotlib.dates as mdates
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 4), dpi=110)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    ax.fill_between(times, lows, highs, color="#1f77b4", alpha=0.2, linewidth=0, label="min–max")
+    ax.plot(times, averages, color="#1f77b4", linewidth=1.8, label="average")
+    ax.set_title(title)
+    ax.set_ylabel(f"Price ({config.BASE_CURRENCY})")
+    ax.grid(alpha=0.3)
+    locator = mdates.AutoDateLocator()
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    ax.legend(loc="upper left", frameon=False)
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+class ChartImage:
+    """A rendered chart plus the Telegram file_id once it has been uploaded"""
+
+    __slots__ = ("png", "resolution", "low", "high", "latest", "file_id")
+
+    def __init__(self, png: bytes, resolution: str, low: float, high: float, latest: float):
+        self.png = png
+        self.resolution = resolution
+        self.low = low
+        self.high = high
+        self.latest = latest
+        self.file_id: Optional[str] = None
+
+
+class ChartService:
+    """
+    Renders route charts in a process pool and keeps the PNGs in an LRU
+    keyed by (route, range, history version). The version is the route's
+    newest observation time, so a cached chart is reused until the route
+    gets new data. Concurrent requests for the same chart share one render.
+    """
+
+    def __init__(self, history: "PriceHistory", workers: int = None, cache_size: int = None):
+        self.history = history
+        self.workers = workers or config.CHART_WORKERS
+        self.cache_size = cache_size or config.CHART_CACHE_SIZE
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._images: "OrderedDict[Tuple, ChartImage]" = OrderedDict()
+        self._rendering: Dict[Tuple, asyncio.Future] = {}
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned rather than forked, so workers don't inherit the bot's threads and sockets
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker
+            )
+        return self._pool
+
+    async def get(self, origin: str, destination: str,
+                  range_key: str = DEFAULT_RANGE) -> Optional[ChartImage]:
+        """Cached chart for the route and range, rendering it if needed; None without data"""
+        key = route_key(origin, destination)
+        version = await asyncio.to_thread(self.history.db.get_history_version, key)
+        cache_key = (key, range_key, version)
+
+        image = self._images.get(cache_key)
+        if image is not None:
+            self._images.move_to_end(cache_key)
+            metrics.increment("charts.cache_hits")
+            return image
+        if cache_key in self._rendering:
+            return await asyncio.shield(self._rendering[cache_key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._rendering[cache_key] = future
+        image = None
+        try:
+            image = await self._render(key, range_key)
+        except Exception as e:
+            logger.error(f"Chart render failed for {key} {range_key}: {e}")
+        finally:
+            del self._rendering[cache_key]
+            future.set_result(image)
+
+        if image is not None:
+            self._images[cache_key] = image
+            while len(self._images) > self.cache_size:
+                self._images.popitem(last=False)
+        return image
+
+    async def _render(self, key: str, range_key: str) -> Optional[ChartImage]:
+        end = datetime.utcnow()
+        series = await asyncio.to_thread(
+            self.history.series, key, end - timedelta(days=RANGES[range_key]), end, MAX_POINTS
+        )
+        series = series.dropna(subset=["avg"])
+        if series.empty:
+            return None
+
+        began = time.perf_counter()
+        png = await asyncio.get_running_loop().run_in_executor(
+            self.pool, render_price_chart,
+            f"{key.replace('-', ' → ')} · last {range_key}",
+            series["time"].to_numpy(), series["min"].to_numpy(),
+            series["avg"].to_numpy(), series["max"].to_numpy()
+        )
+        metrics.increment("charts.rendered")
+        metrics.observe("charts.render_seconds", time.perf_counter() - began)
+        return ChartImage(
+            png, series.attrs["resolution"],
+            float(series["min"].min()), float(series["max"].max()), float(series["avg"].iloc[-1])
+        )
+
+    async def send(self, message, image: ChartImage, caption: str, reply_markup=None):
+        """Reply with the chart, uploading the PNG only the first time"""
+        sent = await message.reply_photo(
+            photo=image.file_id or image.png,
+            caption=caption,
+            reply_markup=reply_markup,
+            parse_mode='HTML'
+        )
+        if image.file_id:
+            metrics.increment("charts.file_id_reuse")
+        elif sent.photo:
+            # file_ids work in any chat for this bot, so group chats reuse it too
+            image.file_id = sent.photo[-1].file_id
+        return sent
+
+    async def prerender(self, routes: Iterable[Tuple[str, str]],
+                        ranges: Sequence[str] = (DEFAULT_RANGE,)) -> int:
+        """Warm the cache for several routes at once; returns charts available"""
+        images = await asyncio.gather(*(
+            self.get(origin, destination, range_key)
+            for origin, destination in routes
+            for range_key in ranges
+        ))
+        return sum(image is not None for image in images)
+
+    async def prerender_popular(self):
+        """Keep the most tracked routes' default charts warm"""
+        while True:
+            try:
+                routes = await asyncio.to_thread(
+                    self.history.db.get_popular_routes, config.CHART_PRERENDER_ROUTES
+                )
+                ready = await self.prerender(routes)
+                logger.info(f"Pre-rendered {ready} charts for {len(routes)} popular routes")
+            except Exception as e:
+                logger.error(f"Chart pre-render failed: {e}")
+            await asyncio.sleep(config.CHART_PRERENDER_MINUTES * 60)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
\ No newline at end of file
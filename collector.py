@@ -0,0 +1,60 @@
+"""
+Per-run channel for typed tool results produced during a crew run
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from flight_results import FlightResults
+from fx import get_rates
+from models import PricePrediction
+
+_current: ContextVar[Optional["ResultCollector"]] = ContextVar("result_collector", default=None)
+
+
+class ResultCollector:
+    """Typed results published by tools while a crew runs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results: Dict[str, List[Any]] = {}
+
+    def add(self, kind: str, value: Any):
+        with self._lock:
+            self._results.setdefault(kind, []).append(value)
+
+    def get(self, kind: str) -> List[Any]:
+        with self._lock:
+            return list(self._results.get(kind, []))
+
+    def flights(self) -> FlightResults:
+        """Every flight any search tool returned during the run, priced in the base currency"""
+        records = []
+        for results in self.get("flights"):
+            records.extend(results.records())
+        return get_rates().normalize(FlightResults.from_records(records))
+
+    def best_price(self) -> Optional[float]:
+        return self.flights().min_price()
+
+    def prediction(self) -> Optional[PricePrediction]:
+        predictions = self.get("predictions")
+        return predictions[-1] if predictions else None
+
+
+@contextmanager
+def collecting():
+    """Collect tool results published within this context"""
+    collector = ResultCollector()
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+
+
+def publish(kind: str, value: Any):
+    """Hand a typed result to the active collector, if any"""
+    collector = _current.get()
+    if collector is not None:
+        collector.add(kind, value)
\ No newline at end of file
@@ -29,9 +29,71 @@ class Config:
     MAX_BOOKING = float(os.getenv("MAX_AUTO_BOOKING_AMOUNT", "1500"))
     CHECK_INTERVAL = int(os.getenv("DEFAULT_CHECK_INTERVAL", "30"))
     PRICE_THRESHOLD = float(os.getenv("PRICE_DROP_THRESHOLD", "5"))
+    BOOKING_MONTHLY_CAP = float(os.getenv("AUTO_BOOKING_MONTHLY_CAP", "3000"))
+    BOOKING_PROVIDER = os.getenv("BOOKING_PROVIDER", "")  # stub, for local testing only
+    # Pending bookings older than this are treated as crashed and retried
+    BOOKING_PENDING_TIMEOUT = int(os.getenv("BOOKING_PENDING_TIMEOUT_MINUTES", "30"))
+    
+    # Inbound admission
+    USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "20"))
+    USER_BURST = int(os.getenv("USER_BURST", "5"))
+    MAX_PENDING_CREWS = int(os.getenv("MAX_PENDING_CREWS", "8"))
+    
+    # Adaptive monitoring
+    MONITOR_TICK = int(os.getenv("MONITOR_TICK_MINUTES", "5"))
+    MIN_CHECK_INTERVAL = int(os.getenv("MIN_CHECK_INTERVAL", "10"))
+    MAX_CHECK_INTERVAL = int(os.getenv("MAX_CHECK_INTERVAL", "720"))
+    PROVIDER_BUDGET = float(os.getenv("PROVIDER_CALLS_PER_HOUR", "120"))
+    
+    # Route statistics
+    STATS_CACHE_SECONDS = int(os.getenv("STATS_CACHE_SECONDS", "60"))
+    
+    # Batched monitoring checks
+    MONITOR_BATCH_SIZE = int(os.getenv("MONITOR_BATCH_SIZE", "1"))  # routes per crew run; 1 = a crew per route
+    MONITOR_SEARCH_CONCURRENCY = int(os.getenv("MONITOR_SEARCH_CONCURRENCY", "5"))
+    
+    # Sharded monitoring
+    ENABLE_SHARDING = os.getenv("ENABLE_MONITOR_SHARDING", "false").lower() == "true"
+    NODE_TTL = int(os.getenv("MONITOR_NODE_TTL_SECONDS", "300"))
+    ROUTE_LEASE_TTL = int(os.getenv("ROUTE_LEASE_TTL_SECONDS", "600"))
+    
+    # Warm restarts
+    SNAPSHOT_PATH = os.getenv("MONITOR_SNAPSHOT_PATH", "monitor.snapshot")  # one file per monitor
+    SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE_MINUTES", "1440"))
+    RESUME_STAGGER_MINUTES = int(os.getenv("RESUME_STAGGER_MINUTES", "15"))
+    
+    # Progressive replies
+    ENABLE_STREAMING = os.getenv("ENABLE_STREAMING_RESULTS", "true").lower() == "true"
+    STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", "1.5"))
+    
+    # Price history retention
+    RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "14"))
+    HOURLY_RETENTION_DAYS = int(os.getenv("HOURLY_RETENTION_DAYS", "120"))
+    ROLLUP_BATCH = int(os.getenv("ROLLUP_BATCH_SIZE", "5000"))
+    
+    # Chart rendering
+    CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+    CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "256"))
+    CHART_PRERENDER_ROUTES = int(os.getenv("CHART_PRERENDER_ROUTES", "20"))
+    CHART_PRERENDER_MINUTES = int(os.getenv("CHART_PRERENDER_MINUTES", "60"))
+    
+    # Currency
+    BASE_CURRENCY = os.getenv("BASE_CURRENCY", "USD")
+    FX_RATES_SOURCE = os.getenv("FX_RATES_SOURCE")  # path to a rates JSON, or "stub"
+    FX_REFRESH_MINUTES = int(os.getenv("FX_REFRESH_MINUTES", "60"))
+    
+    # Price calendar
+    CALENDAR_TTL = int(os.getenv("CALENDAR_TTL_MINUTES", "180"))
+    CALENDAR_CONCURRENCY = int(os.getenv("CALENDAR_CONCURRENCY", "5"))
+    CALENDAR_WINDOW = int(os.getenv("CALENDAR_WINDOW_DAYS", "14"))
     
     # Database
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///flightbot.db")
     REDIS_URL = os.getenv("REDIS_URL")
+    EVENT_BUS = os.getenv("EVENT_BUS", "memory")  # memory | redis
+    # Redis entries idle this long on another consumer are taken over
+    EVENT_CLAIM_IDLE = int(os.getenv("EVENT_CLAIM_IDLE_SECONDS", "60"))
+    # Deliveries before an entry is moved to the dead-letter stream
+    EVENT_MAX_DELIVERIES = int(os.getenv("EVENT_MAX_DELIVERIES", "5"))
 
 config = Config()
\ No newline at end of file
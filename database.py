@@ -1,9 +1,14 @@
-from sqlalchemy import create_engine, Column, String, Float, DateTime, Integer, JSON, Boolean
+from sqlalchemy import create_engine, func, inspect, literal, or_, text, update, Index, Column, String, Float, Date, DateTime, Integer, JSON, Boolean
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime, timedelta
-from typing import List, Optional, Dict
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Optional, Dict
 from config import config
+from flight_results import FlightResults, RouteRecord
+import logging
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
@@ -50,12 +55,15 @@ class TrackedRoute(Base):
     origin = Column(String)
     destination = Column(String)
     max_price = Column(Float, nullable=True)
+    departure_date = Column(DateTime, nullable=True)
     check_frequency = Column(Integer, default=30)
     active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_check = Column(DateTime, nullable=True)
+    next_check = Column(DateTime, nullable=True, index=True)
     best_price = Column(Float, nullable=True)
     price_history = Column(JSON, default=list)
+    auto_book = Column(Boolean, default=False)
 
 class ExpenseRecord(Base):
     __tablename__ = "expense_records"
@@ -69,12 +77,147 @@ class ExpenseRecord(Base):
     flight_reference = Column(String, nullable=True)
     date = Column(DateTime, default=datetime.utcnow)
 
+class RouteStatistics(Base):
+    __tablename__ = "route_statistics"
+    
+    route_key = Column(String, primary_key=True)
+    stats = Column(JSON)
+    # Bumped on every write; updates are compare-and-set on it
+    version = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class UserStatistics(Base):
+    __tablename__ = "user_statistics"
+    
+    user_id = Column(String, primary_key=True)
+    stats = Column(JSON)
+    # Bumped on every write; compare-and-set guard for concurrent updates
+    version = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class PriceCalendarCell(Base):
+    __tablename__ = "price_calendar"
+    
+    route_key = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    lowest_price = Column(Float, nullable=True)
+    flight_number = Column(String, nullable=True)
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+
+class MonitorNode(Base):
+    __tablename__ = "monitor_nodes"
+    
+    node_id = Column(String, primary_key=True)
+    heartbeat_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+
+class RouteLease(Base):
+    __tablename__ = "route_leases"
+    
+    route_id = Column(String, primary_key=True)
+    owner = Column(String)
+    expires_at = Column(DateTime)
+
+class PriceObservation(Base):
+    __tablename__ = "price_observations"
+    __table_args__ = (Index("ix_price_observations_route_time", "route_key", "observed_at"),)
+    
+    id = Column(Integer, primary_key=True)
+    route_key = Column(String)
+    price = Column(Float)  # base currency
+    original_price = Column(Float, nullable=True)
+    original_currency = Column(String, nullable=True)
+    fx_version = Column(String, nullable=True)
+    observed_at = Column(DateTime, index=True)
+    # Kept so route statistics can be rebuilt from the tiers
+    departure_date = Column(DateTime, nullable=True)
+    airline = Column(String, nullable=True)
+    # Set in the transaction that folds the row into the rollup tiers
+    rolled_up = Column(Boolean, default=False, index=True)
+
+class PriceRollup(Base):
+    __tablename__ = "price_rollups"
+    
+    route_key = Column(String, primary_key=True)
+    resolution = Column(String, primary_key=True)  # hour | day
+    bucket_start = Column(DateTime, primary_key=True)
+    min_price = Column(Float)
+    max_price = Column(Float)
+    sum_price = Column(Float)
+    count = Column(Integer)
+
+class TravelerRecord(Base):
+    __tablename__ = "traveler_profiles"
+    
+    user_id = Column(String, primary_key=True)
+    full_name = Column(String)
+    email = Column(String)
+    phone = Column(String)
+    date_of_birth = Column(Date)
+    validated_at = Column(DateTime, nullable=True)
+
+class BookingRecord(Base):
+    __tablename__ = "bookings"
+    
+    id = Column(Integer, primary_key=True)
+    idempotency_key = Column(String, unique=True, nullable=False)
+    user_id = Column(String, index=True)
+    route_id = Column(String, index=True)
+    flight_number = Column(String)
+    amount = Column(Float)
+    status = Column(String)  # pending | confirmed | failed | declined
+    # Whether the amount is currently held against the user's monthly cap
+    spend_reserved = Column(Boolean, default=False)
+    provider_reference = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class SpendingCap(Base):
+    __tablename__ = "spending_caps"
+    
+    user_id = Column(String, primary_key=True)
+    monthly_limit = Column(Float)
+    spent = Column(Float, default=0.0)
+    period_start = Column(Date)
+
 class Database:
     def __init__(self):
         self.engine = create_engine(config.DATABASE_URL)
         Base.metadata.create_all(self.engine)
+        self._add_missing_columns()
         self.Session = sessionmaker(bind=self.engine)
     
+    def _add_missing_columns(self):
+        """
+        create_all only creates missing tables, so columns added to a model
+        after a deployment's database was created are ALTERed in here,
+        along with their indexes. Scalar defaults become column defaults so
+        existing rows get them too.
+        """
+        inspector = inspect(self.engine)
+        tables = set(inspector.get_table_names())
+        dialect = self.engine.dialect
+        quote = dialect.identifier_preparer.quote
+        with self.engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if table.name not in tables:
+                    continue
+                present = {c["name"] for c in inspector.get_columns(table.name)}
+                added = [c for c in table.columns if c.name not in present]
+                for column in added:
+                    ddl = (f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} "
+                           f"{column.type.compile(dialect)}")
+                    if column.default is not None and column.default.is_scalar:
+                        value = literal(column.default.arg).compile(
+                            dialect=dialect, compile_kwargs={"literal_binds": True}
+                        )
+                        ddl += f" DEFAULT {value}"
+                    conn.execute(text(ddl))
+                    logger.info(f"Added column {table.name}.{column.name}")
+                for index in table.indexes:
+                    if any(c in added for c in index.columns):
+                        index.create(conn, checkfirst=True)
+    
     def get_or_create_user(self, telegram_id: str, username: str = None, 
                            first_name: str = None):
         session = self.Session()
@@ -95,6 +238,33 @@ class Database:
         finally:
             session.close()
     
+    def set_display_currency(self, user_id: str, currency: str):
+        session = self.Session()
+        try:
+            user = session.query(User).filter_by(telegram_id=user_id).first()
+            if not user:
+                user = User(telegram_id=user_id, preferences={})
+                session.add(user)
+            # Reassigned rather than mutated so the JSON column is marked dirty
+            user.preferences = dict(user.preferences or {}, currency=currency)
+            session.commit()
+        finally:
+            session.close()
+    
+    def get_display_currencies(self, user_ids: List[str]) -> Dict[str, str]:
+        """Chosen display currency per user, for users who picked one"""
+        session = self.Session()
+        try:
+            rows = session.query(User.telegram_id, User.preferences).filter(
+                User.telegram_id.in_(user_ids)
+            ).all()
+            return {
+                user_id: prefs["currency"]
+                for user_id, prefs in rows if prefs and prefs.get("currency")
+            }
+        finally:
+            session.close()
+    
     def log_action(self, user_id: str, action_type: str, 
                    parameters: Dict, result: Dict = None, success: bool = True):
         session = self.Session()
@@ -112,7 +282,8 @@ class Database:
             session.close()
     
     def add_tracked_route(self, user_id: str, origin: str, destination: str, 
-                         max_price: float = None) -> str:
+                         max_price: float = None, departure_date: datetime = None,
+                         auto_book: bool = False, best_price: float = None) -> str:
         session = self.Session()
         try:
             route_id = f"{user_id}_{origin}_{destination}_{datetime.now().timestamp()}"
@@ -121,7 +292,10 @@ class Database:
                 user_id=user_id,
                 origin=origin,
                 destination=destination,
-                max_price=max_price
+                max_price=max_price,
+                departure_date=departure_date,
+                auto_book=auto_book,
+                best_price=best_price
             )
             session.add(route)
             session.commit()
@@ -129,12 +303,728 @@ class Database:
         finally:
             session.close()
     
-    def get_active_routes(self, user_id: str = None) -> List[Dict]:
+    def get_active_routes(self, user_id: str = None) -> List[RouteRecord]:
         session = self.Session()
         try:
-            query = session.query(TrackedRoute).filter_by(active=True)
+            columns = [getattr(TrackedRoute, name) for name in RouteRecord.__slots__]
+            query = session.query(*columns).filter(TrackedRoute.active == True)
             if user_id:
-                query = query.filter_by(user_id=user_id)
-            return [r.__dict__ for r in query.all()]
+                query = query.filter(TrackedRoute.user_id == user_id)
+            return [RouteRecord(**row._asdict()) for row in query.all()]
+        finally:
+            session.close()
+    
+    def get_popular_routes(self, limit: int = 20) -> List[tuple]:
+        """(origin, destination) pairs tracked by the most users"""
+        session = self.Session()
+        try:
+            return [tuple(row) for row in session.query(
+                TrackedRoute.origin, TrackedRoute.destination
+            ).filter(TrackedRoute.active == True).group_by(
+                TrackedRoute.origin, TrackedRoute.destination
+            ).order_by(func.count(TrackedRoute.id).desc()).limit(limit)]
+        finally:
+            session.close()
+    
+    def get_next_checks(self, route_ids: List[str]) -> Dict[str, Optional[datetime]]:
+        """Current next due time of each route that is still active"""
+        session = self.Session()
+        try:
+            return dict(session.query(TrackedRoute.id, TrackedRoute.next_check).filter(
+                TrackedRoute.id.in_(route_ids), TrackedRoute.active == True
+            ).all())
+        finally:
+            session.close()
+    
+    def get_price_histories(self, route_ids: List[str]) -> Dict[str, List[float]]:
+        session = self.Session()
+        try:
+            rows = session.query(TrackedRoute.id, TrackedRoute.price_history).filter(
+                TrackedRoute.id.in_(route_ids)
+            ).all()
+            return {
+                route_id: [point["price"] for point in history or []]
+                for route_id, history in rows
+            }
+        finally:
+            session.close()
+    
+    def schedule_routes(self, intervals: Dict[str, int], now: datetime = None):
+        """Store each route's check interval (minutes) and next due time"""
+        now = now or datetime.utcnow()
+        session = self.Session()
+        try:
+            for route_id, minutes in intervals.items():
+                session.query(TrackedRoute).filter_by(id=route_id).update({
+                    "check_frequency": minutes,
+                    "next_check": now + timedelta(minutes=minutes)
+                })
+            session.commit()
+        finally:
+            session.close()
+    
+    def set_next_checks(self, due: Dict[str, datetime]):
+        """Move routes' next due times without touching their intervals"""
+        session = self.Session()
+        try:
+            session.bulk_update_mappings(TrackedRoute, [
+                {"id": route_id, "next_check": next_check}
+                for route_id, next_check in due.items()
+            ])
+            session.commit()
+        finally:
+            session.close()
+    
+    def save_search(self, user_id: str, origin: str, destination: str,
+                    departure_date: datetime, results: FlightResults) -> int:
+        session = self.Session()
+        try:
+            search = FlightSearch(
+                user_id=user_id,
+                origin=origin,
+                destination=destination,
+                departure_date=departure_date,
+                lowest_price=results.min_price(),
+                results=results.to_dict()
+            )
+            session.add(search)
+            session.commit()
+            return search.id
+        finally:
+            session.close()
+    
+    def get_search_results(self, search_id: int) -> Optional[FlightResults]:
+        session = self.Session()
+        try:
+            search = session.query(FlightSearch).filter_by(id=search_id).first()
+            return FlightResults.from_dict(search.results) if search and search.results else None
+        finally:
+            session.close()
+    
+    def get_route_stats(self, route_key: str) -> Optional[Dict]:
+        session = self.Session()
+        try:
+            row = session.query(RouteStatistics).filter_by(route_key=route_key).first()
+            return row.stats if row else None
+        finally:
+            session.close()
+    
+    def save_route_stats(self, route_key: str, stats: Dict):
+        session = self.Session()
+        try:
+            row = session.query(RouteStatistics).filter_by(route_key=route_key).first()
+            if not row:
+                row = RouteStatistics(route_key=route_key)
+                session.add(row)
+            row.stats = stats
+            row.version = (row.version or 0) + 1
+            row.updated_at = datetime.utcnow()
+            session.commit()
+        finally:
+            session.close()
+    
+    def update_route_stats(self, route_key: str, apply: Callable[[Optional[Dict]], Dict],
+                           attempts: int = 10) -> Dict:
+        """
+        Read-modify-write of a route's statistics. The write only lands if
+        the row's version is unchanged since the read, otherwise apply runs
+        again on the newer stats, so concurrent writers never lose updates.
+        Works the same on SQLite, where row locks aren't available.
+        """
+        for _ in range(attempts):
+            session = self.Session()
+            try:
+                row = session.query(RouteStatistics.stats, RouteStatistics.version).filter_by(
+                    route_key=route_key
+                ).first()
+                if row is None:
+                    stats = apply(None)
+                    session.add(RouteStatistics(
+                        route_key=route_key, stats=stats, version=1, updated_at=datetime.utcnow()
+                    ))
+                    try:
+                        session.commit()
+                        return stats
+                    except IntegrityError:
+                        # Another writer created the row first
+                        session.rollback()
+                        continue
+                
+                version = row.version or 0
+                stats = apply(row.stats)
+                updated = session.query(RouteStatistics).filter(
+                    RouteStatistics.route_key == route_key,
+                    func.coalesce(RouteStatistics.version, 0) == version
+                ).update({
+                    "stats": stats, "version": version + 1, "updated_at": datetime.utcnow()
+                }, synchronize_session=False)
+                session.commit()
+                if updated:
+                    return stats
+            finally:
+                session.close()
+        raise RuntimeError(f"Route statistics for {route_key} kept changing during update")
+    
+    def get_route_stats_times(self) -> Dict[str, datetime]:
+        """When each route's statistics row was last written"""
+        session = self.Session()
+        try:
+            return dict(session.query(RouteStatistics.route_key, RouteStatistics.updated_at).all())
+        finally:
+            session.close()
+    
+    def get_user_stats(self, user_id: str) -> Optional[Dict]:
+        session = self.Session()
+        try:
+            row = session.get(UserStatistics, user_id)
+            return row.stats if row else None
+        finally:
+            session.close()
+    
+    def update_user_stats(self, user_id: str, apply: Callable[[Optional[Dict]], Dict],
+                          attempts: int = 10) -> Dict:
+        """
+        Read-modify-write of a user's aggregates, guarded by the row's
+        version like update_route_stats, so the bot and the monitor writing
+        the same user never lose each other's updates
+        """
+        return self._with_user_stats(user_id, apply, None, attempts)
+    
+    def _with_user_stats(self, user_id: str, apply: Callable[[Optional[Dict]], Dict],
+                         write: Optional[Callable], attempts: int = 10) -> Dict:
+        """
+        Run write(session), if given, and the versioned stats update in one
+        transaction; on a version conflict both are rolled back and retried
+        """
+        for _ in range(attempts):
+            session = self.Session()
+            try:
+                if write:
+                    write(session)
+                row = session.query(UserStatistics.stats, UserStatistics.version).filter_by(
+                    user_id=user_id
+                ).first()
+                if row is None:
+                    stats = apply(None)
+                    session.add(UserStatistics(
+                        user_id=user_id, stats=stats, version=1, updated_at=datetime.utcnow()
+                    ))
+                    try:
+                        session.commit()
+                        return stats
+                    except IntegrityError:
+                        # Another writer created the row first
+                        session.rollback()
+                        continue
+                
+                version = row.version or 0
+                stats = apply(row.stats)
+                updated = session.query(UserStatistics).filter(
+                    UserStatistics.user_id == user_id,
+                    func.coalesce(UserStatistics.version, 0) == version
+                ).update({
+                    "stats": stats, "version": version + 1, "updated_at": datetime.utcnow()
+                }, synchronize_session=False)
+                if updated:
+                    session.commit()
+                    return stats
+                session.rollback()
+            finally:
+                session.close()
+        raise RuntimeError(f"User statistics for {user_id} kept changing during update")
+    
+    def save_user_stats(self, stats: Dict[str, Dict]):
+        session = self.Session()
+        try:
+            rows = {row.user_id: row for row in session.query(UserStatistics).filter(
+                UserStatistics.user_id.in_(list(stats))
+            )}
+            for user_id, entry in stats.items():
+                row = rows.get(user_id)
+                if row is None:
+                    row = UserStatistics(user_id=user_id)
+                    session.add(row)
+                row.stats = entry
+                # A rebuild replaces the aggregates; in-flight updates must re-read
+                row.version = (row.version or 0) + 1
+                row.updated_at = datetime.utcnow()
+            session.commit()
+        finally:
+            session.close()
+    
+    def add_expense(self, user_id: str, amount: float, currency: str, category: str,
+                    description: str = "", date: datetime = None,
+                    apply: Callable[[Optional[Dict]], Dict] = None) -> int:
+        """Insert one expense; with apply, the user's aggregates update in the same transaction"""
+        added: List[int] = []
+        def write(session):
+            expense = ExpenseRecord(
+                user_id=user_id,
+                amount=amount,
+                currency=currency,
+                category=category,
+                description=description,
+                date=date or datetime.utcnow()
+            )
+            session.add(expense)
+            session.flush()
+            added.append(expense.id)
+        if apply:
+            self._with_user_stats(user_id, apply, write)
+            return added[-1]
+        
+        session = self.Session()
+        try:
+            write(session)
+            session.commit()
+            return added[-1]
+        finally:
+            session.close()
+    
+    def add_expenses(self, user_id: str, rows: List[Dict],
+                     apply: Callable[[Optional[Dict]], Dict] = None):
+        """Bulk insert for imports; with apply, the aggregates update in the same transaction"""
+        def write(session):
+            session.bulk_insert_mappings(ExpenseRecord, [
+                dict(row, user_id=user_id) for row in rows
+            ])
+        if apply:
+            self._with_user_stats(user_id, apply, write)
+            return
+        
+        session = self.Session()
+        try:
+            write(session)
+            session.commit()
+        finally:
+            session.close()
+    
+    def get_calendar_cells(self, route_key: str, start: date, end: date) -> Dict[date, Dict]:
+        session = self.Session()
+        try:
+            rows = session.query(PriceCalendarCell).filter(
+                PriceCalendarCell.route_key == route_key,
+                PriceCalendarCell.day >= start,
+                PriceCalendarCell.day <= end
+            ).all()
+            return {
+                r.day: {
+                    "price": r.lowest_price,
+                    "flight_number": r.flight_number,
+                    "fetched_at": r.fetched_at
+                }
+                for r in rows
+            }
+        finally:
+            session.close()
+    
+    def save_calendar_cells(self, route_key: str, cells: List[Dict]):
+        session = self.Session()
+        try:
+            now = datetime.utcnow()
+            for cell in cells:
+                session.merge(PriceCalendarCell(
+                    route_key=route_key,
+                    day=cell["day"],
+                    lowest_price=cell["price"],
+                    flight_number=cell.get("flight_number"),
+                    fetched_at=now
+                ))
+            session.commit()
+        finally:
+            session.close()
+    
+    def heartbeat_node(self, node_id: str):
+        session = self.Session()
+        try:
+            node = session.query(MonitorNode).filter_by(node_id=node_id).first()
+            if not node:
+                session.add(MonitorNode(node_id=node_id))
+            else:
+                node.heartbeat_at = datetime.utcnow()
+            session.commit()
+        finally:
+            session.close()
+    
+    def remove_node(self, node_id: str):
+        session = self.Session()
+        try:
+            session.query(MonitorNode).filter_by(node_id=node_id).delete()
+            session.query(RouteLease).filter_by(owner=node_id).delete()
+            session.commit()
+        finally:
+            session.close()
+    
+    def get_live_nodes(self, since: datetime) -> List[str]:
+        session = self.Session()
+        try:
+            rows = session.query(MonitorNode.node_id).filter(
+                MonitorNode.heartbeat_at >= since
+            ).all()
+            return sorted(r.node_id for r in rows)
+        finally:
+            session.close()
+    
+    def acquire_route_lease(self, route_id: str, owner: str, ttl: timedelta) -> bool:
+        """Atomically take a route lease that is free, expired or already ours"""
+        now = datetime.utcnow()
+        session = self.Session()
+        try:
+            updated = session.query(RouteLease).filter(
+                RouteLease.route_id == route_id,
+                or_(RouteLease.owner == owner, RouteLease.expires_at < now)
+            ).update({"owner": owner, "expires_at": now + ttl}, synchronize_session=False)
+            if not updated:
+                session.add(RouteLease(route_id=route_id, owner=owner, expires_at=now + ttl))
+            session.commit()
+            return True
+        except IntegrityError:
+            # Another node holds a live lease
+            session.rollback()
+            return False
+        finally:
+            session.close()
+    
+    def release_route_lease(self, route_id: str, owner: str):
+        session = self.Session()
+        try:
+            session.query(RouteLease).filter_by(route_id=route_id, owner=owner).delete()
+            session.commit()
+        finally:
+            session.close()
+    
+    def deactivate_route(self, route_id: str):
+        session = self.Session()
+        try:
+            session.query(TrackedRoute).filter_by(id=route_id).update({"active": False})
+            session.commit()
+        finally:
+            session.close()
+    
+    def save_traveler_profile(self, user_id: str, profile: Dict):
+        """Store a profile that has already passed TravelerProfile validation"""
+        session = self.Session()
+        try:
+            session.merge(TravelerRecord(
+                user_id=user_id,
+                validated_at=datetime.utcnow(),
+                **profile
+            ))
+            session.commit()
+        finally:
+            session.close()
+    
+    def get_traveler_profile(self, user_id: str) -> Optional[Dict]:
+        session = self.Session()
+        try:
+            row = session.query(TravelerRecord).filter(
+                TravelerRecord.user_id == user_id,
+                TravelerRecord.validated_at.isnot(None)
+            ).first()
+            if not row:
+                return None
+            return {
+                "full_name": row.full_name,
+                "email": row.email,
+                "phone": row.phone,
+                "date_of_birth": row.date_of_birth,
+            }
+        finally:
+            session.close()
+    
+    def claim_booking(self, key: str, user_id: str, route_id: str,
+                      flight_number: str, amount: float) -> bool:
+        """
+        Insert the booking as pending under its idempotency key. Only one
+        claimant wins; only an attempt that failed at the provider may be retried.
+        """
+        now = datetime.utcnow()
+        session = self.Session()
+        try:
+            session.add(BookingRecord(
+                idempotency_key=key, user_id=user_id, route_id=route_id,
+                flight_number=flight_number, amount=amount, status="pending",
+                created_at=now, updated_at=now
+            ))
+            session.commit()
+            return True
+        except IntegrityError:
+            session.rollback()
+            retried = session.query(BookingRecord).filter(
+                BookingRecord.idempotency_key == key,
+                BookingRecord.status == "failed"
+            ).update({"status": "pending", "amount": amount, "updated_at": now},
+                     synchronize_session=False)
+            session.commit()
+            return bool(retried)
+        finally:
+            session.close()
+    
+    def finish_booking(self, key: str, status: str, reference: str = None):
+        session = self.Session()
+        try:
+            booking = session.query(BookingRecord).filter_by(idempotency_key=key).first()
+            booking.status = status
+            booking.provider_reference = reference
+            booking.updated_at = datetime.utcnow()
+            if status == "confirmed":
+                session.query(User).filter_by(telegram_id=booking.user_id).update(
+                    {"total_bookings": User.total_bookings + 1}, synchronize_session=False
+                )
+            session.commit()
+        finally:
+            session.close()
+    
+    def reserve_spend(self, user_id: str, amount: float, default_limit: float,
+                      booking_key: str = None) -> bool:
+        """
+        Atomically add amount to this month's spend if it stays within the cap,
+        marking the booking as holding it in the same transaction
+        """
+        month = date.today().replace(day=1)
+        session = self.Session()
+        try:
+            for _ in range(2):
+                # Start a new period lazily on the first booking of the month
+                session.query(SpendingCap).filter(
+                    SpendingCap.user_id == user_id,
+                    SpendingCap.period_start < month
+                ).update({"spent": 0.0, "period_start": month}, synchronize_session=False)
+                
+                reserved = session.execute(
+                    update(SpendingCap)
+                    .where(SpendingCap.user_id == user_id,
+                           SpendingCap.spent + amount <= SpendingCap.monthly_limit)
+                    .values(spent=SpendingCap.spent + amount)
+                ).rowcount
+                if reserved:
+                    self._mark_reserved(session, booking_key, True)
+                    session.commit()
+                    return True
+                if session.query(SpendingCap).filter_by(user_id=user_id).first():
+                    session.rollback()
+                    return False
+                
+                if amount > default_limit:
+                    return False
+                try:
+                    session.add(SpendingCap(user_id=user_id, monthly_limit=default_limit,
+                                            spent=amount, period_start=month))
+                    self._mark_reserved(session, booking_key, True)
+                    session.commit()
+                    return True
+                except IntegrityError:
+                    # Created concurrently; go round once more and use the row
+                    session.rollback()
+            return False
+        finally:
+            session.close()
+    
+    def release_spend(self, user_id: str, amount: float, booking_key: str = None):
+        session = self.Session()
+        try:
+            session.execute(
+                update(SpendingCap)
+                .where(SpendingCap.user_id == user_id)
+                .values(spent=SpendingCap.spent - amount)
+            )
+            self._mark_reserved(session, booking_key, False)
+            session.commit()
+        finally:
+            session.close()
+    
+    @staticmethod
+    def _mark_reserved(session, booking_key: Optional[str], reserved: bool):
+        if booking_key:
+            session.query(BookingRecord).filter_by(idempotency_key=booking_key).update(
+                {"spend_reserved": reserved}, synchronize_session=False
+            )
+    
+    def expire_pending_bookings(self, before: datetime) -> int:
+        """
+        Fail bookings still pending since before the cutoff and release the
+        spend they hold. Each row is taken with a conditional update, so an
+        attempt that finishes meanwhile, or another node expiring it, wins.
+        """
+        session = self.Session()
+        try:
+            stale = session.query(
+                BookingRecord.idempotency_key, BookingRecord.user_id,
+                BookingRecord.amount, BookingRecord.spend_reserved
+            ).filter(
+                BookingRecord.status == "pending",
+                BookingRecord.updated_at < before
+            ).all()
+            expired = 0
+            for key, user_id, amount, reserved in stale:
+                taken = session.query(BookingRecord).filter(
+                    BookingRecord.idempotency_key == key,
+                    BookingRecord.status == "pending",
+                    BookingRecord.updated_at < before
+                ).update({"status": "failed", "spend_reserved": False,
+                          "updated_at": datetime.utcnow()}, synchronize_session=False)
+                if taken and reserved:
+                    session.execute(
+                        update(SpendingCap)
+                        .where(SpendingCap.user_id == user_id)
+                        .values(spent=SpendingCap.spent - amount)
+                    )
+                session.commit()
+                expired += taken
+            return expired
+        finally:
+            session.close()
+    
+    def get_unrolled_observations(self, limit: int) -> List[tuple]:
+        """(id, route_key, price, observed_at) for raw rows not yet rolled up"""
+        session = self.Session()
+        try:
+            return [tuple(row) for row in session.query(
+                PriceObservation.id, PriceObservation.route_key,
+                PriceObservation.price, PriceObservation.observed_at
+            ).filter(PriceObservation.rolled_up == False).order_by(
+                PriceObservation.id
+            ).limit(limit)]
+        finally:
+            session.close()
+    
+    def apply_rollups(self, ids: List[int], buckets: Dict[tuple, List[float]]) -> bool:
+        """
+        Fold aggregates into the rollup tables and mark their rows rolled up in
+        one transaction. Rows are marked only if none was marked already, so
+        two monitors rolling up at once can't count the same rows twice.
+        buckets: (route_key, resolution, bucket_start) -> [min, max, sum, count]
+        """
+        session = self.Session()
+        try:
+            marked = session.query(PriceObservation).filter(
+                PriceObservation.id.in_(ids),
+                PriceObservation.rolled_up == False
+            ).update({"rolled_up": True}, synchronize_session=False)
+            if marked != len(ids):
+                session.rollback()
+                return False
+            
+            # One query for the buckets this batch touches; they are usually few and recent
+            existing = {}
+            if buckets:
+                for row in session.query(PriceRollup).filter(
+                    PriceRollup.route_key.in_({key for key, _, _ in buckets}),
+                    PriceRollup.bucket_start >= min(start for _, _, start in buckets)
+                ):
+                    existing[(row.route_key, row.resolution, row.bucket_start)] = row
+            
+            new_rows = []
+            for (key, resolution, start), (low, high, total, count) in buckets.items():
+                row = existing.get((key, resolution, start))
+                if row is None:
+                    new_rows.append({
+                        "route_key": key, "resolution": resolution, "bucket_start": start,
+                        "min_price": low, "max_price": high, "sum_price": total, "count": count
+                    })
+                else:
+                    row.min_price = min(row.min_price, low)
+                    row.max_price = max(row.max_price, high)
+                    row.sum_price += total
+                    row.count += count
+            session.bulk_insert_mappings(PriceRollup, new_rows)
+            session.commit()
+            return True
+        except IntegrityError:
+            session.rollback()
+            return False
+        finally:
+            session.close()
+    
+    def expire_price_history(self, raw_before: datetime, hourly_before: datetime) -> Dict[str, int]:
+        """Drop raw rows past their window (only once rolled up) and old hourly buckets"""
+        session = self.Session()
+        try:
+            raw = session.query(PriceObservation).filter(
+                PriceObservation.observed_at < raw_before,
+                PriceObservation.rolled_up == True
+            ).delete(synchronize_session=False)
+            hourly = session.query(PriceRollup).filter(
+                PriceRollup.resolution == "hour",
+                PriceRollup.bucket_start < hourly_before
+            ).delete(synchronize_session=False)
+            session.commit()
+            return {"raw": raw, "hour": hourly}
+        finally:
+            session.close()
+    
+    def get_history_version(self, route_key: str) -> Optional[datetime]:
+        """Time of the route's newest observation; every tier changes only when this does"""
+        session = self.Session()
+        try:
+            return session.query(func.max(PriceObservation.observed_at)).filter(
+                PriceObservation.route_key == route_key
+            ).scalar()
+        finally:
+            session.close()
+    
+    def count_observations(self, route_key: str, start: datetime, end: datetime) -> int:
+        session = self.Session()
+        try:
+            return session.query(PriceObservation).filter(
+                PriceObservation.route_key == route_key,
+                PriceObservation.observed_at >= start,
+                PriceObservation.observed_at < end
+            ).count()
+        finally:
+            session.close()
+    
+    def get_observation_series(self, route_key: str, start: datetime,
+                               end: datetime) -> List[tuple]:
+        """(observed_at, price) in time order"""
+        session = self.Session()
+        try:
+            return [tuple(row) for row in session.query(
+                PriceObservation.observed_at, PriceObservation.price
+            ).filter(
+                PriceObservation.route_key == route_key,
+                PriceObservation.observed_at >= start,
+                PriceObservation.observed_at < end
+            ).order_by(PriceObservation.observed_at)]
+        finally:
+            session.close()
+    
+    def get_observations_for_stats(self) -> List[tuple]:
+        """(route_key, price, observed_at, departure_date, airline, rolled_up) for every raw row"""
+        session = self.Session()
+        try:
+            return [tuple(row) for row in session.query(
+                PriceObservation.route_key, PriceObservation.price,
+                PriceObservation.observed_at, PriceObservation.departure_date,
+                PriceObservation.airline, PriceObservation.rolled_up
+            )]
+        finally:
+            session.close()
+    
+    def get_rollups(self, resolution: str) -> List[tuple]:
+        """(route_key, bucket_start, min, max, sum, count) for every bucket of a tier"""
+        session = self.Session()
+        try:
+            return [tuple(row) for row in session.query(
+                PriceRollup.route_key, PriceRollup.bucket_start, PriceRollup.min_price,
+                PriceRollup.max_price, PriceRollup.sum_price, PriceRollup.count
+            ).filter(PriceRollup.resolution == resolution)]
+        finally:
+            session.close()
+    
+    def get_rollup_series(self, route_key: str, resolution: str, start: datetime,
+                          end: datetime) -> List[tuple]:
+        """(bucket_start, min, max, sum, count) in time order"""
+        session = self.Session()
+        try:
+            return [tuple(row) for row in session.query(
+                PriceRollup.bucket_start, PriceRollup.min_price, PriceRollup.max_price,
+                PriceRollup.sum_price, PriceRollup.count
+            ).filter(
+                PriceRollup.route_key == route_key,
+                PriceRollup.resolution == resolution,
+                PriceRollup.bucket_start >= start,
+                PriceRollup.bucket_start < end
+            ).order_by(PriceRollup.bucket_start)]
         finally:
             session.close()
\ No newline at end of file
@@ -0,0 +1,280 @@
+"""
+Publish/subscribe stream for price events, in-process or on Redis Streams
+"""
+import asyncio
+import json
+import os
+import socket
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Type
+from pydantic import BaseModel
+from models import PriceObserved, PriceDropped
+from metrics import metrics
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES: Dict[str, Type[BaseModel]] = {
+    "PriceObserved": PriceObserved,
+    "PriceDropped": PriceDropped,
+}
+
+BatchHandler = Callable[[List[BaseModel]], Awaitable[None]]
+
+
+def topic_of(event: BaseModel) -> str:
+    return type(event).__name__
+
+
+class InMemoryEventBus:
+    """asyncio queues, one per (topic, consumer group), consumed in batches"""
+
+    def __init__(self, max_wait: float = 0.5):
+        self.max_wait = max_wait
+        self._groups: Dict[str, List[Tuple[str, asyncio.Queue]]] = {}
+        self._consumers: List[Tuple[asyncio.Queue, BatchHandler, int, str]] = []
+        self._tasks: List[asyncio.Task] = []
+        # Deliveries published but not yet handled, across all groups
+        self._in_flight = 0
+
+    def subscribe(self, topic: str, group: str, handler: BatchHandler, batch_size: int = 50):
+        queue: asyncio.Queue = asyncio.Queue()
+        self._groups.setdefault(topic, []).append((group, queue))
+        self._consumers.append((queue, handler, batch_size, f"{topic}/{group}"))
+
+    async def publish(self, event: BaseModel):
+        # Every group gets its own copy, like consumer groups on a stream
+        for _, queue in self._groups.get(topic_of(event), []):
+            self._in_flight += 1
+            queue.put_nowait(event)
+
+    async def start(self):
+        for queue, handler, batch_size, name in self._consumers:
+            self._tasks.append(asyncio.create_task(
+                self._consume(queue, handler, batch_size, name)
+            ))
+
+    async def _consume(self, queue: asyncio.Queue, handler: BatchHandler,
+                       batch_size: int, name: str):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await handler(batch)
+            except Exception as e:
+                logger.error(f"Subscriber {name} failed on {len(batch)} events: {e}")
+            finally:
+                self._in_flight -= len(batch)
+
+    async def drain(self):
+        """Wait until every subscriber has handled everything published so far"""
+        # Includes follow-up events that handlers publish while draining
+        while self._in_flight:
+            await asyncio.sleep(0.01)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class RedisStreamBus:
+    """
+    Redis Streams with consumer groups and one XACK per processed batch.
+    Entries left pending by a consumer that went away are claimed by the
+    others once idle, and an entry delivered max_deliveries times without
+    being acknowledged is moved to the topic's dead-letter stream.
+    """
+
+    def __init__(self, url: str, block_ms: int = 1000, maxlen: int = 100000,
+                 claim_idle: int = None, max_deliveries: int = None):
+        import redis.asyncio as redis
+        self.client = redis.Redis.from_url(url)
+        self.block_ms = block_ms
+        self.maxlen = maxlen
+        self.claim_idle_ms = (claim_idle or config.EVENT_CLAIM_IDLE) * 1000
+        self.max_deliveries = max_deliveries or config.EVENT_MAX_DELIVERIES
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._subscriptions: List[Tuple[str, str, BatchHandler, int]] = []
+        self._tasks: List[asyncio.Task] = []
+
+    @staticmethod
+    def stream(topic: str) -> str:
+        return f"flightbot:events:{topic}"
+
+    @staticmethod
+    def dead_letters(topic: str) -> str:
+        return f"flightbot:dead:{topic}"
+
+    def subscribe(self, topic: str, group: str, handler: BatchHandler, batch_size: int = 50):
+        self._subscriptions.append((topic, group, handler, batch_size))
+
+    async def publish(self, event: BaseModel):
+        await self.client.xadd(
+            self.stream(topic_of(event)),
+            {"data": event.model_dump_json()},
+            maxlen=self.maxlen,
+            approximate=True
+        )
+
+    async def start(self):
+        import redis.exceptions
+        for topic, group, handler, batch_size in self._subscriptions:
+            try:
+                await self.client.xgroup_create(self.stream(topic), group, id="0", mkstream=True)
+            except redis.exceptions.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+            self._tasks.append(asyncio.create_task(
+                self._consume(topic, group, handler, batch_size)
+            ))
+
+    async def _reclaim(self, stream: str, group: str) -> int:
+        """Take over entries idle on other consumers, e.g. from a process that died"""
+        claimed, start = 0, "0-0"
+        while True:
+            response = await self.client.xautoclaim(
+                stream, group, self.consumer, self.claim_idle_ms, start_id=start, count=100
+            )
+            start, entries = response[0], response[1]
+            claimed += len(entries)
+            if start in (b"0-0", "0-0"):
+                return claimed
+
+    async def _bury(self, topic: str, group: str, entry_id, fields: Optional[dict], reason: str):
+        """Copy one entry to the dead-letter stream and acknowledge it"""
+        data = (fields or {}).get(b"data", b"")
+        await self.client.xadd(self.dead_letters(topic), {
+            "data": data, "group": group, "id": entry_id, "reason": reason
+        }, maxlen=self.maxlen, approximate=True)
+        await self.client.xack(self.stream(topic), group, entry_id)
+        metrics.increment("events.dead_lettered")
+        logger.error(f"Dead-lettered {topic}/{group} entry {entry_id!r}: {reason}")
+
+    async def _dead_letter(self, topic: str, group: str, entries: List[tuple]) -> List[tuple]:
+        """Move entries delivered too often to the dead-letter stream; return the rest"""
+        pending = await self.client.xpending_range(
+            self.stream(topic), group, min=entries[0][0], max=entries[-1][0],
+            count=len(entries), consumername=self.consumer
+        )
+        deliveries = {p["message_id"]: p["times_delivered"] for p in pending}
+        rest = []
+        for entry_id, fields in entries:
+            times = deliveries.get(entry_id, 0)
+            if times >= self.max_deliveries:
+                await self._bury(topic, group, entry_id, fields, f"{times} deliveries")
+            else:
+                rest.append((entry_id, fields))
+        return rest
+
+    async def _decode(self, topic: str, group: str, entries: List[tuple]) -> List[tuple]:
+        """
+        (entry_id, event) for each entry that parses. Entries trimmed by
+        maxlen (no fields) or that aren't valid events are dead-lettered,
+        since no retry can make them readable.
+        """
+        event_type = EVENT_TYPES[topic]
+        decoded = []
+        for entry_id, fields in entries:
+            try:
+                if not fields or b"data" not in fields:
+                    raise ValueError("no data, trimmed from the stream")
+                decoded.append((entry_id, event_type(**json.loads(fields[b"data"]))))
+            except (ValueError, TypeError) as e:
+                # ValidationError and JSONDecodeError are both ValueErrors
+                await self._bury(topic, group, entry_id, fields, f"undecodable: {e}")
+        return decoded
+
+    async def _consume(self, topic: str, group: str, handler: BatchHandler, batch_size: int):
+        stream = self.stream(topic)
+        loop = asyncio.get_running_loop()
+        reclaim_at = loop.time()
+        # Re-deliver anything this consumer read but never acknowledged; after
+        # a failure one entry at a time, so a bad entry can't hold up the rest
+        cursor, count = "0", batch_size
+        while True:
+            try:
+                if loop.time() >= reclaim_at:
+                    reclaim_at = loop.time() + self.claim_idle_ms / 1000
+                    if await self._reclaim(stream, group):
+                        cursor = "0"
+
+                response = await self.client.xreadgroup(
+                    group, self.consumer, {stream: cursor}, count=count, block=self.block_ms
+                )
+                entries = response[0][1] if response else []
+                if not entries:
+                    cursor, count = ">", batch_size
+                    continue
+                if cursor == "0":
+                    entries = await self._dead_letter(topic, group, entries)
+                decoded = await self._decode(topic, group, entries)
+                if not decoded:
+                    continue
+
+                ids = [entry_id for entry_id, _ in decoded]
+                events = [event for _, event in decoded]
+                try:
+                    await handler(events)
+                except Exception as e:
+                    # Left unacknowledged and re-read from this consumer's pending list
+                    logger.error(f"Subscriber {topic}/{group} failed on {len(events)} events: {e}")
+                    cursor, count = "0", 1
+                    await asyncio.sleep(1)
+                    continue
+                await self.client.xack(stream, group, *ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # A dropped connection or other Redis error; keep the subscriber
+                # alive and re-read its pending list once Redis answers again
+                logger.error(f"Consumer {topic}/{group} hit a Redis error, retrying: {e}")
+                metrics.increment("events.consumer_errors")
+                cursor = "0"
+                await asyncio.sleep(1)
+
+    async def drain(self, timeout: float = 30.0):
+        """
+        Wait until no group has unread entries and this consumer has none
+        unacknowledged; other consumers' pending entries are theirs to finish
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            busy = False
+            for topic, group, _, _ in self._subscriptions:
+                stream = self.stream(topic)
+                for info in await self.client.xinfo_groups(stream):
+                    if info["name"].decode() == group and info.get("lag"):
+                        busy = True
+                if not busy and await self.client.xpending_range(
+                    stream, group, min="-", max="+", count=1, consumername=self.consumer
+                ):
+                    busy = True
+            if not busy:
+                return
+            await asyncio.sleep(0.1)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.client.close()
+
+
+def create_event_bus():
+    """Redis Streams when configured, otherwise in-process queues"""
+    if config.EVENT_BUS == "redis" and config.REDIS_URL:
+        return RedisStreamBus(config.REDIS_URL)
+    return InMemoryEventBus()
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+Compact containers for flight result sets and tracked route records
+"""
+import json
+import numpy as np
+from datetime import datetime
+from typing import Dict, List, Any, Iterable, Optional
+from models import Flight
+
+# Alternate keys used by raw tool output
+ALIASES = {"departure_time": "departure", "arrival_time": "arrival"}
+
+# Column name -> default for records that don't provide it
+STRING_COLUMNS = {
+    "flight_number": "",
+    "airline": "",
+    "origin": "",
+    "destination": "",
+    "departure_time": "",
+    "arrival_time": "",
+    "currency": "USD",
+    "booking_class": "economy",
+    "booking_url": None,
+    # Provider currency, set once prices are normalized to the base currency
+    "original_currency": None,
+}
+NUMERIC_COLUMNS = {
+    "price": (np.float64, 0.0),
+    "stops": (np.int16, 0),
+    "duration_minutes": (np.int32, 0),
+    "available_seats": (np.int32, -1),
+    "original_price": (np.float64, np.nan),
+}
+
+
+def _duration_from_times(departure: str, arrival: str) -> int:
+    """Best-effort duration for records that only carry HH:MM times"""
+    try:
+        dep = datetime.strptime(departure, "%H:%M")
+        arr = datetime.strptime(arrival, "%H:%M")
+    except (TypeError, ValueError):
+        return 0
+    minutes = int((arr - dep).total_seconds() // 60)
+    return minutes if minutes >= 0 else minutes + 24 * 60
+
+
+class FlightResults:
+    """Columnar flight result set with vectorized sort and filter"""
+
+    __slots__ = ("columns",)
+
+    def __init__(self, columns: Dict[str, Any]):
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns["price"])
+
+    @classmethod
+    def empty(cls) -> "FlightResults":
+        return cls.from_records([])
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict]) -> "FlightResults":
+        """Build from tool output rows without per-row validation"""
+        records = list(records)
+        columns: Dict[str, Any] = {}
+        for name, default in STRING_COLUMNS.items():
+            columns[name] = [r.get(name, r.get(ALIASES.get(name), default))
+                             for r in records]
+        for name, (dtype, default) in NUMERIC_COLUMNS.items():
+            values = [r.get(name) for r in records]
+            columns[name] = np.array(
+                [default if v is None else v for v in values], dtype=dtype
+            )
+
+        missing = columns["duration_minutes"] == 0
+        if missing.any():
+            for i in np.flatnonzero(missing):
+                columns["duration_minutes"][i] = _duration_from_times(
+                    columns["departure_time"][i], columns["arrival_time"][i]
+                )
+        return cls(columns)
+
+    @classmethod
+    def from_flights(cls, flights: List[Flight]) -> "FlightResults":
+        return cls.from_records(
+            [f.model_dump(mode="json") for f in flights]
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, List]) -> "FlightResults":
+        """Wrap the columnar JSON stored in FlightSearch.results"""
+        columns: Dict[str, Any] = {}
+        length = len(data.get("price", []))
+        for name, default in STRING_COLUMNS.items():
+            columns[name] = data.get(name) or [default] * length
+        for name, (dtype, default) in NUMERIC_COLUMNS.items():
+            values = data.get(name)
+            columns[name] = (np.asarray(values, dtype=dtype) if values is not None
+                             else np.full(length, default, dtype=dtype))
+        return cls(columns)
+
+    @classmethod
+    def from_json(cls, payload: str) -> "FlightResults":
+        data = json.loads(payload)
+        if isinstance(data, list):
+            return cls.from_records(data)
+        return cls.from_dict(data)
+
+    def to_dict(self) -> Dict[str, List]:
+        """Columnar form suitable for a JSON column"""
+        return {
+            name: (values.tolist() if isinstance(values, np.ndarray) else list(values))
+            for name, values in self.columns.items()
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def take(self, index: np.ndarray) -> "FlightResults":
+        """New result set containing only the given row positions"""
+        index = np.asarray(index, dtype=np.intp)
+        return FlightResults({
+            name: (values[index] if isinstance(values, np.ndarray)
+                   else [values[i] for i in index])
+            for name, values in self.columns.items()
+        })
+
+    def row(self, i: int) -> Dict[str, Any]:
+        record = {}
+        for name, values in self.columns.items():
+            value = values[i]
+            record[name] = value.item() if isinstance(value, np.generic) else value
+        if record["available_seats"] < 0:
+            record["available_seats"] = None
+        if np.isnan(record["original_price"]):
+            record["original_price"] = None
+        return record
+
+    def records(self) -> List[Dict[str, Any]]:
+        return [self.row(i) for i in range(len(self))]
+
+    def to_flights(self) -> List[Flight]:
+        """Validate into pydantic models, for use at API boundaries only"""
+        return [Flight(**record) for record in self.records()]
+
+    def filter(self, max_price: float = None, max_stops: int = None,
+               airlines: List[str] = None) -> "FlightResults":
+        mask = np.ones(len(self), dtype=bool)
+        if max_price is not None:
+            mask &= self.columns["price"] <= max_price
+        if max_stops is not None:
+            mask &= self.columns["stops"] <= max_stops
+        if airlines:
+            mask &= np.isin(np.asarray(self.columns["airline"], dtype=object), airlines)
+        return self.take(np.flatnonzero(mask))
+
+    def cheapest(self, n: int = 1) -> "FlightResults":
+        return self.take(np.argsort(self.columns["price"], kind="stable")[:n])
+
+    def fastest(self, n: int = 1) -> "FlightResults":
+        return self.take(np.argsort(self.columns["duration_minutes"], kind="stable")[:n])
+
+    def best_value(self, n: int = 1) -> "FlightResults":
+        """Rank by price and duration, each relative to the best available"""
+        if not len(self):
+            return self
+        price = self.columns["price"]
+        duration = self.columns["duration_minutes"].astype(np.float64)
+        score = price / max(price.min(), 1.0)
+        if duration.max() > 0:
+            score = score + duration / max(duration[duration > 0].min(), 1.0)
+        score = score + 0.25 * self.columns["stops"]
+        return self.take(np.argsort(score, kind="stable")[:n])
+
+    def min_price(self) -> Optional[float]:
+        return float(self.columns["price"].min()) if len(self) else None
+
+
+class RouteRecord:
+    """Lightweight tracked route row returned by get_active_routes"""
+
+    __slots__ = ("id", "user_id", "origin", "destination", "max_price",
+                 "departure_date", "check_frequency", "last_check", "next_check",
+                 "best_price", "created_at", "auto_book")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @property
+    def key(self) -> str:
+        return f"{self.origin}-{self.destination}"
\ No newline at end of file
@@ -0,0 +1,189 @@
+"""
+Exchange rates: a versioned in-memory snapshot and vectorized price conversion
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence
+import numpy as np
+from flight_results import FlightResults
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+RATES_FILE = os.path.join(DATA_DIR, "fx_rates.json")
+
+SYMBOLS = {"USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥", "INR": "₹", "KRW": "₩", "TRY": "₺"}
+
+# Fixed table for tests and offline runs, in units per US dollar
+STUB_RATES = {"USD": 1.0, "EUR": 0.92, "GBP": 0.79, "JPY": 150.0, "CAD": 1.37, "AUD": 1.53}
+
+
+def symbol(currency: str) -> str:
+    """Prefix for amounts shown to users, e.g. '€' or 'CHF '"""
+    return SYMBOLS.get(currency, f"{currency} ")
+
+
+class FileRateSource:
+    """Rates from a JSON file ({"base", "as_of", "rates"}) kept current by an external job"""
+
+    def __init__(self, path: str = RATES_FILE):
+        self.path = path
+
+    def load(self) -> Dict:
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+class StubRateSource:
+    def __init__(self, rates: Dict[str, float] = None):
+        self.rates = rates or STUB_RATES
+
+    def load(self) -> Dict:
+        return {"base": "USD", "as_of": "stub", "rates": dict(self.rates)}
+
+
+class RateSnapshot:
+    """
+    Immutable rate table. Rates are units of each currency per one unit
+    of the base, held in one array so a whole result set converts with a
+    single gather and divide. version is a digest of the table, stable
+    across processes, and is stored with every normalized price.
+    """
+
+    __slots__ = ("base", "as_of", "version", "codes", "rates", "_index")
+
+    def __init__(self, base: str, rates: Dict[str, float], as_of: str = ""):
+        table = dict(rates, **{base: 1.0})
+        self.base = base
+        self.as_of = as_of
+        self.codes = sorted(table)
+        self.rates = np.asarray([table[c] for c in self.codes], dtype=np.float64)
+        self._index = {code: i for i, code in enumerate(self.codes)}
+        digest = hashlib.blake2b(
+            json.dumps([base, self.codes, self.rates.tolist()]).encode(), digest_size=4
+        ).hexdigest()
+        self.version = f"{base}-{digest}"
+
+    def __contains__(self, currency: str) -> bool:
+        return currency in self._index
+
+    def rate(self, currency: str) -> float:
+        i = self._index.get(currency)
+        return float(self.rates[i]) if i is not None else float("nan")
+
+    def to_base(self, amounts: np.ndarray, currencies: Sequence[str]) -> np.ndarray:
+        """Convert row-wise amounts to the base currency; unknown currencies become NaN"""
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if not len(amounts):
+            return amounts.copy()
+        labels, inverse = np.unique(np.asarray(currencies, dtype=object), return_inverse=True)
+        per_label = np.asarray([self.rate(c) for c in labels], dtype=np.float64)
+        return amounts / per_label[inverse]
+
+    def from_base(self, amounts, currency: str):
+        """Base-currency amounts (a float or an array) expressed in currency"""
+        return amounts * self.rate(currency)
+
+    def normalize(self, results: FlightResults) -> FlightResults:
+        """
+        Result set priced in the base currency, with the provider's price and
+        currency kept in original_price/original_currency. Rows already
+        normalized keep their originals; rows in unknown currencies are dropped.
+        """
+        columns = dict(results.columns)
+        converted = self.to_base(columns["price"], columns["currency"])
+        fresh = np.isnan(columns["original_price"])
+        columns["original_price"] = np.where(fresh, columns["price"], columns["original_price"])
+        columns["original_currency"] = np.where(
+            fresh,
+            np.asarray(columns["currency"], dtype=object),
+            np.asarray(columns["original_currency"], dtype=object)
+        ).tolist()
+        columns["price"] = converted
+        columns["currency"] = [self.base] * len(converted)
+
+        normalized = FlightResults(columns)
+        known = ~np.isnan(converted)
+        if known.all():
+            return normalized
+        dropped = sorted({c for c, ok in zip(columns["original_currency"], known) if not ok})
+        logger.warning(f"Dropping {int((~known).sum())} flights priced in unknown currencies {dropped}")
+        return normalized.take(np.flatnonzero(known))
+
+    def display(self, results: FlightResults, currency: str) -> FlightResults:
+        """Normalized results re-priced for showing to a user; not for comparison or storage"""
+        if currency == self.base or currency not in self:
+            return results
+        columns = dict(results.columns)
+        columns["price"] = columns["price"] * self.rate(currency)
+        columns["currency"] = [currency] * len(results)
+        return FlightResults(columns)
+
+
+class ExchangeRates:
+    """
+    Holds the current snapshot and reloads it from the source every
+    FX_REFRESH_MINUTES, checked on access. A reload that yields the same
+    table keeps the existing snapshot; readers always see a whole table.
+    """
+
+    def __init__(self, source=None, refresh_minutes: int = None):
+        self.source = source or self._default_source()
+        self.refresh_seconds = (refresh_minutes or config.FX_REFRESH_MINUTES) * 60
+        self._snapshot: Optional[RateSnapshot] = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _default_source():
+        if config.FX_RATES_SOURCE == "stub":
+            return StubRateSource()
+        return FileRateSource(config.FX_RATES_SOURCE or RATES_FILE)
+
+    def refresh(self) -> RateSnapshot:
+        data = self.source.load()
+        snapshot = RateSnapshot(data.get("base", config.BASE_CURRENCY), data["rates"], data.get("as_of", ""))
+        if snapshot.base != config.BASE_CURRENCY:
+            # Rebase so stored prices always share one currency
+            snapshot = RateSnapshot(config.BASE_CURRENCY, {
+                code: rate / snapshot.rate(config.BASE_CURRENCY)
+                for code, rate in zip(snapshot.codes, snapshot.rates)
+            }, snapshot.as_of)
+        if self._snapshot is None or snapshot.version != self._snapshot.version:
+            logger.info(f"FX rates {snapshot.version} as of {snapshot.as_of} ({len(snapshot.codes)} currencies)")
+            self._snapshot = snapshot
+        return self._snapshot
+
+    @property
+    def snapshot(self) -> RateSnapshot:
+        now = time.monotonic()
+        if self._snapshot is None or now - self._checked >= self.refresh_seconds:
+            with self._lock:
+                if self._snapshot is None or now - self._checked >= self.refresh_seconds:
+                    try:
+                        self.refresh()
+                    except (OSError, ValueError, KeyError) as e:
+                        if self._snapshot is None:
+                            raise
+                        logger.error(f"FX refresh failed, keeping {self._snapshot.version}: {e}")
+                    self._checked = now
+        return self._snapshot
+
+
+_rates: Optional[ExchangeRates] = None
+_lock = threading.Lock()
+
+
+def get_rates() -> RateSnapshot:
+    """Current snapshot of the shared rate table"""
+    global _rates
+    if _rates is None:
+        with _lock:
+            if _rates is None:
+                _rates = ExchangeRates()
+    return _rates.snapshot
\ No newline at end of file
@@ -10,6 +10,8 @@ import threading
 import argparse
 from telegram_bot import run_bot
 from monitoring import FlightMonitor
+from analytics import RouteAnalytics
+from reports import UserReports
 from config import config
 import logging
 
@@ -19,9 +21,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def run_monitor_thread():
+def run_monitor_thread(node_id: str = None):
     """Run monitoring in separate thread"""
-    monitor = FlightMonitor()
+    monitor = FlightMonitor(node_id)
     monitor.start_monitoring()
 
 def main():
@@ -42,8 +44,38 @@ def main():
         help="Run only the monitoring system"
     )
     
+    parser.add_argument(
+        "--node-id",
+        help="Monitor node name when ENABLE_MONITOR_SHARDING is on (default: host-pid)"
+    )
+    
+    parser.add_argument(
+        "--rebuild-stats",
+        action="store_true",
+        help="Recompute route statistics and user reports from stored history, then exit"
+    )
+    
+    parser.add_argument(
+        "--import-expenses",
+        nargs=2,
+        metavar=("USER_ID", "CSV"),
+        help="Bulk-import a user's expenses (date,amount,currency,category[,description]), then exit"
+    )
+    
     args = parser.parse_args()
     
+    if args.rebuild_stats:
+        routes = RouteAnalytics().rebuild()
+        users = UserReports().rebuild()
+        logger.info(f"Rebuilt statistics for {routes} routes and reports for {users} users")
+        return
+    
+    if args.import_expenses:
+        user_id, path = args.import_expenses
+        imported, skipped = UserReports().import_expenses(user_id, path)
+        logger.info(f"Imported {imported} expenses for {user_id}, skipped {skipped}")
+        return
+    
     print("""
     ╔══════════════════════════════════════════════════════════╗
     ║                                                          ║  
@@ -60,7 +92,7 @@ def main():
     
     if args.monitor_only:
         logger.info("Starting monitoring system only...")
-        monitor = FlightMonitor()
+        monitor = FlightMonitor(args.node_id)
         monitor.start_monitoring()
         
     elif args.bot_only:
@@ -71,11 +103,13 @@ def main():
         logger.info("Starting full system (bot + monitoring)...")
         
         # Start monitoring in background thread
-        monitor_thread = threading.Thread(target=run_monitor_thread, daemon=True)
+        monitor_thread = threading.Thread(
+            target=run_monitor_thread, args=(args.node_id,), daemon=True
+        )
         monitor_thread.start()
         
         # Run bot in main thread
         run_bot()
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
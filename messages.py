@@ -0,0 +1,197 @@
+"""
+Compiled templates for outbound Telegram messages
+"""
+import html
+from string import Formatter
+from typing import Dict, List, Any, Tuple
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+
+class Template:
+    """A message template parsed once into literal and field segments"""
+
+    __slots__ = ("name", "segments")
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self.segments: List[Tuple[str, str, str]] = [
+            (literal, field or "", spec or "")
+            for literal, field, spec, _ in Formatter().parse(source.strip("\n"))
+        ]
+
+    def render(self, data: Dict[str, Any]) -> str:
+        parts = []
+        for literal, field, spec in self.segments:
+            parts.append(literal)
+            if not field:
+                continue
+            value = data[field]
+            text = format(value, spec) if spec else str(value)
+            # Fields named *_html carry pre-rendered, already escaped markup
+            parts.append(text if field.endswith("_html") else html.escape(text, quote=False))
+        return "".join(parts)
+
+
+SOURCES = {
+    "flight_option": """
+{rank}️⃣ <b>{label}:</b>
+   {flight_number} | {symbol}{price:,.0f}
+   {departure} → {arrival} ({duration})
+""",
+    "search_results": """
+✈️ <b>Flight Search Results</b>
+{origin} → {destination} · {date}
+
+🏆 <b>Best Options:</b>
+
+{options_html}
+
+{recommendation_html}<i>Prices may change. Book soon for best rates!</i>
+""",
+    "search_empty": """
+✈️ <b>Flight Search Results</b>
+{origin} → {destination} · {date}
+
+No flights found for this date. Try flexible dates for nearby days.
+""",
+    "recommendation": """
+💡 <b>AI Recommendation:</b>
+{text}
+""",
+    "prediction_line": "• {horizon}: {symbol}{price:,.0f} ({arrow} {change:.0f}%)",
+    "predictions": """
+📊 <b>Price Prediction Analysis</b>
+{route}
+
+Current price: {symbol}{current_price:,.0f}
+
+📈 <b>Price Forecast:</b>
+{lines_html}
+
+📉 <b>Trend:</b> {trend}
+⚡ <b>Confidence:</b> {confidence:.0%}
+
+💡 <b>AI Recommendation:</b>
+{recommendation}
+
+🎯 <b>Best Booking Window:</b>
+{best_booking_window}
+
+<i>Based on historical data and ML predictions</i>
+""",
+    "predictions_unavailable": """
+📊 <b>Price Prediction Analysis</b>
+{route}
+
+{analysis}
+""",
+    "price_drop": """
+🚨 <b>PRICE DROP ALERT!</b>
+
+Route: {origin} → {destination}
+Previous best: {symbol}{previous:,.2f}
+Current best: {symbol}{current:,.2f}
+Savings: {symbol}{savings:,.2f} ({percent:.0f}% off)
+
+{analysis_html}<i>Book now before prices go back up!</i>
+""",
+    "drop_analysis": "💡 {text}",
+    "digest_line": "• {origin} → {destination}: {symbol}{previous:,.0f} → <b>{symbol}{current:,.0f}</b> (−{percent:.0f}%){note_html}",
+    "digest_note": "   💡 <i>{text}</i>",
+    "alert_digest": """
+🚨 <b>{count} PRICE DROPS ON YOUR ROUTES</b>
+
+{lines_html}
+
+<i>Book now before prices go back up!</i>
+""",
+    "price_chart": """
+📈 <b>{origin} → {destination}</b> · last {range}
+Low {symbol}{low:,.0f} · High {symbol}{high:,.0f} · Latest {symbol}{latest:,.0f}
+""",
+    "chart_unavailable": """
+📭 No price history for <b>{origin} → {destination}</b> yet.
+Track the route and I'll start recording prices.
+""",
+    "report": """
+📊 <b>Your Travel Report</b>
+
+🔍 Searches: {searches}
+🔔 Price drop alerts: {alerts} ({symbol}{savings:,.0f} in drops caught)
+✅ Auto-bookings: {bookings} ({symbol}{booked:,.0f})
+
+🛫 <b>Top routes:</b>
+{routes_html}
+
+💰 <b>Expenses:</b>
+{expenses_html}
+""",
+    "report_route_line": "• {route}: {searches} searches",
+    "expense_currency_line": "• {currency}: {total:,.2f} across {count} expenses",
+    "expense_category_line": "   {category}: {total:,.2f}",
+    "expense_month_line": "   📅 {month}: {total:,.2f}",
+    "expenses_summary": """
+💰 <b>Travel Expenses</b>
+
+{totals_html}
+
+Add one: <code>/expenses 120 EUR hotel Hilton Paris</code>
+Import many: send a CSV with columns <code>date,amount,currency,category,description</code>
+""",
+    "expense_added": "✅ Added {amount:,.2f} {currency} for {category}.",
+    "expenses_imported": "📥 Imported {imported} expenses{skipped_note}.",
+    "expenses_disabled": "Expense tracking is turned off on this bot.",
+    "request_duplicate": "⏳ Already working on {request} for you, results are on the way.",
+    "request_shed": "🛬 I'm handling a lot of requests right now. Please try again in a minute.",
+    "request_superseded": "↪️ Replaced by your newer request.",
+    "booking_confirmed": """
+✅ <b>AUTO-BOOKED!</b>
+
+Route: {origin} → {destination}
+Flight: {flight_number} ({airline})
+Departure: {departure}
+Price: {symbol}{price:,.2f}
+Reference: <code>{reference}</code>
+
+<i>Booked automatically because the fare fell below your {symbol}{limit:,.0f} limit.</i>
+""",
+}
+
+# Parsed once at import so rendering is a single pass over segments
+TEMPLATES: Dict[str, Template] = {
+    name: Template(name, source) for name, source in SOURCES.items()
+}
+
+
+def render(name: str, **data) -> str:
+    """Fill a named template from structured data"""
+    return TEMPLATES[name].render(data)
+
+
+def render_lines(name: str, rows: List[Dict[str, Any]], separator: str = "\n") -> str:
+    template = TEMPLATES[name]
+    return separator.join(template.render(row) for row in rows)
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split text into Telegram-sized chunks on line boundaries"""
+    if len(text) <= limit:
+        return [text]
+
+    chunks, current = [], ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""
+In-process counters and latency samples for the bot and monitor
+"""
+import threading
+from collections import deque
+from typing import Deque, Dict
+import numpy as np
+
+
+class Metrics:
+    """Named counters plus a bounded window of samples per timing"""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def increment(self, name: str, amount: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = deque(maxlen=self.window)
+            self._samples[name].append(value)
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Counters as-is, timings as count/p50/p95/max over the window"""
+        with self._lock:
+            counters = dict(self._counters)
+            samples = {name: np.asarray(values) for name, values in self._samples.items()}
+
+        timings = {}
+        for name, values in samples.items():
+            if not len(values):
+                continue
+            p50, p95 = np.percentile(values, [50, 95])
+            timings[name] = {
+                "count": len(values),
+                "p50": float(p50),
+                "p95": float(p95),
+                "max": float(values.max()),
+            }
+        return {"counters": counters, "timings": timings}
+
+    def render(self) -> str:
+        snapshot = self.snapshot()
+        lines = [f"{name}: {value:g}" for name, value in sorted(snapshot["counters"].items())]
+        for name, t in sorted(snapshot["timings"].items()):
+            lines.append(
+                f"{name}: n={t['count']} p50={t['p50']:.2f} p95={t['p95']:.2f} max={t['max']:.2f}"
+            )
+        return "\n".join(lines) or "no metrics yet"
+
+
+metrics = Metrics()
\ No newline at end of file
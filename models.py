@@ -1,6 +1,7 @@
-from datetime import datetime
+import re
+from datetime import date, datetime
 from typing import List, Optional, Dict, Any, Literal
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from enum import Enum
 
 class ActionType(str, Enum):
@@ -86,4 +87,81 @@ class TelegramContext(BaseModel):
     username: Optional[str]
     current_action: Optional[ActionType] = None
     context_data: Dict[str, Any] = {}
-    last_interaction: datetime = Field(default_factory=datetime.now)
\ No newline at end of file
+    last_interaction: datetime = Field(default_factory=datetime.now)
+
+class PriceObserved(BaseModel):
+    route_id: str
+    user_id: str
+    origin: str
+    destination: str
+    price: float
+    currency: str = "USD"
+    # What the provider quoted, and the rate table used to normalize it
+    original_price: Optional[float] = None
+    original_currency: Optional[str] = None
+    fx_version: Optional[str] = None
+    previous_price: Optional[float] = None
+    max_price: Optional[float] = None
+    departure_date: Optional[datetime] = None
+    airline: Optional[str] = None
+    # Analyst's one-line take when the route was checked in a batch
+    note: Optional[str] = None
+    observed_at: datetime = Field(default_factory=datetime.utcnow)
+
+class PriceDropped(BaseModel):
+    route_id: str
+    user_id: str
+    origin: str
+    destination: str
+    previous_price: float
+    price: float
+    currency: str = "USD"
+    note: Optional[str] = None
+    observed_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class TravelerProfile(BaseModel):
+    """Passenger details checked once when saved, so booking never re-validates"""
+    full_name: str
+    email: str
+    phone: str
+    date_of_birth: date
+
+    @field_validator("full_name")
+    @classmethod
+    def _full_name(cls, value: str) -> str:
+        value = " ".join(value.split())
+        if len(value.split()) < 2:
+            raise ValueError("first and last name are required")
+        return value
+
+    @field_validator("email")
+    @classmethod
+    def _email(cls, value: str) -> str:
+        value = value.strip().lower()
+        if not re.fullmatch(r"[^@\s]+@[^@\s]+\.[a-z]{2,}", value):
+            raise ValueError("invalid email address")
+        return value
+
+    @field_validator("phone")
+    @classmethod
+    def _phone(cls, value: str) -> str:
+        digits = re.sub(r"[\s().-]", "", value)
+        if not re.fullmatch(r"\+?\d{7,15}", digits):
+            raise ValueError("invalid phone number")
+        return digits
+
+    @field_validator("date_of_birth")
+    @classmethod
+    def _date_of_birth(cls, value: date) -> date:
+        if not date(1900, 1, 1) <= value < date.today():
+            raise ValueError("invalid date of birth")
+        return value
+
+class BookingConfirmation(BaseModel):
+    reference: str
+    idempotency_key: str
+    flight_number: str
+    amount: float
+    currency: str = "USD"
+    booked_at: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
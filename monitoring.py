@@ -2,45 +2,275 @@
 Background monitoring system for tracked routes and alerts
 """
 import asyncio
-import schedule
+import json
 import time
+import numpy as np
 from datetime import datetime, timedelta
-from typing import List, Dict
-from database import Database
+from typing import List, Dict, Optional, Set, Tuple
+from database import Database, TrackedRoute, PriceObservation
+from flight_results import FlightResults, RouteRecord
 from agents import FlightAgents, FlightTasks
-from crewai import Crew, Process
+from analytics import RouteAnalytics, route_key
+from messages import render, render_lines, split_message
+from collector import collecting
+from tools import FlightTools
+from scheduling import AdaptivePolicy
+from sharding import ShardCoordinator
+from events import create_event_bus
+from booking import AutoBooker, create_booking_provider
+from reports import UserReports
+from snapshot import SnapshotStore
+from models import PriceObserved, PriceDropped
+from fx import get_rates, symbol
+from crewai import Crew, Process, Task
 from telegram import Bot
+from metrics import metrics
 from config import config
 import logging
 
 logger = logging.getLogger(__name__)
 
+# A checked route's flights and the analyst's note on them, if any
+RouteCheck = Tuple[FlightResults, Optional[str]]
+
+def _crew_tokens(crew) -> int:
+    """Total LLM tokens a finished crew used, whichever form the crewai version reports"""
+    usage = getattr(crew, "usage_metrics", None)
+    total = usage.get("total_tokens") if isinstance(usage, dict) else getattr(usage, "total_tokens", 0)
+    return int(total) if isinstance(total, (int, float)) else 0
+
 class FlightMonitor:
     """Background monitoring system"""
     
-    def __init__(self):
+    def __init__(self, node_id: str = None):
         self.db = Database()
-        self.agents = FlightAgents()
+        self.analytics = RouteAnalytics(self.db)
+        self.reports = UserReports(self.db)
+        self.agents = FlightAgents(self.analytics)
         self.bot = Bot(token=config.TELEGRAM_BOT_TOKEN)
+        self.policy = AdaptivePolicy()
+        self.snapshots = SnapshotStore()
+        # Loaded before sharding starts so a restarted node keeps its name, and so its leases
+        self.warm_state = self.snapshots.load()
+        saved_node = self.warm_state.get("sections", {}).get("node_id")
+        self.shard = ShardCoordinator(
+            self.db, node_id or saved_node
+        ) if config.ENABLE_SHARDING else None
+        # Routes leased for the current pass and not yet checked
+        self._in_flight: Set[str] = set()
+        self.search_slots = asyncio.Semaphore(config.MONITOR_SEARCH_CONCURRENCY)
+        self.bus = create_event_bus()
+        self._subscribe()
+        provider = create_booking_provider() if config.ENABLE_AUTO_BOOKING else None
+        self.booker = AutoBooker(
+            self.db, provider, notify=self._send, reports=self.reports
+        ) if provider else None
+    
+    def _subscribe(self):
+        """Each consumer of price observations is an independent subscriber group"""
+        self.bus.subscribe("PriceObserved", "history", self._persist_observations)
+        self.bus.subscribe("PriceObserved", "analytics", self._record_analytics)
+        self.bus.subscribe("PriceObserved", "alerts", self._detect_drops)
+        self.bus.subscribe("PriceDropped", "notifications", self._notify_drops)
+        self.bus.subscribe("PriceDropped", "reports", self._record_drops)
         
     async def check_tracked_routes(self):
-        """Check all tracked routes for price changes"""
-        routes = self.db.get_active_routes()
+        """Check tracked routes that are due for price changes"""
+        now = datetime.utcnow()
+        routes = self._owned_routes()
+        
+        if self.booker:
+            await asyncio.to_thread(self.booker.recover)
         
-        for route in routes:
+        due = [r for r in routes if r.next_check is None or r.next_check <= now]
+        self._in_flight = {r.id for r in due}
+        batch_size = max(config.MONITOR_BATCH_SIZE, 1)
+        for start in range(0, len(due), batch_size):
+            batch = due[start:start + batch_size]
+            keep_alive = None
+            if self.shard:
+                # Leases are taken per batch, so a long pass never outlives them
+                batch = await asyncio.to_thread(self._claim, batch)
+                if not batch:
+                    continue
+                keep_alive = asyncio.create_task(self._hold_leases([r.id for r in batch]))
             try:
-                await self._check_route(route)
+                await self._check_routes(batch, routes)
+            finally:
+                if keep_alive:
+                    keep_alive.cancel()
+                # Leases are held until next_check is stored, so a new owner can't re-check
+                if self.shard:
+                    await asyncio.to_thread(self.shard.release_all, [r.id for r in batch])
+    
+    async def _check_routes(self, batch: List[RouteRecord], routes: List[RouteRecord]):
+        """Check one batch of due routes, publish what was seen and schedule their next checks"""
+        try:
+            if config.MONITOR_BATCH_SIZE > 1:
+                checked = await self._check_batch(batch)
+            else:
+                checked = {batch[0].id: (await self._check_route(batch[0]), None)}
+        except Exception as e:
+            logger.error(f"Error checking routes {[r.id for r in batch]}: {e}")
+            checked = {}
+        for route in batch:
+            flights, note = checked.get(route.id, (FlightResults.empty(), None))
+            await self._observe(route, flights, note)
+        
+        # History must be persisted before rescheduling reads it back
+        await self.bus.drain()
+        self._reschedule(batch, routes)
+    
+    def _claim(self, batch: List[RouteRecord]) -> List[RouteRecord]:
+        """
+        Lease the batch's routes that this node still owns and that are
+        still due. The due list was read at the start of the pass, so the
+        ring may have moved since, or another node may have checked a route
+        in the meantime; next_check is re-read once the lease is held.
+        """
+        self.shard.refresh()
+        # Routes still leased by a previous owner mid-rebalance are skipped
+        leased = [r for r in batch if self.shard.owns(r.id) and self.shard.acquire(r.id)]
+        next_checks = self.db.get_next_checks([r.id for r in leased])
+        now = datetime.utcnow()
+        claimed = []
+        for route in leased:
+            if route.id in next_checks and (next_checks[route.id] or now) <= now:
+                claimed.append(route)
+            else:
+                self.shard.release(route.id)
+        for route in batch:
+            if route not in claimed:
+                self._in_flight.discard(route.id)
+        return claimed
+    
+    async def _hold_leases(self, route_ids: List[str]):
+        """Heartbeat and extend a batch's leases while it is being checked"""
+        interval = min(self.shard.lease_ttl, self.shard.node_ttl).total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.shard.renew, route_ids)
             except Exception as e:
-                logger.error(f"Error checking route {route['id']}: {e}")
+                logger.error(f"Lease renewal failed: {e}")
+    
+    async def _observe(self, route: RouteRecord, flights: FlightResults, note: str = None):
+        """Hand one route's check result to booking and the event fan-out"""
+        try:
+            if not len(flights):
+                return
+            observed_at = datetime.utcnow()
+            
+            # Booking runs inline, ahead of the event fan-out
+            if self.booker:
+                await self.booker.consider(route, flights, observed_at)
+            
+            cheapest = flights.cheapest().row(0)
+            await self.bus.publish(PriceObserved(
+                route_id=route.id,
+                user_id=route.user_id,
+                origin=route.origin,
+                destination=route.destination,
+                price=cheapest['price'],
+                currency=cheapest['currency'],
+                original_price=cheapest['original_price'],
+                original_currency=cheapest['original_currency'],
+                fx_version=get_rates().version,
+                previous_price=route.best_price,
+                max_price=route.max_price,
+                departure_date=route.departure_date,
+                airline=cheapest['airline'] or None,
+                note=note,
+                observed_at=observed_at
+            ))
+        except Exception as e:
+            logger.error(f"Error checking route {route.id}: {e}")
+        finally:
+            self._in_flight.discard(route.id)
     
-    async def _check_route(self, route: Dict):
-        """Check single route for price changes"""
+    def _owned_routes(self) -> List[RouteRecord]:
+        """Active routes this node checks, sizing its share of the provider budget"""
+        routes = self.db.get_active_routes()
+        if self.shard:
+            nodes = self.shard.refresh()
+            routes = [r for r in routes if self.shard.owns(r.id)]
+            # Each node gets an equal share of the provider budget
+            self.policy.budget_per_hour = config.PROVIDER_BUDGET / len(nodes)
+        return routes
+    
+    def resume(self) -> Dict[str, int]:
+        """
+        Apply the snapshot loaded at startup and stagger overdue routes, so a
+        restart carries on where the last process stopped instead of checking
+        every route on the first tick. Due times themselves are stored on
+        tracked_routes; the snapshot holds what the database doesn't.
+        """
+        began = time.perf_counter()
+        sections = self.warm_state.get("sections", {})
+        restored = 0
+        if sections:
+            self.policy.restore(sections["policy"])
+            restored = self.analytics.restore(sections["route_stats"], self.warm_state["saved_at"])
+        self.warm_state = {}
+        
+        due = self.policy.stagger(self._owned_routes(), first=sections.get("in_flight", ()))
+        if due:
+            self.db.set_next_checks(due)
+        
+        summary = {"route_stats": restored, "staggered": len(due)}
+        logger.info(
+            f"{'Warm' if sections else 'Cold'} start in {time.perf_counter() - began:.2f}s: "
+            f"restored stats for {restored} routes, spread {len(due)} overdue checks"
+        )
+        return summary
+    
+    def snapshot_state(self) -> Dict:
+        return {
+            "node_id": self.shard.node_id if self.shard else None,
+            "in_flight": sorted(self._in_flight),
+            "policy": self.policy.snapshot(),
+            "route_stats": self.analytics.snapshot(),
+        }
+    
+    def save_snapshot(self):
+        """Write scheduler state and hot caches for the next start"""
+        try:
+            # Taken before reading the caches, so restore() can spot rows written after it
+            saved_at = datetime.utcnow()
+            self.snapshots.save(self.snapshot_state(), saved_at)
+        except Exception as e:
+            logger.error(f"Saving monitor snapshot failed: {e}")
+    
+    def _reschedule(self, checked: List[RouteRecord], routes: List[RouteRecord]):
+        """Pick each checked route's next interval from its price behaviour"""
+        histories = self.db.get_price_histories([r.id for r in checked])
+        checked_ids = {r.id for r in checked}
+        self.policy.retain({r.id for r in routes})
+        # Routes not planned since startup count at their stored interval
+        unknown_demand = sum(
+            60.0 / (r.check_frequency or config.CHECK_INTERVAL)
+            for r in routes if r.id not in checked_ids and not self.policy.knows(r.id)
+        )
+        intervals = self.policy.plan([
+            {
+                "id": r.id,
+                "prices": histories.get(r.id, []),
+                "base": config.CHECK_INTERVAL,
+                "departure_date": r.departure_date,
+                "max_price": r.max_price,
+            }
+            for r in checked
+        ], unknown_demand)
+        self.db.schedule_routes(intervals)
+    
+    async def _check_route(self, route: RouteRecord) -> FlightResults:
+        """Check single route and return the flights found"""
         # Execute search crew
         search_agent = self.agents.search_specialist()
         analyst_agent = self.agents.price_analyst()
         
         search_task = Task(
-            description=f"Search flights for {route['origin']} to {route['destination']}",
+            description=f"Search flights for {route.origin} to {route.destination}",
             agent=search_agent
         )
         
@@ -50,77 +280,303 @@ class FlightMonitor:
             process=Process.sequential
         )
         
-        results = crew.kickoff()
+        # Off the event loop so subscribers keep running during the crew
+        began = time.perf_counter()
+        with collecting() as collector:
+            await asyncio.to_thread(crew.kickoff)
+        self._record_crew_cost("route", crew, 1, began)
         
-        # Parse results and check for price drops
-        current_best_price = self._extract_best_price(results)
-        
-        if route.get('best_price'):
-            if current_best_price < route['best_price'] * 0.95:  # 5% drop
-                await self._send_price_alert(route, current_best_price)
+        # Tools publish typed results, so no parsing of the crew's prose
+        flights = collector.flights()
+        if not len(flights):
+            logger.warning(f"No search results collected for route {route.id}")
+        return flights
+    
+    async def _check_batch(self, routes: List[RouteRecord]) -> Dict[str, RouteCheck]:
+        """
+        Check several routes with one crew run. Searches go straight to the
+        search tool's code, concurrently, and a single analyst task reviews a
+        compact table of every route's results, so agent prompts and tool
+        descriptions are paid once per batch rather than once per route.
+        Returns each route's flights and the analyst's note, keyed by route id.
+        """
+        began = time.perf_counter()
+        found = await asyncio.gather(*(self._search(r) for r in routes), return_exceptions=True)
+        flights = {}
+        for route, result in zip(routes, found):
+            if isinstance(result, Exception):
+                logger.error(f"Search failed for route {route.id}: {result}")
+                result = FlightResults.empty()
+            flights[route.id] = result
         
-        # Update database
-        self._update_route_price(route['id'], current_best_price)
+        notes = {}
+        rows = [r for r in routes if len(flights[r.id])]
+        if rows:
+            analyst_agent = self.agents.price_analyst()
+            crew = Crew(
+                agents=[analyst_agent],
+                tasks=[FlightTasks.assess_routes_task(analyst_agent, self._route_table(rows, flights))],
+                process=Process.sequential
+            )
+            try:
+                output = await asyncio.to_thread(crew.kickoff)
+                notes = self._parse_assessments(str(output), rows)
+            except Exception as e:
+                # Prices are still observed; only the notes are lost
+                logger.error(f"Batch assessment failed for {len(rows)} routes: {e}")
+            self._record_crew_cost("batch", crew, len(routes), began)
+        return {r.id: (flights[r.id], notes.get(r.id)) for r in routes}
     
-    async def _send_price_alert(self, route: Dict, new_price: float):
-        """Send price drop alert to user"""
-        message = f"""
-🚨 <b>PRICE DROP ALERT!</b>
-
-Route: {route['origin']} → {route['destination']}
-Previous best: ${route.get('best_price', 0):.2f}
-Current best: ${new_price:.2f}
-Savings: ${(route.get('best_price', 0) - new_price):.2f}
-
-<i>Book now before prices go back up!</i>
+    async def _search(self, route: RouteRecord) -> FlightResults:
+        date = (route.departure_date or datetime.utcnow()).strftime("%Y-%m-%d")
+        async with self.search_slots:
+            records = await asyncio.to_thread(
+                FlightTools.search_flights, route.origin, route.destination, date
+            )
+        return get_rates().normalize(FlightResults.from_records(records))
+    
+    @staticmethod
+    def _route_table(routes: List[RouteRecord], flights: Dict[str, FlightResults]) -> str:
+        """One pipe-separated row per route, numbered so replies map back by row"""
+        lines = ["row|route|date|flights|low|median|high|cheapest|last|target"]
+        for i, route in enumerate(routes, start=1):
+            results = flights[route.id]
+            prices = results.columns["price"]
+            cheapest = results.cheapest().row(0)
+            lines.append("|".join([
+                str(i),
+                f"{route.origin}-{route.destination}",
+                route.departure_date.strftime("%Y-%m-%d") if route.departure_date else "any",
+                str(len(results)),
+                f"{prices.min():.0f}",
+                f"{np.median(prices):.0f}",
+                f"{prices.max():.0f}",
+                f"{cheapest['airline'] or cheapest['flight_number']}",
+                f"{route.best_price:.0f}" if route.best_price else "-",
+                f"{route.max_price:.0f}" if route.max_price else "-",
+            ]))
+        return "\n".join(lines)
+    
+    @staticmethod
+    def _parse_assessments(output: str, routes: List[RouteRecord]) -> Dict[str, str]:
+        """Route id -> note from the first JSON object in the output keyed by row numbers"""
+        decoder = json.JSONDecoder()
+        start = output.find('{')
+        while start != -1:
+            try:
+                data, _ = decoder.raw_decode(output, start)
+                if isinstance(data, dict):
+                    notes = {
+                        routes[int(row) - 1].id: str(note).strip()
+                        for row, note in data.items()
+                        if str(row).isdigit() and 0 < int(row) <= len(routes) and note
+                    }
+                    if notes:
+                        return notes
+            except ValueError:
+                pass
+            start = output.find('{', start + 1)
+        logger.warning(f"No per-route assessments in analyst output for {len(routes)} routes")
+        return {}
+    
+    @staticmethod
+    def _record_crew_cost(mode: str, crew, routes: int, began: float):
+        """Wall clock and LLM tokens per route, comparable across route and batch checks"""
+        metrics.observe(f"monitor.{mode}.seconds_per_route", (time.perf_counter() - began) / routes)
+        tokens = _crew_tokens(crew)
+        if tokens:
+            metrics.observe(f"monitor.{mode}.tokens_per_route", tokens / routes)
+    
+    async def _persist_observations(self, events: List[PriceObserved]):
+        """Subscriber: write observed prices to tracked route history"""
+        self._update_route_prices(events)
+    
+    async def _record_analytics(self, events: List[PriceObserved]):
+        """Subscriber: fold observations into route statistics"""
+        for event in events:
+            self.analytics.record_observation(
+                event.origin, event.destination, event.price, event.observed_at,
+                event.departure_date, event.airline
+            )
+    
+    async def _detect_drops(self, events: List[PriceObserved]):
+        """Subscriber: turn significant decreases into PriceDropped events"""
+        for event in events:
+            previous = event.previous_price
+            if self._is_drop(event):
+                await self.bus.publish(PriceDropped(
+                    route_id=event.route_id,
+                    user_id=event.user_id,
+                    origin=event.origin,
+                    destination=event.destination,
+                    previous_price=previous,
+                    price=event.price,
+                    currency=event.currency,
+                    note=event.note,
+                    observed_at=event.observed_at
+                ))
+    
+    @staticmethod
+    def _is_drop(event: PriceObserved) -> bool:
         """
+        A route with a target alerts when the fare first falls to the target
+        or drops significantly again below it; one without, on any
+        significant decrease
+        """
+        previous = event.previous_price
+        if not previous:
+            return False
+        dropped = event.price < previous * (1 - config.PRICE_THRESHOLD / 100)
+        if event.max_price is None:
+            return dropped
+        return event.price <= event.max_price and (previous > event.max_price or dropped)
+    
+    async def _notify_drops(self, events: List[PriceDropped]):
+        """Subscriber: one message per user per batch, however many routes dropped"""
+        by_user: Dict[str, List[PriceDropped]] = {}
+        for event in events:
+            by_user.setdefault(event.user_id, []).append(event)
+        currencies = self.db.get_display_currencies(list(by_user))
         
-        await self.bot.send_message(
-            chat_id=route['user_id'],
-            text=message,
-            parse_mode='HTML'
-        )
+        for user_id, drops in by_user.items():
+            currency = currencies.get(user_id, config.BASE_CURRENCY)
+            try:
+                if len(drops) == 1:
+                    await self._send_price_alert(drops[0], currency)
+                else:
+                    await self._send_alert_digest(user_id, drops, currency)
+            except Exception as e:
+                logger.error(f"Error sending alerts to {user_id}: {e}")
+    
+    async def _record_drops(self, events: List[PriceDropped]):
+        """Subscriber: log each drop and fold its savings into the user's report"""
+        savings: Dict[str, List[float]] = {}
+        for event in events:
+            saved = round(event.previous_price - event.price, 2)
+            self.db.log_action(event.user_id, "price_drop", {
+                "route_id": event.route_id, "origin": event.origin,
+                "destination": event.destination
+            }, {"previous": event.previous_price, "price": event.price, "savings": saved})
+            savings.setdefault(event.user_id, []).append(saved)
+        for user_id, amounts in savings.items():
+            self.reports.record_drops(user_id, amounts)
+    
+    def _drop_fields(self, drop: PriceDropped, currency: str = None) -> Dict:
+        """Template fields in the user's display currency; drops are detected in the base one"""
+        rates = get_rates()
+        if currency not in rates:
+            currency = drop.currency
+        rate = rates.rate(currency) / rates.rate(drop.currency)
+        previous, current = drop.previous_price * rate, drop.price * rate
+        return {
+            "origin": drop.origin,
+            "destination": drop.destination,
+            "symbol": symbol(currency),
+            "previous": previous,
+            "current": current,
+            "savings": previous - current,
+            "percent": (previous - current) / previous * 100 if previous else 0,
+        }
+    
+    async def _send_price_alert(self, drop: PriceDropped, currency: str = None):
+        """Send price drop alert to user"""
+        analysis = render("drop_analysis", text=drop.note) + "\n\n" if drop.note else ""
+        message = render("price_drop", analysis_html=analysis, **self._drop_fields(drop, currency))
+        await self._send(drop.user_id, message)
     
-    def _extract_best_price(self, results: str) -> float:
-        """Extract best price from crew results"""
-        # Parse crew output for price
-        # This is simplified - would need proper parsing
-        return 425.0
+    async def _send_alert_digest(self, user_id: str, drops: List[PriceDropped],
+                                 currency: str = None):
+        """Send several price drops for one user as a single message"""
+        lines = render_lines("digest_line", [
+            dict(self._drop_fields(drop, currency),
+                 note_html="\n" + render("digest_note", text=drop.note) if drop.note else "")
+            for drop in drops
+        ])
+        message = render("alert_digest", count=len(drops), lines_html=lines)
+        await self._send(user_id, message)
     
-    def _update_route_price(self, route_id: str, price: float):
-        """Update route with new price"""
+    async def _send(self, chat_id: str, message: str):
+        for chunk in split_message(message):
+            await self.bot.send_message(
+                chat_id=chat_id,
+                text=chunk,
+                parse_mode='HTML'
+            )
+    
+    def _update_route_prices(self, events: List[PriceObserved]):
+        """Update routes and append raw observations in a single transaction"""
         session = self.db.Session()
         try:
-            route = session.query(TrackedRoute).filter_by(id=route_id).first()
-            if route:
-                route.best_price = price
-                route.last_check = datetime.utcnow()
+            routes = session.query(TrackedRoute).filter(
+                TrackedRoute.id.in_({e.route_id for e in events})
+            ).all()
+            by_id = {route.id: route for route in routes}
+            
+            for event in events:
+                route = by_id.get(event.route_id)
+                if not route:
+                    continue
+                route.best_price = event.price
+                route.last_check = event.observed_at
                 
                 # Update price history
-                history = route.price_history or []
+                history = list(route.price_history or [])
                 history.append({
-                    "price": price,
-                    "timestamp": datetime.utcnow().isoformat()
+                    "price": event.price,
+                    "currency": event.currency,
+                    "original_price": event.original_price,
+                    "original_currency": event.original_currency,
+                    "timestamp": event.observed_at.isoformat(),
+                    "departure_date": event.departure_date.isoformat() if event.departure_date else None,
+                    "airline": event.airline
                 })
                 route.price_history = history[-100:]  # Keep last 100
                 
-                session.commit()
+                # Long-horizon history goes to the tiered tables
+                session.add(PriceObservation(
+                    route_key=route_key(event.origin, event.destination),
+                    price=event.price,
+                    original_price=event.original_price,
+                    original_currency=event.original_currency,
+                    fx_version=event.fx_version,
+                    observed_at=event.observed_at,
+                    departure_date=event.departure_date,
+                    airline=event.airline
+                ))
+            
+            session.commit()
         finally:
             session.close()
     
     def start_monitoring(self):
         """Start the monitoring loop"""
         logger.info("Starting flight monitoring system...")
-        
-        # Schedule checks
-        schedule.every(config.CHECK_INTERVAL).minutes.do(
-            lambda: asyncio.run(self.check_tracked_routes())
-        )
-        
-        # Initial check
-        asyncio.run(self.check_tracked_routes())
-        
-        # Keep running
-        while True:
-            schedule.run_pending()
-            time.sleep(60)
\ No newline at end of file
+        asyncio.run(self.run())
+    
+    async def run(self):
+        """Tick frequently; each pass only checks routes that are due"""
+        await self.bus.start()
+        try:
+            try:
+                await asyncio.to_thread(self.resume)
+            except Exception as e:
+                logger.error(f"Warm restart failed, checking routes as they fall due: {e}")
+            while True:
+                try:
+                    await self.check_tracked_routes()
+                except Exception as e:
+                    logger.error(f"Monitoring pass failed: {e}")
+                await asyncio.to_thread(self.analytics.history.maintain)
+                # Subscribers are drained between passes, so the caches hold still while saving
+                await asyncio.to_thread(self.save_snapshot)
+                
+                for _ in range(config.MONITOR_TICK):
+                    await asyncio.sleep(60)
+                    if self.shard:
+                        self.shard.refresh()
+        finally:
+            await self.bus.stop()
+            # Keeps any unchecked routes of an interrupted pass, to go first next time
+            self.save_snapshot()
+            if self.shard:
+                self.shard.leave()
\ No newline at end of file
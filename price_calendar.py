@@ -0,0 +1,115 @@
+"""
+Per-route, per-day lowest price calendar for flexible date searches
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from database import Database
+from analytics import route_key
+from tools import FlightTools
+from flight_results import FlightResults
+from fx import get_rates
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PriceCalendar:
+    """Cached lowest-price grid, refreshed cell by cell when stale"""
+
+    def __init__(self, db: Database = None, search: Callable = None,
+                 max_concurrency: int = None, ttl_minutes: int = None):
+        self.db = db or Database()
+        self.search = search or FlightTools.search_flights
+        self.semaphore = asyncio.Semaphore(max_concurrency or config.CALENDAR_CONCURRENCY)
+        self.ttl = timedelta(minutes=ttl_minutes or config.CALENDAR_TTL)
+
+    def _ttl_for(self, day: date) -> timedelta:
+        """Near departures move quickly, so their cells expire sooner"""
+        days_out = (day - datetime.utcnow().date()).days
+        if days_out <= 14:
+            return self.ttl
+        if days_out <= 60:
+            return self.ttl * 2
+        return self.ttl * 4
+
+    def lookup(self, origin: str, destination: str,
+               start: date, end: date) -> Dict[date, Dict]:
+        """Read the grid for a date window in a single query"""
+        return self.db.get_calendar_cells(route_key(origin, destination), start, end)
+
+    def stale_days(self, cells: Dict[date, Dict], start: date, end: date) -> List[date]:
+        now = datetime.utcnow()
+        stale = []
+        day = start
+        while day <= end:
+            cell = cells.get(day)
+            if not cell or now - cell["fetched_at"] > self._ttl_for(day):
+                stale.append(day)
+            day += timedelta(days=1)
+        return stale
+
+    async def _fetch_day(self, origin: str, destination: str, day: date) -> Optional[Dict]:
+        async with self.semaphore:
+            try:
+                flights = await asyncio.to_thread(
+                    self.search, origin, destination, day.isoformat()
+                )
+            except Exception as e:
+                logger.error(f"Calendar search failed for {origin}-{destination} {day}: {e}")
+                return None
+
+        # Providers may price in different currencies; cells are in the base currency
+        flights = get_rates().normalize(FlightResults.from_records(flights))
+        if not len(flights):
+            return {"day": day, "price": None, "flight_number": None}
+        cheapest = flights.cheapest().row(0)
+        return {
+            "day": day,
+            "price": cheapest["price"],
+            "flight_number": cheapest["flight_number"] or None,
+        }
+
+    async def window(self, origin: str, destination: str,
+                     start: date, days: int = 7) -> Dict[date, Dict]:
+        """Return the calendar for a window, searching only stale days"""
+        end = start + timedelta(days=days - 1)
+        key = route_key(origin, destination)
+        cells = self.lookup(origin, destination, start, end)
+        stale = self.stale_days(cells, start, end)
+
+        if stale:
+            fetched = await asyncio.gather(
+                *(self._fetch_day(origin, destination, day) for day in stale)
+            )
+            fresh = [cell for cell in fetched if cell is not None]
+            self.db.save_calendar_cells(key, fresh)
+            now = datetime.utcnow()
+            for cell in fresh:
+                cells[cell["day"]] = {
+                    "price": cell["price"],
+                    "flight_number": cell["flight_number"],
+                    "fetched_at": now,
+                }
+            logger.info(f"Refreshed {len(fresh)}/{days} calendar days for {key}")
+
+        return cells
+
+    def compare_dates(self, origin: str, destination: str,
+                      dates: List[date]) -> Dict[str, Optional[float]]:
+        """Compare lowest prices for specific dates straight from the grid"""
+        if not dates:
+            return {}
+        cells = self.lookup(origin, destination, min(dates), max(dates))
+        return {
+            day.isoformat(): cells[day]["price"] if day in cells else None
+            for day in sorted(dates)
+        }
+
+    @staticmethod
+    def cheapest(cells: Dict[date, Dict]) -> Optional[date]:
+        priced = [day for day, cell in cells.items() if cell["price"] is not None]
+        if not priced:
+            return None
+        return min(priced, key=lambda day: cells[day]["price"])
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""
+Per-user report aggregates, updated on every write so /report is a key lookup
+"""
+import io
+import math
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from database import Database, ActionLog, ExpenseRecord, FlightSearch
+from analytics import route_key
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns a bulk expense CSV must have; description and flight_reference are optional
+EXPENSE_COLUMNS = ["date", "amount", "currency", "category"]
+TOP_ROUTES = 5
+RECENT_MONTHS = 6
+
+
+def _empty_accumulators() -> Dict[str, Any]:
+    return {
+        "searches": 0,
+        "routes": {},
+        "expenses": {},
+        "alerts": 0,
+        "savings": 0.0,
+        "bookings": 0,
+        "booked": 0.0,
+    }
+
+
+def _currency_bucket(acc: Dict[str, Any], currency: str) -> Dict[str, Any]:
+    return acc["expenses"].setdefault(
+        currency, {"total": 0.0, "count": 0, "categories": {}, "months": {}}
+    )
+
+
+def _add_expense(acc: Dict[str, Any], amount: float, currency: str, category: str,
+                 month: str, count: int = 1):
+    bucket = _currency_bucket(acc, currency)
+    bucket["total"] += amount
+    bucket["count"] += count
+    bucket["categories"][category] = bucket["categories"].get(category, 0.0) + amount
+    bucket["months"][month] = bucket["months"].get(month, 0.0) + amount
+
+
+def summarize(acc: Dict[str, Any]) -> Dict[str, Any]:
+    """Derive the user-facing report from raw accumulators"""
+    routes = sorted(acc["routes"].items(), key=lambda item: -item[1])[:TOP_ROUTES]
+    expenses = {}
+    for currency, bucket in sorted(acc["expenses"].items(), key=lambda item: -item[1]["total"]):
+        expenses[currency] = {
+            "total": round(bucket["total"], 2),
+            "count": bucket["count"],
+            "categories": {
+                name: round(total, 2)
+                for name, total in sorted(bucket["categories"].items(), key=lambda item: -item[1])
+            },
+            "months": {
+                month: round(bucket["months"][month], 2)
+                for month in sorted(bucket["months"])[-RECENT_MONTHS:]
+            },
+        }
+    return {
+        "searches": acc["searches"],
+        "top_routes": [{"route": key, "searches": count} for key, count in routes],
+        "expenses": expenses,
+        "alerts": acc["alerts"],
+        "savings": round(acc["savings"], 2),
+        "bookings": acc["bookings"],
+        "booked": round(acc["booked"], 2),
+    }
+
+
+class UserReports:
+    """
+    Per-user aggregate store. Each write folds into the user's row with a
+    versioned compare-and-set, retried on conflict, so the bot and the
+    monitor can both update it; reads never touch the underlying logs.
+    """
+
+    def __init__(self, db: Database = None):
+        self.db = db or Database()
+
+    @staticmethod
+    def _applier(fold):
+        def apply(stats: Optional[Dict]) -> Dict:
+            acc = stats["accumulators"] if stats else _empty_accumulators()
+            fold(acc)
+            return {"accumulators": acc, "summary": summarize(acc)}
+        return apply
+
+    def _update(self, user_id: str, fold):
+        try:
+            self.db.update_user_stats(user_id, self._applier(fold))
+        except Exception as e:
+            # The rebuild job recovers anything missed here
+            logger.error(f"Report aggregate update failed for {user_id}: {e}")
+
+    def record_search(self, user_id: str, origin: str, destination: str):
+        def fold(acc):
+            key = route_key(origin, destination)
+            acc["searches"] += 1
+            acc["routes"][key] = acc["routes"].get(key, 0) + 1
+        self._update(user_id, fold)
+
+    def record_drops(self, user_id: str, savings: List[float]):
+        def fold(acc):
+            acc["alerts"] += len(savings)
+            acc["savings"] += sum(savings)
+        self._update(user_id, fold)
+
+    def record_booking(self, user_id: str, amount: float):
+        def fold(acc):
+            acc["bookings"] += 1
+            acc["booked"] += amount
+        self._update(user_id, fold)
+
+    def get(self, user_id: str) -> Dict[str, Any]:
+        """The user's materialized report; all zeros before their first write"""
+        stats = self.db.get_user_stats(user_id)
+        return stats["summary"] if stats else summarize(_empty_accumulators())
+
+    def add_expense(self, user_id: str, amount: float, currency: str, category: str,
+                    description: str = "", date: datetime = None) -> int:
+        """Store the expense and count it in the aggregates in one transaction"""
+        if not math.isfinite(amount) or amount <= 0:
+            raise ValueError(f"Invalid expense amount: {amount}")
+        month = (date or datetime.utcnow()).strftime("%Y-%m")
+        return self.db.add_expense(
+            user_id, amount, currency, category, description, date,
+            apply=self._applier(lambda acc: _add_expense(acc, amount, currency, category, month))
+        )
+
+    def import_expenses(self, user_id: str, data) -> Tuple[int, int]:
+        """
+        Bulk-load expenses from CSV text, bytes or a path. Rows that fail
+        validation, including non-finite amounts, are skipped. The rows and
+        one aggregate update for the whole file commit together. Returns
+        (imported, skipped).
+        """
+        if isinstance(data, bytes):
+            data = io.BytesIO(data)
+        elif isinstance(data, str) and "\n" in data:
+            data = io.StringIO(data)
+        df = pd.read_csv(data, dtype=str, skipinitialspace=True)
+        df.columns = [c.strip().lower() for c in df.columns]
+        missing = [c for c in EXPENSE_COLUMNS if c not in df.columns]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+        total = len(df)
+        df["amount"] = pd.to_numeric(df["amount"], errors="coerce")
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        df["currency"] = df["currency"].str.strip().str.upper()
+        df["category"] = df["category"].str.strip().str.lower()
+        df = df[
+            np.isfinite(df["amount"]) & (df["amount"] > 0) & df["date"].notna()
+            & df["currency"].str.fullmatch(r"[A-Z]{3}", na=False)
+            & df["category"].notna() & (df["category"] != "")
+        ]
+        for column in ("description", "flight_reference"):
+            if column not in df.columns:
+                df[column] = None
+        if df.empty:
+            return 0, total
+
+        df["month"] = df["date"].dt.strftime("%Y-%m")
+        grouped = df.groupby(["currency", "category", "month"])["amount"].agg(["sum", "count"])
+        def fold(acc):
+            for (currency, category, month), row in grouped.iterrows():
+                _add_expense(acc, float(row["sum"]), currency, category, month, int(row["count"]))
+
+        rows = df[["amount", "currency", "category", "description", "flight_reference", "date"]]
+        self.db.add_expenses(
+            user_id, rows.astype(object).where(rows.notna(), None).to_dict("records"),
+            apply=self._applier(fold)
+        )
+        return len(df), total - len(df)
+
+    def rebuild(self) -> int:
+        """Recompute every user's aggregates from the logs with vectorized group-bys"""
+        engine = self.db.engine
+        session = self.db.Session()
+        try:
+            searches = pd.read_sql(session.query(
+                FlightSearch.user_id, FlightSearch.origin, FlightSearch.destination
+            ).statement, engine)
+            expenses = pd.read_sql(session.query(
+                ExpenseRecord.user_id, ExpenseRecord.amount, ExpenseRecord.currency,
+                ExpenseRecord.category, ExpenseRecord.date
+            ).statement, engine)
+            actions = session.query(
+                ActionLog.user_id, ActionLog.action_type, ActionLog.result
+            ).filter(
+                ActionLog.action_type.in_(("price_drop", "book_flight")),
+                ActionLog.success == True
+            ).all()
+        finally:
+            session.close()
+        actions = pd.DataFrame(actions, columns=["user_id", "action_type", "result"])
+
+        users = set(searches["user_id"]) | set(expenses["user_id"]) | set(actions["user_id"])
+        accumulators = {user_id: _empty_accumulators() for user_id in users}
+
+        if not searches.empty:
+            searches["route"] = (searches["origin"].str.strip().str.upper() + "-"
+                                 + searches["destination"].str.strip().str.upper())
+            for (user_id, key), count in searches.groupby(["user_id", "route"]).size().items():
+                accumulators[user_id]["routes"][key] = int(count)
+                accumulators[user_id]["searches"] += int(count)
+
+        if not expenses.empty:
+            expenses["month"] = pd.to_datetime(expenses["date"]).dt.strftime("%Y-%m")
+            grouped = expenses.groupby(
+                ["user_id", "currency", "category", "month"]
+            )["amount"].agg(["sum", "count"])
+            for (user_id, currency, category, month), row in grouped.iterrows():
+                _add_expense(accumulators[user_id], float(row["sum"]), currency,
+                             category, month, int(row["count"]))
+
+        if not actions.empty:
+            results = pd.json_normalize(actions["result"].map(lambda r: r or {}).tolist())
+            actions["value"] = pd.to_numeric(
+                results.get("savings", pd.Series(index=actions.index, dtype=float)), errors="coerce"
+            ).fillna(pd.to_numeric(
+                results.get("amount", pd.Series(index=actions.index, dtype=float)), errors="coerce"
+            )).fillna(0.0)
+            totals = actions.groupby(["user_id", "action_type"])["value"].agg(["sum", "count"])
+            for (user_id, action_type), row in totals.iterrows():
+                acc = accumulators[user_id]
+                if action_type == "price_drop":
+                    acc["alerts"], acc["savings"] = int(row["count"]), float(row["sum"])
+                else:
+                    acc["bookings"], acc["booked"] = int(row["count"]), float(row["sum"])
+
+        self.db.save_user_stats({
+            user_id: {"accumulators": acc, "summary": summarize(acc)}
+            for user_id, acc in accumulators.items()
+        })
+        logger.info(f"Rebuilt reports for {len(accumulators)} users")
+        return len(accumulators)
\ No newline at end of file
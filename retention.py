@@ -0,0 +1,121 @@
+"""
+Tiered price history: raw observations, rolled up into hourly and daily buckets
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from database import Database
+from metrics import metrics
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+SERIES_COLUMNS = ["time", "min", "avg", "max", "count"]
+
+
+class PriceHistory:
+    """
+    Raw observations are kept for RAW_RETENTION_DAYS, hourly buckets for
+    HOURLY_RETENTION_DAYS and daily buckets indefinitely. Rollups fold raw
+    rows not yet marked rolled up, a batch at a time, so maintenance cost
+    follows the number of new observations rather than history size, and
+    a row committed late is still folded before it can expire.
+    """
+
+    def __init__(self, db: Database, raw_days: int = None, hourly_days: int = None,
+                 batch_size: int = None):
+        self.db = db
+        self.raw_days = raw_days or config.RAW_RETENTION_DAYS
+        self.hourly_days = hourly_days or config.HOURLY_RETENTION_DAYS
+        self.batch_size = batch_size or config.ROLLUP_BATCH
+
+    def roll_up(self, max_batches: int = 20) -> int:
+        """Fold new raw observations into both rollup tiers; returns rows folded"""
+        folded = 0
+        for _ in range(max_batches):
+            rows = self.db.get_unrolled_observations(self.batch_size)
+            if not rows:
+                break
+            frame = pd.DataFrame(rows, columns=["id", "route_key", "price", "observed_at"])
+            buckets = self._aggregate(frame)
+            if not self.db.apply_rollups([int(i) for i in frame["id"]], buckets):
+                # Another monitor marked some of these rows first; it owns this batch
+                break
+            folded += len(frame)
+            if len(rows) < self.batch_size:
+                break
+        if folded:
+            metrics.increment("history.rolled_up", folded)
+        return folded
+
+    @staticmethod
+    def _aggregate(frame: pd.DataFrame) -> Dict[tuple, List[float]]:
+        buckets = {}
+        for resolution, freq in (("hour", "h"), ("day", "D")):
+            starts = frame["observed_at"].dt.floor(freq)
+            grouped = frame.groupby([frame["route_key"], starts])["price"].agg(
+                ["min", "max", "sum", "count"]
+            )
+            for (key, start), row in zip(grouped.index, grouped.itertuples(index=False)):
+                buckets[(key, resolution, start.to_pydatetime())] = [
+                    float(row.min), float(row.max), float(row.sum), int(row.count)
+                ]
+        return buckets
+
+    def expire(self, now: datetime = None) -> Dict[str, int]:
+        """Delete raw rows and hourly buckets that have aged out of their tier"""
+        now = now or datetime.utcnow()
+        deleted = self.db.expire_price_history(
+            raw_before=now - timedelta(days=self.raw_days),
+            hourly_before=now - timedelta(days=self.hourly_days)
+        )
+        for tier, count in deleted.items():
+            if count:
+                metrics.increment(f"history.expired.{tier}", count)
+        return deleted
+
+    def maintain(self, now: datetime = None):
+        """Roll up then expire; cheap enough to run after every monitor pass"""
+        try:
+            self.roll_up()
+            self.expire(now)
+        except Exception as e:
+            logger.error(f"Price history maintenance failed: {e}")
+
+    def resolution_for(self, route_key: str, start: datetime, end: datetime,
+                       max_points: int, now: datetime = None) -> str:
+        """Finest tier that still covers start and fits within max_points"""
+        now = now or datetime.utcnow()
+        if (start >= now - timedelta(days=self.raw_days)
+                and self.db.count_observations(route_key, start, end) <= max_points):
+            return "raw"
+        if (start >= now - timedelta(days=self.hourly_days)
+                and (end - start) / timedelta(hours=1) <= max_points):
+            return "hour"
+        return "day"
+
+    def series(self, route_key: str, start: datetime, end: datetime = None,
+               max_points: int = 500, resolution: str = None) -> pd.DataFrame:
+        """
+        Prices over [start, end) as time/min/avg/max/count rows. The tier is
+        picked automatically unless resolution is given, and is reported in
+        frame.attrs["resolution"].
+        """
+        end = end or datetime.utcnow()
+        resolution = resolution or self.resolution_for(route_key, start, end, max_points)
+
+        if resolution == "raw":
+            rows = self.db.get_observation_series(route_key, start, end)
+            frame = pd.DataFrame(rows, columns=["time", "avg"])
+            frame["min"] = frame["max"] = frame["avg"]
+            frame["count"] = 1
+        else:
+            rows = self.db.get_rollup_series(route_key, resolution, start, end)
+            frame = pd.DataFrame(rows, columns=["time", "min", "max", "sum", "count"])
+            frame["avg"] = frame["sum"] / frame["count"].where(frame["count"] > 0, np.nan)
+
+        frame = frame[SERIES_COLUMNS]
+        frame.attrs["resolution"] = resolution
+        return frame
\ No newline at end of file
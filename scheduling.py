@@ -0,0 +1,112 @@
+"""
+Adaptive check intervals for tracked routes
+"""
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+from config import config
+
+
+class AdaptivePolicy:
+    """Computes each route's next check interval from its recent behaviour"""
+
+    def __init__(self, min_interval: int = None, max_interval: int = None,
+                 budget_per_hour: float = None, window: int = 20):
+        self.min_interval = min_interval or config.MIN_CHECK_INTERVAL
+        self.max_interval = max_interval or config.MAX_CHECK_INTERVAL
+        self.budget_per_hour = budget_per_hour or config.PROVIDER_BUDGET
+        self.window = window
+        # Unscaled calls per hour wanted by every route planned so far
+        self._raw_rates: Dict[str, float] = {}
+        # Volatility at which a route is checked at the base interval
+        self.reference_volatility = 0.005
+
+    def volatility(self, prices: Sequence[float]) -> float:
+        """Standard deviation of recent log returns"""
+        prices = np.asarray(prices[-self.window:], dtype=np.float64)
+        prices = prices[prices > 0]
+        if len(prices) < 3:
+            return self.reference_volatility
+        return float(np.std(np.diff(np.log(prices))))
+
+    def raw_interval(self, prices: Sequence[float], base: float,
+                     departure_date: datetime = None, max_price: float = None,
+                     now: datetime = None) -> float:
+        """Interval in minutes before the global budget is applied"""
+        now = now or datetime.utcnow()
+
+        vol = self.volatility(prices)
+        factor = np.clip(self.reference_volatility / max(vol, 1e-4), 0.25, 4.0)
+
+        if departure_date:
+            days_out = max((departure_date - now).total_seconds() / 86400, 0)
+            factor *= np.clip(days_out / 30, 0.25, 4.0)
+
+        if max_price and len(prices):
+            # Within 10% of the user's target, a single drop can trigger an alert
+            gap = (prices[-1] - max_price) / max_price
+            if gap <= 0.10:
+                factor *= 0.5
+
+        return float(np.clip(base * factor, self.min_interval, self.max_interval))
+
+    def knows(self, route_id: str) -> bool:
+        return route_id in self._raw_rates
+
+    def retain(self, active_ids: Set[str]):
+        """Drop routes that are no longer monitored from the demand estimate"""
+        for route_id in [i for i in self._raw_rates if i not in active_ids]:
+            del self._raw_rates[route_id]
+
+    def plan(self, routes: List[Dict], unknown_demand: float = 0.0,
+             now: datetime = None) -> Dict[str, int]:
+        """
+        Intervals for a set of routes, scaled uniformly so the total call
+        rate of all known routes tracks the provider budget.
+        routes: dicts with id, prices, base and optional departure_date/max_price
+        unknown_demand: calls per hour of active routes this policy hasn't planned yet
+        """
+        raw = {
+            r["id"]: self.raw_interval(
+                r["prices"], r["base"], r.get("departure_date"), r.get("max_price"), now
+            )
+            for r in routes
+        }
+        for route_id, interval in raw.items():
+            self._raw_rates[route_id] = 60.0 / interval
+
+        demand = unknown_demand + sum(self._raw_rates.values())
+        scale = demand / self.budget_per_hour if self.budget_per_hour else 1.0
+        return {
+            route_id: int(np.clip(interval * scale, self.min_interval, self.max_interval))
+            for route_id, interval in raw.items()
+        }
+
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Demand estimate to carry across a restart"""
+        return {"raw_rates": dict(self._raw_rates)}
+
+    def restore(self, state: Dict[str, Any]):
+        self._raw_rates.update(state.get("raw_rates", {}))
+
+    def stagger(self, routes: Sequence, now: datetime = None, first: Iterable[str] = (),
+                window_minutes: float = None) -> Dict[str, datetime]:
+        """
+        Next due times that spread overdue routes evenly over a window
+        rather than checking them all on the first tick after a restart.
+        The window is at least as long as the provider budget needs for the
+        backlog. Routes in first (checks the previous process was in the
+        middle of) go ahead, then the longest overdue.
+        """
+        now = now or datetime.utcnow()
+        first = set(first)
+        overdue = [r for r in routes if r.next_check is None or r.next_check <= now]
+        if not overdue:
+            return {}
+        overdue.sort(key=lambda r: (r.id not in first, r.next_check or datetime.min))
+        minutes = window_minutes or config.RESUME_STAGGER_MINUTES
+        if self.budget_per_hour:
+            minutes = max(minutes, len(overdue) * 60.0 / self.budget_per_hour)
+        step = timedelta(minutes=minutes) / len(overdue)
+        return {route.id: now + step * i for i, route in enumerate(overdue)}
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Route ownership across several monitor nodes via consistent hashing
+"""
+import bisect
+import hashlib
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from database import Database
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring; a membership change moves ~1/N of the keys"""
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 128):
+        self.vnodes = vnodes
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(set(self._owners.values()))
+
+    def add(self, node: str):
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+                self._owners[point] = node
+
+    def remove(self, node: str):
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                self._points.remove(point)
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[i]]
+
+
+class DatabaseMembership:
+    """Node heartbeats in the shared monitor_nodes table"""
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def heartbeat(self, node_id: str):
+        self.db.heartbeat_node(node_id)
+
+    def leave(self, node_id: str):
+        self.db.remove_node(node_id)
+
+    def live_nodes(self, ttl: timedelta) -> List[str]:
+        return self.db.get_live_nodes(datetime.utcnow() - ttl)
+
+
+class RedisMembership:
+    """Node heartbeats as expiring Redis keys"""
+
+    PREFIX = "flightbot:monitor:node:"
+
+    def __init__(self, url: str, ttl: timedelta):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def heartbeat(self, node_id: str):
+        self.client.set(self.PREFIX + node_id, datetime.utcnow().isoformat(),
+                        ex=int(self.ttl.total_seconds()))
+
+    def leave(self, node_id: str):
+        self.client.delete(self.PREFIX + node_id)
+
+    def live_nodes(self, ttl: timedelta) -> List[str]:
+        return sorted(
+            key.decode()[len(self.PREFIX):]
+            for key in self.client.scan_iter(self.PREFIX + "*")
+        )
+
+
+class ShardCoordinator:
+    """Decides which routes this node checks and guards each check with a lease"""
+
+    def __init__(self, db: Database, node_id: str = None):
+        self.db = db
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.node_ttl = timedelta(seconds=config.NODE_TTL)
+        self.lease_ttl = timedelta(seconds=config.ROUTE_LEASE_TTL)
+        if config.REDIS_URL:
+            self.membership = RedisMembership(config.REDIS_URL, self.node_ttl)
+        else:
+            self.membership = DatabaseMembership(db)
+        self.ring = HashRing()
+
+    def refresh(self) -> List[str]:
+        """Heartbeat and rebuild the ring from live nodes"""
+        self.membership.heartbeat(self.node_id)
+        live = set(self.membership.live_nodes(self.node_ttl)) | {self.node_id}
+        current = set(self.ring.nodes)
+        for node in live - current:
+            self.ring.add(node)
+        for node in current - live:
+            self.ring.remove(node)
+        if live != current:
+            logger.info(f"Monitor ring changed: {sorted(live)}")
+        return sorted(live)
+
+    def owns(self, route_id: str) -> bool:
+        return self.ring.owner(route_id) == self.node_id
+
+    def acquire(self, route_id: str) -> bool:
+        """
+        Take the route's lease. Fails while another node still holds an
+        unexpired lease, so a route is never checked twice during a rebalance;
+        it moves once the previous owner releases it or the lease expires.
+        """
+        return self.db.acquire_route_lease(route_id, self.node_id, self.lease_ttl)
+
+    def renew(self, route_ids: List[str]):
+        """Heartbeat and push back the expiry of leases this node holds"""
+        self.membership.heartbeat(self.node_id)
+        for route_id in route_ids:
+            if not self.acquire(route_id):
+                logger.warning(f"Lost the lease on route {route_id} mid-check")
+
+    def release(self, route_id: str):
+        self.db.release_route_lease(route_id, self.node_id)
+
+    def release_all(self, route_ids: List[str]):
+        for route_id in route_ids:
+            self.release(route_id)
+
+    def leave(self):
+        self.membership.leave(self.node_id)
\ No newline at end of file
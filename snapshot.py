@@ -0,0 +1,65 @@
+"""
+Warm restarts: monitor state and hot caches saved to disk and restored on start
+"""
+import os
+import pickle
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever a section's layout changes; older snapshots are ignored
+SNAPSHOT_FORMAT = 1
+
+
+class SnapshotStore:
+    """
+    Named sections saved together as one zlib-compressed pickle. Writes go
+    to a temporary file that replaces the previous snapshot in one rename,
+    so a crash mid-save leaves the last good snapshot in place. Snapshots
+    older than max_age, from another format or unreadable load as empty
+    and the caller starts cold.
+    """
+
+    def __init__(self, path: str = None, max_age_minutes: int = None):
+        self.path = path or config.SNAPSHOT_PATH
+        self.max_age = timedelta(minutes=max_age_minutes or config.SNAPSHOT_MAX_AGE)
+
+    def save(self, sections: Dict[str, Any], saved_at: datetime = None) -> int:
+        """Write the sections and return the snapshot size in bytes"""
+        payload = {
+            "format": SNAPSHOT_FORMAT,
+            "saved_at": saved_at or datetime.utcnow(),
+            "sections": sections,
+        }
+        data = zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        return len(data)
+
+    def load(self, now: datetime = None) -> Dict[str, Any]:
+        """{"saved_at", "sections"} from the last snapshot, or {} when there is none to use"""
+        now = now or datetime.utcnow()
+        try:
+            with open(self.path, "rb") as f:
+                payload = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable snapshot {self.path}: {e}")
+            return {}
+
+        if payload.get("format") != SNAPSHOT_FORMAT:
+            logger.info(f"Ignoring snapshot {self.path} in format {payload.get('format')}")
+            return {}
+        if now - payload["saved_at"] > self.max_age:
+            logger.info(f"Ignoring snapshot {self.path} from {payload['saved_at']:%Y-%m-%d %H:%M}")
+            return {}
+        return {"saved_at": payload["saved_at"], "sections": payload["sections"]}
\ No newline at end of file
@@ -0,0 +1,102 @@
+"""
+Progressive replies: one placeholder message edited in place as results arrive
+"""
+import asyncio
+import time
+from typing import Optional
+from telegram.error import BadRequest, RetryAfter
+from messages import split_message
+from config import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MessageStream:
+    """
+    Coalesces content updates into throttled edits of a single message.
+    update() only records the latest text; at most one edit per
+    min_interval reaches Telegram, always carrying the newest content.
+    """
+
+    def __init__(self, message, min_interval: float = None):
+        self.message = message
+        self.min_interval = config.STREAM_EDIT_INTERVAL if min_interval is None else min_interval
+        self.started = time.perf_counter()
+        # Seconds from start until the first useful content was on screen
+        self.first_content: Optional[float] = None
+        self._latest: Optional[str] = None
+        self._shown: Optional[str] = None
+        self._last_edit = float("-inf")
+        self._flush: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.closed = False
+
+    def update(self, text: str):
+        """Replace the pending content; must be called on the event loop"""
+        if self.closed:
+            return
+        self._latest = text
+        if self._flush is None or self._flush.done():
+            self._flush = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await self._wait_for_slot()
+        try:
+            # Partial content is trimmed to one message; finish() sends overflow
+            await self._edit(split_message(self._latest)[0])
+        except Exception as e:
+            # Intermediate edits are best effort, the final one still goes out
+            logger.warning(f"Progress edit failed: {e}")
+
+    async def _wait_for_slot(self):
+        delay = self._last_edit + self.min_interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _edit(self, text: str, reply_markup=None):
+        async with self._lock:
+            if text == self._shown and reply_markup is None:
+                return
+            for attempt in range(2):
+                try:
+                    await self.message.edit_text(
+                        text, reply_markup=reply_markup, parse_mode='HTML'
+                    )
+                    break
+                except RetryAfter as e:
+                    if attempt:
+                        raise
+                    logger.warning(f"Edit rate limited, retrying in {e.retry_after}s")
+                    await asyncio.sleep(e.retry_after)
+                except BadRequest as e:
+                    if "not modified" not in str(e).lower():
+                        raise
+                    break
+            self._shown = text
+            self._last_edit = time.perf_counter()
+            if self.first_content is None:
+                self.first_content = self._last_edit - self.started
+
+    async def close(self):
+        """Stop progress edits, e.g. when the work behind them was cancelled"""
+        self.closed = True
+        if self._flush and not self._flush.done():
+            self._flush.cancel()
+            await asyncio.gather(self._flush, return_exceptions=True)
+
+    async def finish(self, text: str, reply_markup=None) -> float:
+        """Show the final content with buttons and return total latency"""
+        await self.close()
+
+        chunks = split_message(text)
+        await self._wait_for_slot()
+        await self._edit(chunks[0], reply_markup if len(chunks) == 1 else None)
+        # Overflow goes out as follow-up messages, buttons on the last one
+        for i, chunk in enumerate(chunks[1:], start=2):
+            await self.message.reply_text(
+                chunk,
+                reply_markup=reply_markup if i == len(chunks) else None,
+                parse_mode='HTML'
+            )
+        return time.perf_counter() - self.started
\ No newline at end of file
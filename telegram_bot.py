@@ -2,10 +2,31 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from datetime import datetime, timedelta
+import asyncio
+import html
 import json
-from typing import Dict, Any
+import math
+import time
+from typing import Dict, List, Any, Optional
 from database import Database
 from agents import FlightAgents, FlightTasks
+from analytics import RouteAnalytics
+from price_calendar import PriceCalendar
+from flight_results import FlightResults
+from messages import render, render_lines, split_message
+from callbacks import CallbackRouter
+from collector import collecting
+from streaming import MessageStream
+from admission import AdmissionController
+from metrics import metrics
+from models import ActionType, PricePrediction, TravelerProfile
+from pydantic import ValidationError
+from tools import FlightTools
+from airports import get_index
+from charts import ChartService, RANGES, DEFAULT_RANGE
+from reports import UserReports
+from fx import get_rates, symbol
+from booking import auto_booking_available
 from crewai import Crew, Process
 from config import config
 
@@ -17,9 +38,33 @@ class FlightBot:
     
     def __init__(self):
         self.db = Database()
-        self.agents = FlightAgents()
+        self.analytics = RouteAnalytics(self.db)
+        self.calendar = PriceCalendar(self.db)
+        self.agents = FlightAgents(self.analytics, self.calendar)
         self.tasks = FlightTasks()
         self.user_sessions: Dict[str, Dict] = {}
+        self.callbacks = CallbackRouter()
+        self._register_callbacks()
+        self.admission = AdmissionController()
+        self.charts = ChartService(self.analytics.history)
+        self.reports = UserReports(self.db)
+        self._prerender: Optional[asyncio.Task] = None
+    
+    def _register_callbacks(self):
+        """Routing table for every inline button"""
+        self.callbacks.route('search', self.handle_search)
+        self.callbacks.route('track', self.handle_track)
+        self.callbacks.route('predict', self.handle_predict)
+        self.callbacks.route('date', self.handle_date, ('origin', 'destination', 'choice'))
+        self.callbacks.route('track_route', self.handle_track_route, ('origin', 'destination'))
+        self.callbacks.route('set_alert', self.handle_set_alert, ('origin', 'destination', 'price'))
+        self.callbacks.route('alert_drop', self.handle_set_alert, ('origin', 'destination', 'price'))
+        self.callbacks.route('view_predict', self.handle_view_predict, ('origin', 'destination'))
+        self.callbacks.route('place', self.handle_place, ('field', 'code'))
+        self.callbacks.route('auto_book', self.handle_auto_book, ('origin', 'destination', 'price'))
+        self.callbacks.route('analytics', self.handle_analytics)
+        self.callbacks.route('expenses', self.handle_expenses)
+        self.callbacks.route('chart', self.handle_chart, ('origin', 'destination', 'period'))
         
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command"""
@@ -62,6 +107,15 @@ Choose an action below or type your request!
             parse_mode='HTML'
         )
     
+    async def stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /stats command (admin only)"""
+        if str(update.effective_user.id) != str(config.TELEGRAM_ADMIN_ID):
+            return
+        await update.message.reply_text(
+            f"<pre>{html.escape(metrics.render())}</pre>",
+            parse_mode='HTML'
+        )
+    
     async def handle_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle flight search request"""
         query = update.callback_query
@@ -98,7 +152,7 @@ Choose an action below or type your request!
             "📍 <b>Route Tracking</b>\n\n"
             "I'll monitor this route and alert you on price drops!\n\n"
             "Enter route in format: <code>origin-destination</code>\n"
-            "Example: <code>LAX-JFK</code>",
+            "Example: <code>LAX-JFK</code> or <code>London-Paris</code>",
             parse_mode='HTML'
         )
     
@@ -123,6 +177,281 @@ Choose an action below or type your request!
             'step': 'route'
         }
     
+    async def handle_date(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                          origin: str = None, destination: str = None, choice: str = None):
+        """Handle quick date selection in the search flow"""
+        query = update.callback_query
+        await query.answer()
+        
+        # The route travels in the button itself, the session is just cleanup
+        self.user_sessions.pop(str(update.effective_user.id), None)
+        today = datetime.utcnow().date()
+        
+        if choice == 'flexible':
+            await query.edit_message_text(
+                "📅 <b>Checking prices across flexible dates...</b>",
+                parse_mode='HTML'
+            )
+            cells = await self.calendar.window(
+                origin, destination, today, config.CALENDAR_WINDOW
+            )
+            await query.message.reply_text(
+                self._format_price_calendar(
+                    origin, destination, cells, self._display_currency(str(update.effective_user.id))
+                ),
+                parse_mode='HTML'
+            )
+            return
+        
+        offsets = {'today': 0, 'tomorrow': 1, 'next_week': 7}
+        date = (today + timedelta(days=offsets.get(choice, 0))).isoformat()
+        
+        placeholder = await query.edit_message_text(
+            "🔍 <b>Searching flights...</b>\n"
+            "AI agents are finding the best options for you.",
+            parse_mode='HTML'
+        )
+        
+        await self._run_search(update, origin, destination, date, placeholder)
+    
+    async def handle_track_route(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 origin: str = None, destination: str = None):
+        """Start tracking the route shown on a result message"""
+        query = update.callback_query
+        await query.answer()
+        
+        self.db.add_tracked_route(str(update.effective_user.id), origin, destination)
+        await query.message.reply_text(
+            f"📍 Now tracking <b>{origin} → {destination}</b>. "
+            "I'll alert you when prices drop!",
+            parse_mode='HTML'
+        )
+    
+    async def handle_set_alert(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               origin: str = None, destination: str = None,
+                               price: str = None):
+        """Track a route with a target price below the current best"""
+        query = update.callback_query
+        await query.answer()
+        
+        target = round(float(price) * (1 - config.PRICE_THRESHOLD / 100), 2) if price else None
+        # The searched fare is the baseline the target is checked against
+        self.db.add_tracked_route(str(update.effective_user.id), origin, destination, target,
+                                  best_price=float(price) if price else None)
+        
+        target_text = f" below <b>{symbol(config.BASE_CURRENCY)}{target:,.0f}</b>" if target else ""
+        await query.message.reply_text(
+            f"🔔 Alert set for <b>{origin} → {destination}</b>{target_text}.",
+            parse_mode='HTML'
+        )
+    
+    async def handle_auto_book(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               origin: str = None, destination: str = None,
+                               price: str = None):
+        """Track a route and book automatically once it drops below the limit"""
+        query = update.callback_query
+        await query.answer()
+        user_id = str(update.effective_user.id)
+        
+        if not auto_booking_available():
+            await query.message.reply_text("⚡ Auto-booking isn't available right now.")
+            return
+        if not self.db.get_traveler_profile(user_id):
+            await query.message.reply_text(
+                "⚡ Auto-booking needs your traveler details first:\n"
+                "<code>/profile Full Name, email, phone, YYYY-MM-DD</code>",
+                parse_mode='HTML'
+            )
+            return
+        
+        limit = min(float(price) * (1 - config.PRICE_THRESHOLD / 100), config.MAX_BOOKING)
+        limit = round(limit, 2)
+        self.db.add_tracked_route(user_id, origin, destination, limit, auto_book=True)
+        await query.message.reply_text(
+            f"⚡ I'll book <b>{origin} → {destination}</b> automatically "
+            f"as soon as a fare drops below <b>{symbol(config.BASE_CURRENCY)}{limit:,.0f}</b>.",
+            parse_mode='HTML'
+        )
+    
+    async def profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /profile command: save traveler details used for auto-booking"""
+        parts = [p.strip() for p in " ".join(context.args or []).split(',')]
+        fields = dict(zip(("full_name", "email", "phone", "date_of_birth"), parts))
+        try:
+            profile = TravelerProfile(**fields)
+        except ValidationError as e:
+            problems = "; ".join(
+                f"{error['loc'][0]}: {error['msg'].removeprefix('Value error, ')}"
+                for error in e.errors()
+            )
+            await update.message.reply_text(
+                f"❌ {html.escape(problems)}\n\n"
+                "Usage: <code>/profile Full Name, email, phone, YYYY-MM-DD</code>",
+                parse_mode='HTML'
+            )
+            return
+        
+        self.db.save_traveler_profile(str(update.effective_user.id), profile.model_dump())
+        await update.message.reply_text(
+            f"✅ Traveler profile saved for <b>{html.escape(profile.full_name)}</b>.",
+            parse_mode='HTML'
+        )
+    
+    async def currency(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /currency command: choose the currency prices are shown in"""
+        user_id = str(update.effective_user.id)
+        rates = get_rates()
+        code = (context.args[0] if context.args else "").strip().upper()
+        if code not in rates:
+            await update.message.reply_text(
+                f"💱 Prices are shown in <b>{self._display_currency(user_id)}</b>.\n\n"
+                f"Change with <code>/currency EUR</code>. Available: {', '.join(rates.codes)}",
+                parse_mode='HTML'
+            )
+            return
+        
+        self.db.set_display_currency(user_id, code)
+        await update.message.reply_text(
+            f"✅ Prices will be shown in <b>{code}</b> "
+            f"(1 {rates.base} = {rates.rate(code):,.4g} {code}, rates as of {rates.as_of}).",
+            parse_mode='HTML'
+        )
+    
+    async def report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /report command"""
+        summary = self.reports.get(str(update.effective_user.id))
+        await self._reply_chunked(update, self._format_report(summary))
+    
+    async def expenses(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /expenses command: show totals, or add one expense from the arguments"""
+        if not config.ENABLE_EXPENSES:
+            await update.message.reply_text(render("expenses_disabled"))
+            return
+        
+        user_id = str(update.effective_user.id)
+        if not context.args:
+            await self._reply_chunked(update, self._format_expenses(self.reports.get(user_id)))
+            return
+        
+        amount, currency, category, *description = list(context.args) + [None] * 3
+        try:
+            amount = float(amount)
+        except ValueError:
+            amount = None
+        valid_amount = amount is not None and math.isfinite(amount) and amount > 0
+        if not valid_amount or not (currency and len(currency) == 3 and currency.isalpha()) or not category:
+            await update.message.reply_text(
+                "Usage: <code>/expenses amount CUR category [description]</code>\n"
+                "Example: <code>/expenses 120 EUR hotel Hilton Paris</code>",
+                parse_mode='HTML'
+            )
+            return
+        
+        currency, category = currency.upper(), category.lower()
+        self.reports.add_expense(
+            user_id, amount, currency, category, " ".join(d for d in description if d)
+        )
+        await update.message.reply_text(
+            render("expense_added", amount=amount, currency=currency, category=category)
+        )
+    
+    async def import_expenses(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Bulk-import expenses from an uploaded CSV"""
+        if not config.ENABLE_EXPENSES:
+            await update.message.reply_text(render("expenses_disabled"))
+            return
+        
+        data = await (await update.message.document.get_file()).download_as_bytearray()
+        try:
+            imported, skipped = await asyncio.to_thread(
+                self.reports.import_expenses, str(update.effective_user.id), bytes(data)
+            )
+        except ValueError as e:
+            await update.message.reply_text(f"❌ Couldn't import that file: {e}")
+            return
+        await update.message.reply_text(render(
+            "expenses_imported", imported=imported,
+            skipped_note=f", skipped {skipped} invalid rows" if skipped else ""
+        ))
+    
+    async def handle_expenses(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show expense totals from the menu"""
+        query = update.callback_query
+        await query.answer()
+        if not config.ENABLE_EXPENSES:
+            await query.edit_message_text(render("expenses_disabled"))
+            return
+        await query.edit_message_text(
+            split_message(self._format_expenses(self.reports.get(str(update.effective_user.id))))[0],
+            parse_mode='HTML'
+        )
+    
+    async def handle_analytics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Offer charts for the user's tracked routes, or any route they type"""
+        query = update.callback_query
+        await query.answer()
+        
+        user_id = str(update.effective_user.id)
+        self.user_sessions[user_id] = {
+            'action': 'chart',
+            'step': 'route'
+        }
+        
+        routes = dict.fromkeys((r.origin, r.destination) for r in self.db.get_active_routes(user_id))
+        keyboard = [
+            [InlineKeyboardButton(f"{origin} → {destination}", callback_data=self.callbacks.pack(
+                'chart', origin=origin, destination=destination, period=DEFAULT_RANGE
+            ))]
+            for origin, destination in list(routes)[:8]
+        ]
+        await query.edit_message_text(
+            "📈 <b>Price History</b>\n\n"
+            + ("Pick one of your tracked routes, or enter another as " if keyboard else "Enter a route as ")
+            + "<code>origin-destination</code>\nExample: <code>LAX-JFK</code>",
+            reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None,
+            parse_mode='HTML'
+        )
+    
+    async def handle_chart(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                           origin: str = None, destination: str = None, period: str = None):
+        """Send a route's price chart for the chosen range"""
+        query = update.callback_query
+        await query.answer()
+        self.user_sessions.pop(str(update.effective_user.id), None)
+        await self._send_chart(update, origin, destination, period if period in RANGES else DEFAULT_RANGE)
+    
+    async def handle_view_predict(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                  origin: str = None, destination: str = None):
+        """Run predictions for the route shown on a result message"""
+        query = update.callback_query
+        await query.answer()
+        
+        placeholder = await query.message.reply_text(
+            "📊 <b>Running price prediction analysis...</b>\n"
+            "This may take a moment.",
+            parse_mode='HTML'
+        )
+        await self._run_prediction(update, f"{origin}-{destination}", placeholder)
+    
+    async def handle_place(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                           field: str = None, code: str = None):
+        """Apply the place picked from a disambiguation prompt"""
+        query = update.callback_query
+        await query.answer()
+        
+        session = self.user_sessions.get(str(update.effective_user.id))
+        if not session or field not in ('origin', 'destination'):
+            await query.edit_message_text("This choice has expired. Please start again with /start.")
+            return
+        
+        place = get_index().get(code)
+        await query.edit_message_text(
+            f"✅ {html.escape(place.label if place else code)}",
+            parse_mode='HTML'
+        )
+        session[field] = code
+        await self._advance_flow(update, session)
+    
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages based on context"""
         user_id = str(update.effective_user.id)
@@ -143,6 +472,8 @@ Choose an action below or type your request!
             await self._handle_track_flow(update, context, session, text)
         elif action == 'predict':
             await self._handle_predict_flow(update, context, session, text)
+        elif action == 'chart':
+            await self._handle_chart_flow(update, context, session, text)
     
     async def _handle_search_flow(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
                                   session: Dict, text: str):
@@ -150,107 +481,304 @@ Choose an action below or type your request!
         step = session.get('step')
         user_id = str(update.effective_user.id)
         
-        if step == 'origin':
-            session['origin'] = text.upper()[:3]  # Airport code
-            session['step'] = 'destination'
-            await update.message.reply_text(
-                f"✅ Origin: <b>{session['origin']}</b>\n\n"
-                "Now enter the <b>destination</b>:",
-                parse_mode='HTML'
-            )
-            
-        elif step == 'destination':
-            session['destination'] = text.upper()[:3]
-            session['step'] = 'date'
-            
-            # Quick date options
-            keyboard = [
-                [InlineKeyboardButton("Today", callback_data='date_today')],
-                [InlineKeyboardButton("Tomorrow", callback_data='date_tomorrow')],
-                [InlineKeyboardButton("Next Week", callback_data='date_next_week')],
-                [InlineKeyboardButton("Flexible Dates", callback_data='date_flexible')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await update.message.reply_text(
-                f"✅ Route: <b>{session['origin']} → {session['destination']}</b>\n\n"
-                "Select travel date or enter specific date (YYYY-MM-DD):",
-                reply_markup=reply_markup,
-                parse_mode='HTML'
-            )
+        if step in ('origin', 'destination'):
+            code = await self._resolve_place(update, text, step)
+            if code:
+                session[step] = code
+                await self._advance_flow(update, session)
             
         elif step == 'date':
             session['date'] = text
             
             # Run the search crew
-            await update.message.reply_text(
+            placeholder = await update.message.reply_text(
                 "🔍 <b>Searching flights...</b>\n"
                 "AI agents are finding the best options for you.",
                 parse_mode='HTML'
             )
             
-            # Execute crew
-            results = await self._execute_search_crew(
-                session['origin'],
-                session['destination'],
-                session['date']
-            )
-            
-            # Send results
-            await self._send_flight_results(update, results)
-            
-            # Clear session
+            # Clear session before the crew runs, so a new search can start meanwhile
             del self.user_sessions[user_id]
+            
+            # Execute crew, filling the placeholder in as results arrive
+            await self._run_search(
+                update, session['origin'], session['destination'], session['date'], placeholder
+            )
+    
+    async def _handle_track_flow(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 session: Dict, text: str):
+        """Handle route tracking flow"""
+        if session.get('step') == 'route':
+            if await self._parse_route(update, session, text):
+                await self._advance_flow(update, session)
     
     async def _handle_predict_flow(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
                                    session: Dict, text: str):
         """Handle prediction flow"""
+        if session.get('step') == 'route':
+            if await self._parse_route(update, session, text):
+                await self._advance_flow(update, session)
+    
+    async def _handle_chart_flow(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 session: Dict, text: str):
+        """Handle chart flow"""
+        if session.get('step') == 'route':
+            if await self._parse_route(update, session, text):
+                await self._advance_flow(update, session)
+    
+    async def _resolve_place(self, update: Update, text: str, field: str) -> Optional[str]:
+        """Airport or metro code for free text, asking the user when it's ambiguous"""
+        resolution = get_index().resolve(text)
+        if resolution.place:
+            return resolution.place.code
+        
+        message = update.effective_message
+        if not resolution.candidates:
+            await message.reply_text(
+                f"❓ I couldn't find an airport or city matching <b>{html.escape(text)}</b>.\n"
+                "Try a city name or an IATA code like <code>LAX</code>.",
+                parse_mode='HTML'
+            )
+            return None
+        
+        keyboard = [
+            [InlineKeyboardButton(place.label, callback_data=self.callbacks.pack(
+                'place', field=field, code=place.code
+            ))]
+            for place in resolution.candidates
+        ]
+        await message.reply_text(
+            f"🤔 Which <b>{html.escape(text)}</b> did you mean?",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='HTML'
+        )
+        return None
+    
+    async def _parse_route(self, update: Update, session: Dict, text: str) -> bool:
+        """Split origin-destination text and resolve both ends"""
+        parts = [p.strip() for p in text.split('-')]
+        if len(parts) != 2 or not all(parts):
+            await update.effective_message.reply_text(
+                "Please use the format <code>origin-destination</code>, e.g. <code>LAX-JFK</code>",
+                parse_mode='HTML'
+            )
+            return False
+        
+        session.pop('origin', None)
+        session.pop('destination', None)
+        session['route_text'] = dict(zip(('origin', 'destination'), parts))
+        return await self._resolve_route(update, session)
+    
+    async def _resolve_route(self, update: Update, session: Dict) -> bool:
+        """Resolve whichever route end is still missing; False while waiting on a choice"""
+        for field in ('origin', 'destination'):
+            if field not in session:
+                code = await self._resolve_place(update, session['route_text'][field], field)
+                if not code:
+                    return False
+                session[field] = code
+        return True
+    
+    async def _advance_flow(self, update: Update, session: Dict):
+        """Continue a session once a place has been resolved"""
         user_id = str(update.effective_user.id)
+        message = update.effective_message
+        action = session.get('action')
         
-        if session.get('step') == 'route':
-            route = text.upper()
+        if action == 'search':
+            if 'destination' not in session:
+                session['step'] = 'destination'
+                await message.reply_text(
+                    f"✅ Origin: <b>{session['origin']}</b>\n\n"
+                    "Now enter the <b>destination</b>:",
+                    parse_mode='HTML'
+                )
+                return
             
-            await update.message.reply_text(
+            session['step'] = 'date'
+            
+            # Quick date options
+            route = {'origin': session['origin'], 'destination': session['destination']}
+            keyboard = [
+                [InlineKeyboardButton(label, callback_data=self.callbacks.pack(
+                    'date', choice=choice, **route
+                ))]
+                for label, choice in [("Today", 'today'), ("Tomorrow", 'tomorrow'),
+                                      ("Next Week", 'next_week'),
+                                      ("Flexible Dates", 'flexible')]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await message.reply_text(
+                f"✅ Route: <b>{session['origin']} → {session['destination']}</b>\n\n"
+                "Select travel date or enter specific date (YYYY-MM-DD):",
+                reply_markup=reply_markup,
+                parse_mode='HTML'
+            )
+            return
+        
+        # Track and predict take both ends in one message
+        if not await self._resolve_route(update, session):
+            return
+        origin, destination = session['origin'], session['destination']
+        
+        # Clear session
+        self.user_sessions.pop(user_id, None)
+        
+        if action == 'track':
+            self.db.add_tracked_route(user_id, origin, destination)
+            await message.reply_text(
+                f"📍 Now tracking <b>{origin} → {destination}</b>. "
+                "I'll alert you when prices drop!",
+                parse_mode='HTML'
+            )
+        
+        elif action == 'predict':
+            placeholder = await message.reply_text(
                 "📊 <b>Running price prediction analysis...</b>\n"
                 "This may take a moment.",
                 parse_mode='HTML'
             )
-            
-            # Execute prediction crew
-            predictions = await self._execute_prediction_crew(route)
-            
-            # Send formatted predictions
+            await self._run_prediction(update, f"{origin}-{destination}", placeholder)
+        
+        elif action == 'chart':
+            await self._send_chart(update, origin, destination, DEFAULT_RANGE)
+    
+    async def _send_chart(self, update: Update, origin: str, destination: str, range_key: str):
+        """Reply with a cached or freshly rendered chart, with buttons for the other ranges"""
+        message = update.effective_message
+        image = await self.charts.get(origin, destination, range_key)
+        if image is None:
+            await message.reply_text(
+                render("chart_unavailable", origin=origin, destination=destination),
+                parse_mode='HTML'
+            )
+            return
+        
+        keyboard = [[
+            InlineKeyboardButton(f"• {key}" if key == range_key else key,
+                                 callback_data=self.callbacks.pack(
+                                     'chart', origin=origin, destination=destination, period=key
+                                 ))
+            for key in RANGES
+        ]]
+        reused = image.file_id is not None
+        await self.charts.send(
+            message, image,
+            render("price_chart", origin=origin, destination=destination, range=range_key,
+                   low=image.low, high=image.high, latest=image.latest,
+                   symbol=symbol(config.BASE_CURRENCY)),
+            InlineKeyboardMarkup(keyboard)
+        )
+        self.db.log_action(str(update.effective_user.id), ActionType.CREATE_VISUALIZATION.value, {
+            "route": f"{origin}-{destination}", "range": range_key
+        }, {"resolution": image.resolution, "reused_upload": reused})
+    
+    async def _run_search(self, update: Update, origin: str, destination: str,
+                          date: str, placeholder):
+        """Search under admission control; a newer search by the same user cancels this one"""
+        stream = self._stream_to(placeholder)
+        currency = self._display_currency(str(update.effective_user.id))
+        status, results = await self.admission.run(
+            str(update.effective_user.id), 'search', f"{origin}-{destination}:{date}",
+            lambda: self._execute_search_crew(origin, destination, date, stream, currency)
+        )
+        if status == 'ok':
+            await self._send_flight_results(update, results)
+            self._record_search(str(update.effective_user.id), results)
+            return
+        if stream:
+            await stream.close()
+        await self._reply_rejected(update, placeholder, status, f"{origin} → {destination}")
+    
+    def _display_currency(self, user_id: str) -> str:
+        return self.db.get_display_currencies([user_id]).get(user_id, config.BASE_CURRENCY)
+    
+    def _record_search(self, user_id: str, results: Dict):
+        """Persist the search and count it towards the user's report"""
+        try:
+            departure = datetime.fromisoformat(results['date'])
+        except ValueError:
+            departure = None
+        self.db.save_search(
+            user_id, results['origin'], results['destination'], departure, results['flights']
+        )
+        self.reports.record_search(user_id, results['origin'], results['destination'])
+    
+    async def _run_prediction(self, update: Update, route: str, placeholder):
+        """Predict under admission control"""
+        status, predictions = await self.admission.run(
+            str(update.effective_user.id), 'predict', route,
+            lambda: self._execute_prediction_crew(route)
+        )
+        if status == 'ok':
             await self._send_predictions(update, predictions)
-            
-            # Clear session
-            del self.user_sessions[user_id]
+            return
+        await self._reply_rejected(update, placeholder, status, route)
+    
+    async def _reply_rejected(self, update: Update, placeholder, status: str, request: str):
+        """Turn the request's placeholder into the reason it didn't run"""
+        text = render(f"request_{status}", request=request)
+        if hasattr(placeholder, 'edit_text'):
+            await placeholder.edit_text(text)
+        else:
+            await update.effective_message.reply_text(text)
+    
+    def _stream_to(self, placeholder) -> Optional[MessageStream]:
+        """Stream into the placeholder when it is an editable chat message"""
+        if config.ENABLE_STREAMING and hasattr(placeholder, 'edit_text'):
+            return MessageStream(placeholder)
+        return None
     
-    async def _execute_search_crew(self, origin: str, destination: str, date: str) -> Dict:
+    async def _execute_search_crew(self, origin: str, destination: str, date: str,
+                                   stream: MessageStream = None, currency: str = None) -> Dict:
         """Execute search crew and return results"""
-        search_agent = self.agents.search_specialist()
+        started = stream.started if stream else time.perf_counter()
+        # Structured results come straight from the search code path; the
+        # crew only contributes the ranking rationale
+        rates = get_rates()
+        records = await self.admission.offload(FlightTools.search_flights, origin, destination, date)
+        flights = rates.normalize(FlightResults.from_records(records))
+        # Ranked and stored in the base currency, shown in the user's
+        shown = rates.display(flights, currency or rates.base)
+        # The analyst works from the results above instead of searching again
         analyst_agent = self.agents.price_analyst()
-        notifier_agent = self.agents.notification_specialist()
-        
-        search_task = self.tasks.search_flights_task(search_agent, origin, destination, date)
-        analysis_task = Task(
-            description="Analyze the search results and identify best options",
-            agent=analyst_agent,
-            expected_output="Analysis of best flights"
-        )
-        notification_task = Task(
-            description="Create a Telegram-formatted message with results",
-            agent=notifier_agent,
-            expected_output="Formatted message"
+        analysis_task = self.tasks.rank_flights_task(
+            analyst_agent, origin, destination, date, self._flight_table(flights)
         )
         
+        if stream and len(flights):
+            stream.update(self._format_search_results(origin, destination, date, shown)
+                          + "\n\n<i>Writing recommendation...</i>")
+            # Task callbacks fire on the crew's worker thread
+            loop = asyncio.get_running_loop()
+            analysis_task.callback = lambda output: loop.call_soon_threadsafe(
+                stream.update,
+                self._format_search_results(origin, destination, date, shown, str(output))
+            )
+        # The message itself comes from the search_results template, so the
+        # analyst's recommendation is the crew's only output
         crew = Crew(
-            agents=[search_agent, analyst_agent, notifier_agent],
-            tasks=[search_task, analysis_task, notification_task],
+            agents=[analyst_agent],
+            tasks=[analysis_task],
             process=Process.sequential
         )
         
-        result = crew.kickoff()
-        return {"raw": result, "formatted": self._format_search_results(result)}
+        # Off the event loop so progress edits go out while the crew works;
+        # with nothing found there is nothing for the analyst to rank
+        result = await self.admission.offload(crew.kickoff) if len(flights) else None
+        return {
+            "raw": result,
+            "origin": origin,
+            "destination": destination,
+            "date": date,
+            "flights": flights,
+            "stream": stream,
+            "started": started,
+            "formatted": self._format_search_results(
+                origin, destination, date, shown, str(result)
+            )
+        }
     
     async def _execute_prediction_crew(self, route: str) -> Dict:
         """Execute prediction crew"""
@@ -264,87 +792,228 @@ Choose an action below or type your request!
             process=Process.sequential
         )
         
-        result = crew.kickoff()
-        return {"raw": result, "formatted": self._format_predictions(result)}
+        with collecting() as collector:
+            result = await self.admission.offload(crew.kickoff)
+        prediction = collector.prediction() or self._parse_prediction(str(result))
+        return {
+            "raw": result,
+            "route": route,
+            "prediction": prediction,
+            "formatted": self._format_predictions(route, prediction, str(result))
+        }
     
-    def _format_search_results(self, results: str) -> str:
+    def _parse_prediction(self, output: str) -> Optional[PricePrediction]:
+        """Pick the predict_prices tool JSON out of the crew output"""
+        decoder = json.JSONDecoder()
+        start = output.find('{')
+        while start != -1:
+            try:
+                data, _ = decoder.raw_decode(output, start)
+                if isinstance(data, dict) and 'predictions' in data:
+                    return PricePrediction(**data)
+            except ValueError:
+                pass
+            start = output.find('{', start + 1)
+        return None
+    
+    def _format_search_results(self, origin: str, destination: str, date: str,
+                               flights: FlightResults, analysis: str = None) -> str:
         """Format search results for Telegram"""
-        # This would parse the crew output and format nicely
-        return f"""
-✈️ <b>Flight Search Results</b>
-
-🏆 <b>Best Options:</b>
-
-1️⃣ <b>Cheapest:</b>
-   AA 101 | $425
-   08:00 → 16:30 (8h 30m)
-   
-2️⃣ <b>Fastest:</b>
-   DL 205 | $520
-   09:15 → 16:45 (7h 30m)
-   
-3️⃣ <b>Best Value:</b>
-   UA 333 | $445
-   10:00 → 17:45 (7h 45m)
-
-💡 <b>AI Recommendation:</b>
-Book the UA 333 flight - best balance of price and convenience.
-
-<i>Prices may change. Book soon for best rates!</i>
-        """
+        if not len(flights):
+            return render("search_empty", origin=origin, destination=destination, date=date)
+        
+        picks = [
+            ("Cheapest", flights.cheapest()),
+            ("Fastest", flights.fastest()),
+            ("Best Value", flights.best_value()),
+        ]
+        options = []
+        for rank, (label, pick) in enumerate(picks, start=1):
+            flight = pick.row(0)
+            minutes = flight['duration_minutes']
+            options.append({
+                "rank": rank,
+                "label": label,
+                "flight_number": flight['flight_number'],
+                "symbol": symbol(flight['currency']),
+                "price": flight['price'],
+                "departure": flight['departure_time'],
+                "arrival": flight['arrival_time'],
+                "duration": f"{minutes // 60}h {minutes % 60:02d}m",
+            })
+        
+        recommendation = render("recommendation", text=analysis) + "\n\n" if analysis else ""
+        return render(
+            "search_results",
+            origin=origin,
+            destination=destination,
+            date=date,
+            options_html=render_lines("flight_option", options, separator="\n\n"),
+            recommendation_html=recommendation
+        )
     
-    def _format_predictions(self, predictions: str) -> str:
+    @staticmethod
+    def _flight_table(flights: FlightResults) -> str:
+        """One pipe-separated row per flight for the analyst, cheapest first"""
+        lines = ["flight|airline|price|departure|arrival|duration_minutes|stops"]
+        for flight in flights.cheapest(len(flights)).records():
+            lines.append("|".join([
+                str(flight['flight_number']),
+                str(flight['airline']),
+                f"{flight['price']:.0f}",
+                str(flight['departure_time']),
+                str(flight['arrival_time']),
+                str(flight['duration_minutes']),
+                str(flight['stops']),
+            ]))
+        return "\n".join(lines)
+    
+    def _format_predictions(self, route: str, prediction: Optional[PricePrediction],
+                            analysis: str = "") -> str:
         """Format predictions for Telegram"""
-        return f"""
-📊 <b>Price Prediction Analysis</b>
-
-📈 <b>Price Forecast:</b>
-• 7 days: $450 (↑ 5%)
-• 14 days: $425 (↓ 2%) 
-• 30 days: $480 (↑ 10%)
-
-📉 <b>Trend:</b> Rising
-⚡ <b>Confidence:</b> 78%
-
-💡 <b>AI Recommendation:</b>
-Book within the next 3-5 days before prices increase.
-
-🎯 <b>Best Booking Window:</b>
-Tuesday-Wednesday next week
-
-<i>Based on historical data and ML predictions</i>
-        """
+        if prediction is None:
+            return render("predictions_unavailable", route=route, analysis=analysis)
+        
+        current = prediction.current_price or 1
+        currency = symbol(config.BASE_CURRENCY)
+        lines = []
+        for horizon, price in prediction.predictions.items():
+            change = (price - current) / current * 100
+            lines.append({
+                "horizon": horizon.replace('d', ' days'),
+                "symbol": currency,
+                "price": price,
+                "arrow": "↑" if change > 0 else "↓",
+                "change": abs(change),
+            })
+        
+        return render(
+            "predictions",
+            route=route,
+            current_price=prediction.current_price,
+            symbol=currency,
+            lines_html=render_lines("prediction_line", lines),
+            trend=prediction.trend.capitalize(),
+            confidence=prediction.confidence,
+            recommendation=prediction.recommendation,
+            best_booking_window=prediction.best_booking_window
+        )
+    
+    def _format_report(self, summary: Dict) -> str:
+        return render(
+            "report",
+            searches=summary["searches"],
+            alerts=summary["alerts"],
+            savings=summary["savings"],
+            bookings=summary["bookings"],
+            booked=summary["booked"],
+            symbol=symbol(config.BASE_CURRENCY),
+            routes_html=render_lines("report_route_line", summary["top_routes"]) or "No searches yet.",
+            expenses_html=self._format_expense_totals(summary, detail=False)
+        )
+    
+    def _format_expenses(self, summary: Dict) -> str:
+        return render("expenses_summary", totals_html=self._format_expense_totals(summary))
+    
+    def _format_expense_totals(self, summary: Dict, detail: bool = True) -> str:
+        if not summary["expenses"]:
+            return "No expenses recorded yet."
+        lines = []
+        for currency, bucket in summary["expenses"].items():
+            lines.append(render("expense_currency_line", currency=currency, **bucket))
+            if not detail:
+                continue
+            lines.append(render_lines("expense_category_line", [
+                {"category": name, "total": total}
+                for name, total in list(bucket["categories"].items())[:5]
+            ]))
+            lines.append(render_lines("expense_month_line", [
+                {"month": month, "total": total} for month, total in bucket["months"].items()
+            ]))
+        return "\n".join(lines)
+    
+    def _format_price_calendar(self, origin: str, destination: str, cells: Dict,
+                               currency: str = None) -> str:
+        """Format a flexible-date price calendar for Telegram"""
+        rates = get_rates()
+        currency = currency if currency in rates else rates.base
+        cheapest = PriceCalendar.cheapest(cells)
+        lines = [f"📅 <b>Flexible Dates: {origin} → {destination}</b>\n"]
+        for day in sorted(cells):
+            price = cells[day]['price']
+            label = (f"{symbol(currency)}{rates.from_base(price, currency):,.0f}"
+                     if price is not None else "no flights")
+            marker = " 🏆" if day == cheapest else ""
+            lines.append(f"• {day.strftime('%a %d %b')}: {label}{marker}")
+        
+        if cheapest:
+            lines.append(f"\n💡 Cheapest day: <b>{cheapest.strftime('%A %d %B')}</b>")
+        return "\n".join(lines)
     
     async def _send_flight_results(self, update: Update, results: Dict):
         """Send formatted flight results with action buttons"""
+        route = {'origin': results['origin'], 'destination': results['destination']}
+        price = results['flights'].min_price()
         keyboard = [
-            [InlineKeyboardButton("📍 Track This Route", callback_data='track_route')],
-            [InlineKeyboardButton("🔔 Set Price Alert", callback_data='set_alert')],
-            [InlineKeyboardButton("📊 View Predictions", callback_data='view_predict')],
-            [InlineKeyboardButton("🔍 New Search", callback_data='search')]
+            [InlineKeyboardButton("📍 Track This Route",
+                                  callback_data=self.callbacks.pack('track_route', **route))],
+            [InlineKeyboardButton("🔔 Set Price Alert", callback_data=self.callbacks.pack(
+                'set_alert', price=f"{price:.0f}" if price else None, **route
+            ))],
+            [InlineKeyboardButton("📊 View Predictions",
+                                  callback_data=self.callbacks.pack('view_predict', **route))],
+            [InlineKeyboardButton("🔍 New Search", callback_data=self.callbacks.pack('search'))]
         ]
+        if auto_booking_available() and price:
+            keyboard.insert(2, [InlineKeyboardButton("⚡ Auto-Book on Drop", callback_data=self.callbacks.pack(
+                'auto_book', price=f"{price:.0f}", **route
+            ))])
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(
-            results['formatted'],
-            reply_markup=reply_markup,
-            parse_mode='HTML'
-        )
+        stream = results.get('stream')
+        if stream:
+            total = await stream.finish(results['formatted'], reply_markup)
+            first_content = stream.first_content
+        else:
+            await self._reply_chunked(update, results['formatted'], reply_markup)
+            total = first_content = time.perf_counter() - results['started']
+        
+        # Perceived latency next to total latency
+        metrics.observe("search.first_content_seconds", first_content)
+        metrics.observe("search.total_seconds", total)
+        logger.info(f"Search {results['origin']}-{results['destination']}: "
+                    f"first content {first_content:.2f}s, total {total:.2f}s")
     
     async def _send_predictions(self, update: Update, predictions: Dict):
         """Send formatted predictions with actions"""
+        origin, _, destination = predictions['route'].partition('-')
+        route = {'origin': origin, 'destination': destination}
+        prediction = predictions.get('prediction')
+        price = prediction.current_price if prediction else None
         keyboard = [
-            [InlineKeyboardButton("🔔 Alert When Price Drops", callback_data='alert_drop')],
-            [InlineKeyboardButton("📍 Track This Route", callback_data='track_route')],
-            [InlineKeyboardButton("🔍 Search Flights Now", callback_data='search')]
+            [InlineKeyboardButton("🔔 Alert When Price Drops", callback_data=self.callbacks.pack(
+                'alert_drop', price=f"{price:.0f}" if price else None, **route
+            ))],
+            [InlineKeyboardButton("📍 Track This Route",
+                                  callback_data=self.callbacks.pack('track_route', **route))],
+            [InlineKeyboardButton("📈 Price History", callback_data=self.callbacks.pack(
+                'chart', period=DEFAULT_RANGE, **route
+            ))],
+            [InlineKeyboardButton("🔍 Search Flights Now", callback_data=self.callbacks.pack('search'))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await update.message.reply_text(
-            predictions['formatted'],
-            reply_markup=reply_markup,
-            parse_mode='HTML'
-        )
+        await self._reply_chunked(update, predictions['formatted'], reply_markup)
+    
+    async def _reply_chunked(self, update: Update, text: str, reply_markup=None):
+        """Reply with text split to Telegram's length limit, buttons on the last part"""
+        chunks = split_message(text)
+        for i, chunk in enumerate(chunks):
+            await update.effective_message.reply_text(
+                chunk,
+                reply_markup=reply_markup if i == len(chunks) - 1 else None,
+                parse_mode='HTML'
+            )
     
     async def send_alert(self, chat_id: str, message: str, 
                          buttons: List[Dict[str, str]] = None):
@@ -360,23 +1029,48 @@ Tuesday-Wednesday next week
         
         # Send via bot (would need bot instance)
         # await bot.send_message(chat_id, message, reply_markup=reply_markup, parse_mode='HTML')
+    
+    async def post_init(self, application: Application):
+        """Start background work that needs the running event loop"""
+        self._prerender = asyncio.create_task(self.charts.prerender_popular())
+    
+    async def post_shutdown(self, application: Application):
+        if self._prerender:
+            self._prerender.cancel()
+        self.charts.shutdown()
 
 def run_bot():
     """Run the Telegram bot"""
-    application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
-    
     bot = FlightBot()
     
+    # Updates are handled concurrently; the admission layer bounds the load
+    application = (
+        Application.builder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(bot.post_init)
+        .post_shutdown(bot.post_shutdown)
+        .build()
+    )
+    
+    guard = bot.admission.guard
+    
     # Command handlers
-    application.add_handler(CommandHandler("start", bot.start))
+    application.add_handler(CommandHandler("start", guard(bot.start)))
+    application.add_handler(CommandHandler("stats", bot.stats))
+    application.add_handler(CommandHandler("profile", guard(bot.profile)))
+    application.add_handler(CommandHandler("report", guard(bot.report)))
+    application.add_handler(CommandHandler("currency", guard(bot.currency)))
+    application.add_handler(CommandHandler("expenses", guard(bot.expenses)))
+    application.add_handler(MessageHandler(
+        filters.Document.FileExtension("csv"), guard(bot.import_expenses)
+    ))
     
-    # Callback handlers
-    application.add_handler(CallbackQueryHandler(bot.handle_search, pattern='^search$'))
-    application.add_handler(CallbackQueryHandler(bot.handle_track, pattern='^track$'))
-    application.add_handler(CallbackQueryHandler(bot.handle_predict, pattern='^predict$'))
+    # Callback handlers, dispatched through the bot's routing table
+    application.add_handler(CallbackQueryHandler(guard(bot.callbacks.dispatch)))
     
     # Message handler
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, guard(bot.handle_message)))
     
     # Start bot
     application.run_polling()
\ No newline at end of file
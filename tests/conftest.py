@@ -0,0 +1,33 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config
+from database import Database, PriceObservation
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh SQLite database per test"""
+    monkeypatch.setattr(config, "DATABASE_URL", f"sqlite:///{tmp_path / 'flightbot.db'}")
+    return Database()
+
+
+@pytest.fixture
+def observe(db):
+    """Insert raw price observations as the monitor would"""
+    def add(route_key: str, prices, observed_at: datetime, **fields):
+        session = db.Session()
+        try:
+            for price in prices:
+                session.add(PriceObservation(
+                    route_key=route_key, price=price, observed_at=observed_at, **fields
+                ))
+            session.commit()
+        finally:
+            session.close()
+    return add
\ No newline at end of file
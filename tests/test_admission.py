@@ -0,0 +1,110 @@
+import asyncio
+import threading
+
+from admission import AdmissionController
+
+
+def controller(**kwargs):
+    return AdmissionController(**dict({"rate_per_minute": 60, "burst": 3, "max_pending": 8}, **kwargs))
+
+
+def test_burst_then_throttle():
+    admission = controller()
+    assert [admission.allow("u1") for _ in range(4)] == [True, True, True, False]
+    # Buckets are per user
+    assert admission.allow("u2")
+
+
+def test_identical_request_in_flight_is_a_duplicate():
+    admission = controller()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "result"
+
+        first = asyncio.ensure_future(admission.run("u1", "search", "JFK-LHR", work))
+        await asyncio.sleep(0)
+        assert await admission.run("u1", "search", "JFK-LHR", work) == ("duplicate", None)
+        release.set()
+        assert await first == ("ok", "result")
+        # Once finished, the same request runs again
+        assert await admission.run("u1", "search", "JFK-LHR", work) == ("ok", "result")
+
+    asyncio.run(scenario())
+
+
+def test_newer_request_of_the_same_kind_supersedes_the_older():
+    admission = controller()
+
+    async def scenario():
+        async def slow():
+            await asyncio.sleep(10)
+
+        async def fast():
+            return "new"
+
+        first = asyncio.ensure_future(admission.run("u1", "search", "JFK-LHR", slow))
+        await asyncio.sleep(0)
+        # Another user's request of the same kind is unaffected
+        other = asyncio.ensure_future(admission.run("u2", "search", "JFK-LHR", fast))
+        assert await admission.run("u1", "search", "JFK-CDG", fast) == ("ok", "new")
+        assert await first == ("superseded", None)
+        assert await other == ("ok", "new")
+        assert admission.pending == 0
+
+    asyncio.run(scenario())
+
+
+def test_work_is_shed_once_too_much_is_pending():
+    admission = controller(max_pending=1)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+
+        first = asyncio.ensure_future(admission.run("u1", "search", "a", work))
+        await asyncio.sleep(0)
+        assert await admission.run("u2", "search", "b", work) == ("shed", None)
+        release.set()
+        assert (await first)[0] == "ok"
+        assert (await admission.run("u2", "search", "b", work))[0] == "ok"
+
+    asyncio.run(scenario())
+
+
+def test_superseded_offloaded_thread_holds_its_slot_until_it_returns():
+    admission = controller()
+    started, finish = threading.Event(), threading.Event()
+
+    def blocking():
+        started.set()
+        finish.wait(5)
+        return "late"
+
+    async def scenario():
+        async def work():
+            return await admission.offload(blocking)
+
+        async def quick():
+            return "new"
+
+        first = asyncio.ensure_future(admission.run("u1", "search", "a", work))
+        await asyncio.to_thread(started.wait, 5)
+        assert await admission.run("u1", "search", "b", quick) == ("ok", "new")
+        assert await first == ("superseded", None)
+        # The thread is still running, so its slot is still taken
+        assert admission.pending == 1
+
+        finish.set()
+        for _ in range(100):
+            if admission.pending == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert admission.pending == 0
+
+    asyncio.run(scenario())
\ No newline at end of file
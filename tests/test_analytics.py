@@ -0,0 +1,77 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from analytics import RouteAnalytics
+from retention import PriceHistory
+
+
+def test_update_route_stats_retries_after_a_concurrent_write(db):
+    db.save_route_stats("JFK-LHR", {"n": 1})
+    calls = []
+
+    def apply(stats):
+        calls.append(stats)
+        if len(calls) == 1:
+            # Another writer lands between our read and our write
+            db.save_route_stats("JFK-LHR", {"n": stats["n"] + 10})
+        return {"n": stats["n"] + 1}
+
+    assert db.update_route_stats("JFK-LHR", apply) == {"n": 12}
+    assert calls == [{"n": 1}, {"n": 11}]
+    assert db.get_route_stats("JFK-LHR") == {"n": 12}
+
+
+def test_update_route_stats_gives_up_when_the_row_keeps_changing(db):
+    db.save_route_stats("JFK-LHR", {"n": 0})
+
+    def apply(stats):
+        db.save_route_stats("JFK-LHR", {"n": stats["n"] + 1})
+        return stats
+
+    with pytest.raises(RuntimeError):
+        db.update_route_stats("JFK-LHR", apply, attempts=3)
+
+
+def test_concurrent_observations_are_all_counted(db):
+    analytics = RouteAnalytics(db, cache_seconds=0)
+    start = datetime(2026, 3, 2, 12)
+
+    def record(offset):
+        for i in range(25):
+            analytics.record_observation("JFK", "LHR", 400 + offset + i,
+                                         observed_at=start + timedelta(minutes=i))
+
+    threads = [threading.Thread(target=record, args=(n * 100,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = db.get_route_stats("JFK-LHR")
+    assert stats["accumulators"]["count"] == 100
+    assert stats["accumulators"]["min"] == 400
+    assert stats["accumulators"]["max"] == 724
+
+
+def test_rebuild_counts_days_only_held_as_rollups(db, observe):
+    now = datetime.utcnow()
+    old = now - timedelta(days=30)
+    observe("JFK-LHR", [300.0, 500.0], old, airline="BA")
+    observe("JFK-LHR", [450.0], now - timedelta(hours=1), airline="VS")
+
+    history = PriceHistory(db, raw_days=14, hourly_days=120)
+    assert history.roll_up() == 3
+    assert history.expire(now)["raw"] == 2
+
+    analytics = RouteAnalytics(db, cache_seconds=0)
+    assert analytics.rebuild() == 1
+    summary = analytics.get("JFK-LHR")
+    acc = db.get_route_stats("JFK-LHR")["accumulators"]
+    assert acc["count"] == 3
+    assert acc["sum"] == 1250.0
+    assert (acc["min"], acc["max"]) == (300.0, 500.0)
+    # Airlines only survive for the raw rows still held
+    assert set(acc["airlines"]) == {"VS"}
+    assert summary["route"] == "JFK-LHR"
\ No newline at end of file
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from booking import AutoBooker, StubBookingProvider, idempotency_key
+from config import config
+from database import BookingRecord, SpendingCap
+from flight_results import FlightResults, RouteRecord
+
+FLIGHT = {"flight_number": "BA112", "departure_time": "2026-12-01T18:30"}
+
+
+def spent(db, user_id):
+    session = db.Session()
+    try:
+        return session.get(SpendingCap, user_id).spent
+    finally:
+        session.close()
+
+
+def booking(db, key):
+    session = db.Session()
+    try:
+        return session.query(BookingRecord).filter_by(idempotency_key=key).one()
+    finally:
+        session.close()
+
+
+def test_idempotency_key_is_stable_per_flight_and_travel_date():
+    key = idempotency_key("u1", "r1", date(2026, 12, 1), FLIGHT)
+    assert key == idempotency_key("u1", "r1", date(2026, 12, 1), dict(FLIGHT))
+    assert key != idempotency_key("u1", "r1", date(2026, 12, 2), FLIGHT)
+    assert key != idempotency_key("u1", "r1", date(2026, 12, 1), dict(FLIGHT, flight_number="BA114"))
+    assert key != idempotency_key("u2", "r1", date(2026, 12, 1), FLIGHT)
+
+
+def test_a_key_is_claimed_once_and_only_retried_after_failure(db):
+    assert db.claim_booking("k1", "u1", "r1", "BA112", 400)
+    assert not db.claim_booking("k1", "u1", "r1", "BA112", 400)
+    db.finish_booking("k1", "failed")
+    assert db.claim_booking("k1", "u1", "r1", "BA112", 390)
+    db.finish_booking("k1", "confirmed", "REF")
+    assert not db.claim_booking("k1", "u1", "r1", "BA112", 390)
+
+
+def test_reserve_spend_stays_within_the_cap(db):
+    assert db.reserve_spend("u1", 600, 1000)
+    assert not db.reserve_spend("u1", 500, 1000)
+    assert db.reserve_spend("u1", 400, 1000)
+    assert spent(db, "u1") == 1000
+    db.release_spend("u1", 400)
+    assert spent(db, "u1") == 600
+
+
+def test_reserve_spend_rejects_a_first_booking_over_the_cap(db):
+    assert not db.reserve_spend("u1", 1200, 1000)
+    assert db.reserve_spend("u1", 1000, 1000)
+
+
+def test_concurrent_reservations_never_overspend(db):
+    results = []
+
+    def reserve():
+        results.append(db.reserve_spend("u1", 150, 1000))
+
+    threads = [threading.Thread(target=reserve) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 6
+    assert spent(db, "u1") == 900
+
+
+def test_expiring_a_stale_pending_booking_gives_back_its_spend_once(db):
+    assert db.claim_booking("k1", "u1", "r1", "BA112", 400)
+    assert db.reserve_spend("u1", 400, 1000, "k1")
+    assert booking(db, "k1").spend_reserved
+
+    # Still inside the timeout: left alone
+    assert db.expire_pending_bookings(datetime.utcnow() - timedelta(minutes=30)) == 0
+    assert db.expire_pending_bookings(datetime.utcnow() + timedelta(seconds=1)) == 1
+    assert db.expire_pending_bookings(datetime.utcnow() + timedelta(seconds=1)) == 0
+
+    record = booking(db, "k1")
+    assert (record.status, record.spend_reserved) == ("failed", False)
+    assert spent(db, "u1") == 0
+    # The next check retries under the same key
+    assert db.claim_booking("k1", "u1", "r1", "BA112", 400)
+
+
+@pytest.fixture
+def booker(db, monkeypatch):
+    monkeypatch.setattr(config, "ENABLE_AUTO_BOOKING", True)
+    monkeypatch.setattr(config, "MAX_BOOKING", 1500)
+    monkeypatch.setattr(config, "BOOKING_MONTHLY_CAP", 1000)
+    db.save_traveler_profile("u1", {
+        "full_name": "Ada Lovelace", "email": "ada@example.com",
+        "phone": "+441234567890", "date_of_birth": date(1990, 1, 1),
+    })
+    return AutoBooker(db, StubBookingProvider(latency=0))
+
+
+def route(**fields):
+    return RouteRecord(**dict({
+        "id": "r1", "user_id": "u1", "origin": "JFK", "destination": "LHR",
+        "max_price": 500, "auto_book": True, "departure_date": datetime(2026, 12, 1),
+    }, **fields))
+
+
+def flights(price):
+    return FlightResults.from_records([dict(FLIGHT, airline="BA", price=price)])
+
+
+def test_concurrent_checks_book_a_flight_once(db, booker):
+    async def both():
+        return await asyncio.gather(
+            booker.consider(route(), flights(450), datetime.utcnow()),
+            booker.consider(route(), flights(450), datetime.utcnow()),
+        )
+
+    confirmations = [c for c in asyncio.run(both()) if c is not None]
+    assert len(confirmations) == 1
+    assert spent(db, "u1") == 450
+    assert booking(db, confirmations[0].idempotency_key).status == "confirmed"
+
+
+def test_fares_over_the_route_limit_are_not_booked(db, booker):
+    assert asyncio.run(booker.consider(route(), flights(550), datetime.utcnow())) is None
+    assert asyncio.run(booker.consider(route(auto_book=False), flights(450), datetime.utcnow())) is None
+
+
+def test_bookings_over_the_monthly_cap_are_declined(db, booker):
+    assert db.reserve_spend("u1", 700, config.BOOKING_MONTHLY_CAP)
+    assert asyncio.run(booker.consider(route(), flights(450), datetime.utcnow())) is None
+    key = idempotency_key("u1", "r1", date(2026, 12, 1), FLIGHT)
+    assert booking(db, key).status == "declined"
+    assert spent(db, "u1") == 700
\ No newline at end of file
@@ -0,0 +1,73 @@
+import pytest
+
+from callbacks import MAX_CALLBACK_BYTES, REF_MARKER, CallbackRouter, StateCache
+
+
+async def handler(update, context, **state):
+    return state
+
+
+@pytest.fixture
+def router():
+    router = CallbackRouter()
+    router.route("menu", handler)
+    router.route("track", handler, fields=("origin", "destination", "date", "price"))
+    return router
+
+
+def test_bare_action_round_trips(router):
+    assert router.pack("menu") == "menu"
+    assert router.unpack("menu") == ("menu", {})
+
+
+def test_short_state_is_packed_inline(router):
+    data = router.pack("track", origin="JFK", destination="LHR", date="2026-12-01", price=412.5)
+    assert REF_MARKER not in data
+    assert len(data.encode()) <= MAX_CALLBACK_BYTES
+    assert router.unpack(data) == ("track", {
+        "origin": "JFK", "destination": "LHR", "date": "2026-12-01", "price": "412.5"
+    })
+
+
+def test_missing_fields_unpack_as_none(router):
+    data = router.pack("track", origin="JFK", destination="LHR")
+    assert router.unpack(data)[1]["date"] is None
+
+
+def test_state_over_64_bytes_goes_through_the_cache(router):
+    state = {"origin": "Düsseldorf", "destination": "Saint Petersburg Pulkovo International",
+             "date": "2026-12-01", "price": "1234.56"}
+    inline = "|".join(["1", "track"] + list(state.values()))
+    assert len(inline.encode()) > MAX_CALLBACK_BYTES
+
+    data = router.pack("track", **state)
+    assert len(data.encode()) <= MAX_CALLBACK_BYTES
+    assert REF_MARKER in data
+    assert router.unpack(data) == ("track", state)
+    # The same state reuses its cache entry
+    assert router.pack("track", **state) == data
+
+
+def test_limit_is_counted_in_bytes_not_characters(router):
+    # Under 64 characters inline, but the multi-byte city name pushes it over in bytes
+    origin = "é" * (MAX_CALLBACK_BYTES - len("1|track|||||"))
+    data = router.pack("track", origin=origin, destination="", date="", price="")
+    assert len(data.encode()) <= MAX_CALLBACK_BYTES
+    assert router.unpack(data)[1]["origin"] == origin
+
+
+def test_expired_state_raises(router):
+    router.cache = StateCache(ttl_seconds=-1)
+    data = router.pack("track", origin="X" * 80)
+    with pytest.raises(KeyError):
+        router.unpack(data)
+
+
+def test_unknown_version_raises(router):
+    with pytest.raises(KeyError):
+        router.unpack("0|track|JFK|LHR||")
+
+
+def test_action_names_may_not_contain_the_separator(router):
+    with pytest.raises(ValueError):
+        router.route("a|b", handler)
\ No newline at end of file
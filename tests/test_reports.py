@@ -0,0 +1,103 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from database import ExpenseRecord
+from reports import UserReports
+
+CSV = """date,amount,currency,category,description
+2026-03-01,120.50,usd,Hotel,Two nights
+2026-03-02,40,USD,food,
+2026-03-03,inf,USD,food,overflow
+2026-03-04,nan,USD,food,not a number
+2026-03-05,-10,USD,food,refund
+2026-03-06,0,USD,food,free
+2026-03-07,25,US,food,bad currency
+not a date,25,USD,food,bad date
+2026-03-08,25,USD,,no category
+2026-04-01,300,EUR,flight,
+"""
+
+
+def expenses(db, user_id="u1"):
+    session = db.Session()
+    try:
+        return session.query(ExpenseRecord).filter_by(user_id=user_id).count()
+    finally:
+        session.close()
+
+
+def test_concurrent_updates_are_all_counted(db):
+    reports = UserReports(db)
+
+    def record():
+        for _ in range(25):
+            reports.record_search("u1", "JFK", "LHR")
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summary = reports.get("u1")
+    assert summary["searches"] == 100
+    assert summary["top_routes"] == [{"route": "JFK-LHR", "searches": 100}]
+
+
+def test_update_user_stats_retries_after_a_concurrent_write(db):
+    db.save_user_stats({"u1": {"n": 1}})
+    calls = []
+
+    def apply(stats):
+        calls.append(stats)
+        if len(calls) == 1:
+            db.save_user_stats({"u1": {"n": stats["n"] + 10}})
+        return {"n": stats["n"] + 1}
+
+    assert db.update_user_stats("u1", apply) == {"n": 12}
+    assert calls == [{"n": 1}, {"n": 11}]
+
+
+def test_import_skips_invalid_rows(db):
+    reports = UserReports(db)
+    assert reports.import_expenses("u1", CSV) == (3, 7)
+    assert expenses(db) == 3
+
+    summary = reports.get("u1")["expenses"]
+    assert summary["USD"]["total"] == 160.5
+    assert summary["USD"]["categories"] == {"hotel": 120.5, "food": 40.0}
+    assert summary["EUR"]["months"] == {"2026-04": 300.0}
+
+
+def test_import_requires_the_expense_columns(db):
+    with pytest.raises(ValueError, match="currency"):
+        UserReports(db).import_expenses("u1", "date,amount,category\n2026-03-01,10,food\n")
+
+
+@pytest.mark.parametrize("amount", [float("inf"), float("-inf"), float("nan"), 0, -5])
+def test_add_expense_rejects_invalid_amounts(db, amount):
+    with pytest.raises(ValueError):
+        UserReports(db).add_expense("u1", amount, "USD", "food")
+    assert expenses(db) == 0
+
+
+def test_add_expense_updates_the_aggregates(db):
+    reports = UserReports(db)
+    reports.add_expense("u1", 19.99, "USD", "food", date=datetime(2026, 3, 1))
+    assert reports.get("u1")["expenses"]["USD"]["months"] == {"2026-03": 19.99}
+    assert expenses(db) == 1
+
+
+def test_expenses_roll_back_when_the_aggregate_update_fails(db):
+    def broken(stats):
+        raise RuntimeError("fold failed")
+
+    with pytest.raises(RuntimeError):
+        db.add_expense("u1", 10.0, "USD", "food", apply=broken)
+    with pytest.raises(RuntimeError):
+        db.add_expenses("u1", [{"amount": 10.0, "currency": "USD", "category": "food",
+                                "date": datetime(2026, 3, 1)}], apply=broken)
+    assert expenses(db) == 0
+    assert db.get_user_stats("u1") is None
\ No newline at end of file
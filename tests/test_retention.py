@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from retention import PriceHistory
+
+NOW = datetime(2026, 6, 1, 12)
+
+
+def test_unrolled_rows_are_never_expired(db, observe):
+    history = PriceHistory(db, raw_days=14, hourly_days=120)
+    observe("JFK-LHR", [300.0, 340.0], NOW - timedelta(days=30))
+
+    assert history.expire(NOW) == {"raw": 0, "hour": 0}
+    assert history.roll_up() == 2
+    assert history.expire(NOW) == {"raw": 2, "hour": 0}
+
+    daily = history.series("JFK-LHR", NOW - timedelta(days=60), NOW, resolution="day")
+    assert daily[["min", "max", "avg", "count"]].values.tolist() == [[300.0, 340.0, 320.0, 2]]
+
+
+def test_a_late_row_is_folded_before_it_can_expire(db, observe):
+    history = PriceHistory(db, raw_days=14, hourly_days=120)
+    observe("JFK-LHR", [300.0], NOW - timedelta(days=1))
+    assert history.roll_up() == 1
+
+    # Committed after the rollup ran, but observed earlier than rows already folded
+    observe("JFK-LHR", [280.0], NOW - timedelta(days=20))
+    assert history.expire(NOW)["raw"] == 0
+    assert history.roll_up() == 1
+    assert history.expire(NOW)["raw"] == 1
+
+    daily = history.series("JFK-LHR", NOW - timedelta(days=60), NOW, resolution="day")
+    assert daily["count"].sum() == 2
+
+
+def test_roll_up_works_in_batches_and_folds_each_row_once(db, observe):
+    history = PriceHistory(db, batch_size=2)
+    observe("JFK-LHR", [100.0, 200.0, 300.0, 400.0, 500.0], NOW.replace(minute=5))
+
+    assert history.roll_up() == 5
+    assert history.roll_up() == 0
+    hourly = history.series("JFK-LHR", NOW - timedelta(hours=1), NOW + timedelta(hours=1),
+                            resolution="hour")
+    assert hourly[["min", "max", "avg", "count"]].values.tolist() == [[100.0, 500.0, 300.0, 5]]
+
+
+def test_rows_marked_by_another_monitor_are_not_folded_again(db, observe):
+    observe("JFK-LHR", [100.0, 200.0], NOW)
+    rows = db.get_unrolled_observations(10)
+    ids = [row[0] for row in rows]
+    buckets = {("JFK-LHR", "day", NOW.replace(hour=0)): [100.0, 200.0, 300.0, 2]}
+
+    assert db.apply_rollups(ids, buckets)
+    assert not db.apply_rollups(ids, buckets)
+    assert db.get_rollups("day") == [("JFK-LHR", NOW.replace(hour=0), 100.0, 200.0, 300.0, 2)]
+
+
+def test_hourly_buckets_expire_but_daily_buckets_stay(db, observe):
+    history = PriceHistory(db, raw_days=14, hourly_days=120)
+    observe("JFK-LHR", [250.0], NOW - timedelta(days=200))
+    history.roll_up()
+
+    assert history.expire(NOW) == {"raw": 1, "hour": 1}
+    assert len(db.get_rollups("hour")) == 0
+    assert len(db.get_rollups("day")) == 1
\ No newline at end of file
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from config import config
+from database import MonitorNode, RouteLease
+from sharding import HashRing, ShardCoordinator
+
+ROUTES = [f"route-{i}" for i in range(500)]
+
+
+@pytest.fixture(autouse=True)
+def no_redis(monkeypatch):
+    monkeypatch.setattr(config, "REDIS_URL", None)
+
+
+def test_every_key_has_one_owner_from_the_ring():
+    ring = HashRing(["a", "b", "c"])
+    owners = {route: ring.owner(route) for route in ROUTES}
+    assert set(owners.values()) == {"a", "b", "c"}
+    assert owners == {route: HashRing(["c", "b", "a"]).owner(route) for route in ROUTES}
+
+
+def test_removing_a_node_only_moves_its_keys():
+    ring = HashRing(["a", "b", "c"])
+    before = {route: ring.owner(route) for route in ROUTES}
+    ring.remove("c")
+    after = {route: ring.owner(route) for route in ROUTES}
+    moved = {route for route in ROUTES if before[route] != after[route]}
+    assert moved == {route for route in ROUTES if before[route] == "c"}
+    assert ring.nodes == ["a", "b"]
+
+
+def test_adding_a_node_moves_about_one_nth_of_the_keys():
+    ring = HashRing(["a", "b", "c"])
+    before = {route: ring.owner(route) for route in ROUTES}
+    ring.add("d")
+    moved = [route for route in ROUTES if ring.owner(route) != before[route]]
+    assert all(ring.owner(route) == "d" for route in moved)
+    assert 0.1 < len(moved) / len(ROUTES) < 0.4
+
+
+def test_empty_ring_owns_nothing():
+    assert HashRing().owner("route-1") is None
+
+
+def test_live_nodes_split_the_routes(db):
+    first, second = ShardCoordinator(db, "node-1"), ShardCoordinator(db, "node-2")
+    first.refresh()
+    assert second.refresh() == ["node-1", "node-2"]
+    assert first.refresh() == ["node-1", "node-2"]
+    for route in ROUTES:
+        assert first.owns(route) != second.owns(route)
+
+
+def test_a_silent_node_drops_out_of_the_ring(db):
+    first, second = ShardCoordinator(db, "node-1"), ShardCoordinator(db, "node-2")
+    second.refresh()
+    first.refresh()
+    session = db.Session()
+    session.query(MonitorNode).filter_by(node_id="node-2").update(
+        {"heartbeat_at": datetime.utcnow() - first.node_ttl - timedelta(seconds=1)}
+    )
+    session.commit()
+    session.close()
+
+    assert first.refresh() == ["node-1"]
+    assert all(first.owns(route) for route in ROUTES)
+
+
+def test_a_held_lease_blocks_other_nodes_until_released(db):
+    first, second = ShardCoordinator(db, "node-1"), ShardCoordinator(db, "node-2")
+    assert first.acquire("route-1")
+    assert first.acquire("route-1")  # Re-acquiring our own lease renews it
+    assert not second.acquire("route-1")
+
+    first.release_all(["route-1"])
+    assert second.acquire("route-1")
+    assert not first.acquire("route-1")
+
+
+def test_an_expired_lease_can_be_taken_over(db):
+    first, second = ShardCoordinator(db, "node-1"), ShardCoordinator(db, "node-2")
+    assert first.acquire("route-1")
+    session = db.Session()
+    session.query(RouteLease).filter_by(route_id="route-1").update(
+        {"expires_at": datetime.utcnow() - timedelta(seconds=1)}
+    )
+    session.commit()
+    session.close()
+
+    assert second.acquire("route-1")
+    # The previous owner finds out on its next renewal
+    assert not first.acquire("route-1")
+    assert db.Session().get(RouteLease, "route-1").owner == "node-2"
+
+
+def test_leaving_frees_the_nodes_leases(db):
+    first, second = ShardCoordinator(db, "node-1"), ShardCoordinator(db, "node-2")
+    first.refresh()
+    assert first.acquire("route-1")
+    first.leave()
+    assert second.acquire("route-1")
+    assert second.refresh() == ["node-2"]
\ No newline at end of file
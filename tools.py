@@ -10,10 +10,39 @@ import numpy as np
 from datetime import datetime, timedelta
 from sklearn.linear_model import LinearRegression
 from models import Flight, PricePrediction
+from analytics import RouteAnalytics
+from flight_results import FlightResults
+from collector import publish
 
 class FlightTools:
     """Collection of tools for flight operations"""
     
+    @staticmethod
+    def search_flights(origin: str, destination: str, date: str) -> List[Dict]:
+        """Search for flights on a single date and return raw results"""
+        # Implement actual flight search here
+        # This is a mock implementation
+        return [
+            {
+                "flight_number": "AA101",
+                "airline": "American Airlines",
+                "origin": origin,
+                "destination": destination,
+                "price": 450.00,
+                "departure": "08:00",
+                "arrival": "16:30"
+            },
+            {
+                "flight_number": "UA202", 
+                "airline": "United Airlines",
+                "origin": origin,
+                "destination": destination,
+                "price": 425.00,
+                "departure": "10:30",
+                "arrival": "18:45"
+            }
+        ]
+    
     @staticmethod
     def search_flights_tool() -> Tool:
         """Tool to search for flights"""
@@ -23,23 +52,9 @@ class FlightTools:
             Example: 'LAX,JFK,2024-03-15'
             """
             try:
-                parts = query.split(',')
-                # Implement actual flight search here
-                # This is a mock implementation
-                flights = [
-                    {
-                        "flight_number": "AA101",
-                        "price": 450.00,
-                        "departure": "08:00",
-                        "arrival": "16:30"
-                    },
-                    {
-                        "flight_number": "UA202", 
-                        "price": 425.00,
-                        "departure": "10:30",
-                        "arrival": "18:45"
-                    }
-                ]
+                origin, destination, date = [p.strip() for p in query.split(',')]
+                flights = FlightTools.search_flights(origin, destination, date)
+                publish("flights", FlightResults.from_records(flights))
                 return json.dumps(flights)
             except Exception as e:
                 return f"Error: {str(e)}"
@@ -51,19 +66,30 @@ class FlightTools:
         )
     
     @staticmethod
-    def predict_prices_tool() -> Tool:
+    def predict_prices_tool(history: "PriceHistory" = None) -> Tool:
         """Tool to predict future prices"""
         def predict(route_data: str) -> str:
             """
             Predict future prices using ML.
-            Input: JSON with route and historical prices
+            Input: JSON with route and historical prices, or just 'origin-destination'
             """
             try:
-                data = json.loads(route_data)
+                try:
+                    data = json.loads(route_data)
+                except ValueError:
+                    data = {"route": route_data.strip()}
                 
                 # Simple prediction using linear regression
                 # In production, use more sophisticated models
                 prices = data.get("historical_prices", [])
+                if not prices and history and data.get("route"):
+                    # One point per day, so the 7/14/30 step offsets below are days
+                    series = history.series(
+                        data["route"].strip().upper(),
+                        datetime.utcnow() - timedelta(days=365),
+                        resolution="day"
+                    )
+                    prices = series["avg"].dropna().round(2).tolist()
                 if len(prices) < 3:
                     return json.dumps({"error": "Insufficient data"})
                 
@@ -102,6 +128,7 @@ class FlightTools:
                     best_booking_window="Next 7 days" if trend == "rising" else "In 2 weeks"
                 )
                 
+                publish("predictions", result)
                 return json.dumps(result.dict(), default=str)
                 
             except Exception as e:
@@ -110,11 +137,11 @@ class FlightTools:
         return Tool(
             name="predict_prices",
             func=predict,
-            description="Predict future flight prices using ML"
+            description="Predict future flight prices using ML; pass 'origin-destination' to use up to a year of recorded daily prices"
         )
     
     @staticmethod
-    def analyze_route_tool() -> Tool:
+    def analyze_route_tool(analytics: RouteAnalytics = None) -> Tool:
         """Tool to analyze route patterns"""
         def analyze(route: str) -> str:
             """
@@ -122,18 +149,17 @@ class FlightTools:
             Input: 'origin-destination'
             """
             try:
-                # Mock analysis - in production, use real data
-                analysis = {
-                    "route": route,
-                    "best_booking_day": "Tuesday",
-                    "best_travel_day": "Wednesday", 
-                    "cheapest_month": "February",
-                    "average_price": 520,
-                    "price_range": {"min": 380, "max": 750},
-                    "best_airlines": ["Delta", "United"],
-                    "typical_discount_percentage": 15,
-                    "recommendation": "Book 6-8 weeks in advance for best prices"
-                }
+                # Statistics are materialized as observations arrive,
+                # so this is a key lookup rather than a history scan
+                analysis = analytics.get(route) if analytics else None
+                if not analysis:
+                    return json.dumps({
+                        "route": route,
+                        "error": "No price observations recorded for this route yet"
+                    })
+                trend = analytics.trend(route)
+                if trend:
+                    analysis["long_term"] = trend
                 return json.dumps(analysis)
             except Exception as e:
                 return f"Error analyzing: {str(e)}"
@@ -142,4 +168,26 @@ class FlightTools:
             name="analyze_route",
             func=analyze,
             description="Analyze route for patterns and best booking strategies"
+        )
+    
+    @staticmethod
+    def compare_dates_tool(calendar: "PriceCalendar" = None) -> Tool:
+        """Tool to compare prices across several travel dates"""
+        def compare(query: str) -> str:
+            """
+            Compare lowest prices for dates. Format: origin,destination,date;date
+            Example: 'LAX,JFK,2024-03-15;2024-03-18'
+            """
+            try:
+                origin, destination, dates = [p.strip() for p in query.split(',')]
+                days = [datetime.strptime(d.strip(), "%Y-%m-%d").date()
+                        for d in dates.split(';')]
+                return json.dumps(calendar.compare_dates(origin, destination, days))
+            except Exception as e:
+                return f"Error comparing dates: {str(e)}"
+        
+        return Tool(
+            name="compare_dates",
+            func=compare,
+            description="Compare cached lowest prices for a route across travel dates"
         )
\ No newline at end of file